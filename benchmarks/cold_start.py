@@ -0,0 +1,96 @@
+"""
+Compares how long the namepicker command takes to start, run, and exit when
+built with PyOxidizer, against running it with `python -m`
+
+    pyoxidizer build --release
+    python benchmarks/cold_start.py --binary build/*/release/install/namepicker
+
+Each command is run --runs times, with a fresh database each time, so every
+run pays for creating it. If strace is installed, the number of file system
+calls each command makes is counted too.
+"""
+import shutil
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Dict, List, Optional
+
+default_runs = 20
+# Exercises argument parsing, the database, and name generation
+default_commands = {
+    "generate": ["generate", "5", "--seed", "1", "--processes", "1"],
+    "search": ["search", "anything"],
+}
+
+
+def time_runs(program: List[str], command: List[str], runs: int) -> List[float]:
+    seconds = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            database = ["--database", str(Path(directory) / "namepicker.sqlitedb")]
+            start = perf_counter()
+            subprocess.run(
+                program + database + command,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            seconds.append(perf_counter() - start)
+    return seconds
+
+
+def count_file_calls(program: List[str], command: List[str]) -> Optional[int]:
+    """
+    Number of system calls on file names, like open() and stat(), or None
+    without strace
+    """
+    strace = shutil.which("strace")
+    if strace is None:
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        log = Path(directory) / "strace.log"
+        database = ["--database", str(Path(directory) / "namepicker.sqlitedb")]
+        subprocess.run(
+            [strace, "-f", "-e", "trace=%file", "-o", str(log)]
+            + program
+            + database
+            + command,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        return sum(1 for line in log.read_text().splitlines() if "(" in line)
+
+
+def arguments() -> Namespace:
+    parser = ArgumentParser(description="Times how long namepicker takes to start")
+    parser.add_argument(
+        "--binary", type=Path, help="The executable built by 'pyoxidizer build'"
+    )
+    parser.add_argument("--runs", type=int, default=default_runs)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arguments()
+    programs: Dict[str, List[str]] = {
+        "python -m": [sys.executable, "-m", "namepicker.namepicker"]
+    }
+    if args.binary is not None:
+        programs["pyoxidizer"] = [str(args.binary.resolve())]
+
+    print(f"{'program':<12} {'command':<10} {'min ms':>8} {'median ms':>10} files")
+    for program, prefix in programs.items():
+        for name, command in default_commands.items():
+            seconds = time_runs(prefix, command, args.runs)
+            calls = count_file_calls(prefix, command)
+            print(
+                f"{program:<12} {name:<10} {min(seconds) * 1000:>8.1f} "
+                f"{median(seconds) * 1000:>10.1f} {'-' if calls is None else calls}"
+            )
+
+
+if __name__ == "__main__":
+    main()
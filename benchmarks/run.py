@@ -0,0 +1,269 @@
+"""
+Measures the hot paths of namepicker, saves the results as JSON, and compares
+them against an earlier run
+
+    python benchmarks/run.py --output before.json
+    (upgrade, or make a change)
+    python benchmarks/run.py --output after.json --compare before.json
+
+A comparison lists every benchmark that got worse by more than --threshold,
+and exits with status 1 if any did. Database benchmarks run in a fresh
+process for each list size, since Pony can only bind once per process.
+"""
+import json
+import platform
+import sys
+import tempfile
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from namepicker import __version__, generate  # noqa: E402
+
+default_sizes = [1_000, 100_000, 1_000_000]
+default_threshold = 0.10
+# Timed runs of each benchmark that's fast enough to repeat; the best is kept
+repeat = 5
+picks_timed = 1_000
+# (mode, query) of the searches timed against each synthetic database; "Zz"
+# is too short for the trigram index, and matches nothing
+search_queries = [
+    ("substring", "0012"),
+    ("prefix", "Name0012"),
+    ("prefix", "Zz"),
+    ("fuzzy", "Nmae00123"),
+]
+
+
+class Result(NamedTuple):
+    value: float
+    unit: str
+    # False for times, True for rates
+    higher_is_better: bool
+
+
+Results = Dict[str, Result]
+
+
+def best_time(function: Callable[[], Any], times: int = repeat) -> float:
+    seconds = []
+    for _ in range(times):
+        start = perf_counter()
+        function()
+        seconds.append(perf_counter() - start)
+    return min(seconds)
+
+
+def synthetic_names(count: int) -> Iterable[str]:
+    # Distinct, and roughly as long as real names
+    return (f"Name{number:08d}" for number in range(count))
+
+
+def generate_benchmarks() -> Results:
+    results: Results = dict()
+    weights = generate.default_config["letter_weights"]
+    sampler = generate.LetterSampler(weights)
+
+    count = 100_000
+    seconds = best_time(lambda: [generate.rand_name(6, sampler) for _ in range(count)])
+    results["rand_name"] = Result(count / seconds, "names/s", True)
+    for engine in ("python", "numpy") if generate.has_numpy else ("python",):
+        seconds = best_time(
+            lambda: generate.rand_list(count, 3, 8, weights, engine=engine)
+        )
+        results[f"rand_list[engine={engine}]"] = Result(
+            count / seconds, "names/s", True
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        census = Path(directory) / "census.csv"
+        census.write_text(
+            "name,rank\n"
+            + "".join(
+                f"{name.upper()},{rank}\n"
+                for rank, name in enumerate(generate.rand_list(100_000, 3, 10, weights))
+            )
+        )
+        seconds = best_time(lambda: generate.letter_weights(census, cache_dir=None))
+        results["letter_weights[names=100000]"] = Result(seconds, "s", False)
+        cache_dir = Path(directory) / "cache"
+        generate.letter_weights(census, cache_dir=cache_dir)
+        seconds = best_time(
+            lambda: generate.letter_weights(census, cache_dir=cache_dir)
+        )
+        results["letter_weights[cached]"] = Result(seconds, "s", False)
+
+    for size in (1_000, 10_000, 100_000):
+        options = list(synthetic_names(size))
+        seconds = best_time(lambda: generate.find_unique_prefixes(options), times=3)
+        results[f"find_unique_prefixes[options={size}]"] = Result(seconds, "s", False)
+    return results
+
+
+def database_benchmarks(size: int, directory: str) -> Dict[str, Result]:
+    """
+    Runs in its own process; the database is created in directory
+    """
+    from namepicker import database
+    from namepicker.database_interface import import_file
+
+    path = Path(directory) / "namepicker.sqlitedb"
+    names = Path(directory) / f"names{size}.txt"
+    with names.open("w") as file:
+        for name in synthetic_names(size):
+            file.write(name + "\n")
+
+    results: Results = dict()
+    start = perf_counter()
+    database.initialize_database(path)
+    results["initialize_database[new]"] = Result(perf_counter() - start, "s", False)
+
+    stats = import_file(names, title="benchmark")
+    results[f"import_file[names={size}]"] = Result(
+        stats.rows_per_second, "rows/s", True
+    )
+
+    # Before any picks, which search doesn't read
+    for mode, query in search_queries:
+        seconds = best_time(lambda: database.search_names(query, mode=mode))
+        results[f"search_names[mode={mode},query={query},names={size}]"] = Result(
+            seconds, "s", False
+        )
+    seconds = best_time(
+        lambda: database.search_names("Name0", mode="prefix", list_title="benchmark")
+    )
+    results[f"search_names[list,names={size}]"] = Result(seconds, "s", False)
+
+    latencies = []
+    for _ in range(min(picks_timed, size)):
+        start = perf_counter()
+        database.pick("benchmark")
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    results[f"pick[names={size}]"] = Result(median(latencies), "s", False)
+    results[f"pick_p99[names={size}]"] = Result(
+        latencies[int(len(latencies) * 0.99)], "s", False
+    )
+    return results
+
+
+def initialize_existing(directory: str) -> Dict[str, Result]:
+    from namepicker import database
+
+    start = perf_counter()
+    database.initialize_database(Path(directory) / "namepicker.sqlitedb")
+    return {"initialize_database[existing]": Result(perf_counter() - start, "s", False)}
+
+
+def in_new_process(function: Callable[..., Results], *args: Any) -> Results:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(function, *args).result()
+
+
+def run(sizes: List[int]) -> Results:
+    results = generate_benchmarks()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            results.update(in_new_process(database_benchmarks, size, directory))
+            if size == sizes[-1]:
+                results.update(in_new_process(initialize_existing, directory))
+    return results
+
+
+def save(results: Results, path: Path) -> None:
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "results": {name: result._asdict() for name, result in results.items()},
+    }
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def load(path: Path) -> Results:
+    report = json.loads(path.read_text())
+    return {name: Result(**result) for name, result in report["results"].items()}
+
+
+def regressions(baseline: Results, current: Results, threshold: float) -> List[str]:
+    """
+    Describes each benchmark in both runs that got worse by more than
+    threshold, as a fraction of the baseline
+    """
+    found = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None or not before.value:
+            continue
+        change = (after.value - before.value) / before.value
+        worse = -change if before.higher_is_better else change
+        if worse > threshold:
+            found.append(
+                f"{name}: {before.value:.4g} -> {after.value:.4g} {after.unit} "
+                f"({worse:.0%} worse)"
+            )
+    return found
+
+
+def print_results(results: Results) -> None:
+    width = max(map(len, results))
+    for name, result in results.items():
+        print(f"{name:<{width}}  {result.value:>12.4g} {result.unit}")
+
+
+def arguments() -> Namespace:
+    parser = ArgumentParser(description="Benchmarks namepicker's hot paths")
+    parser.add_argument(
+        "--sizes",
+        type=lambda text: [int(size) for size in text.split(",")],
+        default=default_sizes,
+        help="Comma-separated list sizes for the database benchmarks, like "
+        "1000,100000,10000000",
+    )
+    parser.add_argument("--output", type=Path, help="Save the results here")
+    parser.add_argument(
+        "--compare", type=Path, help="Results from an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--current",
+        type=Path,
+        help="With --compare, compare these saved results instead of running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=default_threshold,
+        help="Fraction a benchmark can get worse by before it's a regression",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arguments()
+    if args.current is not None:
+        results = load(args.current)
+    else:
+        results = run(args.sizes)
+        print_results(results)
+    if args.output is not None:
+        save(results, args.output)
+
+    if args.compare is not None:
+        found = regressions(load(args.compare), results, args.threshold)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,74 @@
 Wraps Pony to provide a basic interface to the database
 Until Pony gains type annotations, this will live in it's own module
 """
+import json
 import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from enum import Enum
 from functools import partial
+from itertools import chain, product
 from pathlib import Path
-from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from random import Random, random, randrange
+from re import compile as re_compile
+from time import monotonic, perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from pony import orm
+from pony.utils import datetime2timestamp
+
+from .iterators import chunked
+from .metrics import metrics
+from .settings import (
+    ConnectionProfile,
+    SearchMode,
+    WeightMode,
+    connection_profiles,
+    default_connection_profile,
+    default_database_file,
+    search_modes,
+    weight_modes,
+)
 
 SPath = Union[str, Path]
 
-default_database_file = "./namepicker.sqlitedb"
+# Number of lines read, deduplicated, and written per transaction by bulk_import()
+default_chunk_size = 10_000
+# Number of rows read per query when iterating over lists and names
+default_page_size = 1_000
+# Writes a WriteBehindQueue commits together, at most, and how many seconds it
+# waits after the first for more to arrive
+default_group_size = 256
+default_group_delay = 0.002
+# Writes that can wait to be committed before submitting more blocks
+default_write_queue_size = 4_096
+# In 'fair' weighted picks, each earlier pick of a name multiplies its weight
+# by this
+fair_decay = 0.5
+# A 'fair' tree whose weights add up to less than this is built again, before
+# they underflow, or rounding in its totals outweighs them
+fair_rebuild_below = 2.0**-20
+
+log = logging.getLogger(__name__)
 
 db = orm.Database()
 
@@ -22,11 +78,31 @@ class ListNotFoundError(Exception):
     pass
 
 
+class NoNamesLeftError(Exception):
+    pass
+
+
+class NameNotFoundError(Exception):
+    pass
+
+
+class WriteQueueFullError(Exception):
+    pass
+
+
+class SchemaOutdatedError(Exception):
+    pass
+
+
 class Name(db.Entity):
     # id = PrimaryKey(int, auto=True)
     value = orm.Required(str, unique=True)
     lists = orm.Set("NameList")
     name_datas = orm.Set("NameData")
+    picks = orm.Set("Pick")
+    list_slots = orm.Set("ListSlot")
+    pick_slots = orm.Set("PickSlot")
+    pick_weights = orm.Set("PickWeight")
 
 
 class NameList(db.Entity):
@@ -34,6 +110,14 @@ class NameList(db.Entity):
     title = orm.Required(str, unique=True)
     names = orm.Set(Name)
     name_datas = orm.Set("NameData")
+    picks = orm.Set("Pick")
+    list_slots = orm.Set("ListSlot")
+    pick_slots = orm.Set("PickSlot")
+    pick_weights = orm.Set("PickWeight")
+
+    def after_delete(self) -> None:
+        # So what's been cached about the list doesn't outlive it
+        list_changed(self.id)
 
 
 def time_now() -> datetime:
@@ -45,11 +129,451 @@ class NameData(db.Entity):
     name = orm.Required(Name)
     list = orm.Required(NameList)
     date_added = orm.Required(datetime, default=time_now)
+    # How likely weighted_pick() is to pick this name, relative to the others
+    weight = orm.Required(float, default=1.0, sql_default="1")
+    orm.composite_index(list, name)
+
+
+class Pick(db.Entity):
+    """
+    Every name that has been picked from a list
+    """
+    # id = PrimaryKey(int, auto=True)
+    name = orm.Required(Name)
+    list = orm.Required(NameList)
+    date_picked = orm.Required(datetime, default=time_now)
+    orm.composite_index(list, name)
+
+
+class ListSlot(db.Entity):
+    """
+    Every name in a list, picked or not, numbered from 0 with no gaps like
+    PickSlot, so pick_many() can find random names by their slot numbers
+    """
+    list = orm.Required(NameList)
+    slot = orm.Required(int)
+    name = orm.Required(Name)
+    orm.PrimaryKey(list, slot)
+    orm.composite_index(list, name)
+
+
+class PickSlot(db.Entity):
+    """
+    The names in a list that haven't been picked yet, numbered from 0 with no
+    gaps, so a random one can be found by its slot number
+    """
+    list = orm.Required(NameList)
+    slot = orm.Required(int)
+    name = orm.Required(Name)
+    orm.PrimaryKey(list, slot)
+    # Finds the slot of a name being removed from the list
+    orm.composite_index(list, name)
+
 
+class PickWeight(db.Entity):
+    """
+    A Fenwick tree of the weights of a list's names, one for each of
+    weight_modes, so weighted_pick() can find a random name, and change its
+    weight, by reading and writing about log2(n) rows
+
+    Built by weighted_pick() the first time it's needed, and deleted when
+    names are added to or removed from the list, to be built again.
+    """
+    list = orm.Required(NameList)
+    mode = orm.Required(str)
+    # Numbered from 1
+    position = orm.Required(int)
+    name = orm.Required(Name)
+    # The name's own weight
+    weight = orm.Required(float)
+    # The sum of weight over positions (position - lowbit(position), position]
+    total = orm.Required(float)
+    orm.PrimaryKey(list, mode, position)
+    orm.composite_index(list, mode, name)
 
-def initialize_database(filename: SPath = default_database_file) -> None:
-    db.bind(provider="sqlite", filename=str(filename), create_db=True)
-    db.generate_mapping(check_tables=True, create_tables=True)
+
+# Each item upgrades the schema of an existing database by one version, and
+# PRAGMA user_version records how many have been applied. Pony creates new
+# databases with the latest schema, including the indexes declared above, and
+# new tables in existing databases before they're migrated.
+migrations: List[Tuple[str, ...]] = [
+    (
+        'CREATE INDEX IF NOT EXISTS "idx_namedata__list_name" '
+        'ON "NameData" ("list", "name")',
+        'CREATE INDEX IF NOT EXISTS "idx_pick__list_name" ON "Pick" ("list", "name")',
+    ),
+    (
+        'CREATE INDEX IF NOT EXISTS "idx_pickslot__list_name" '
+        'ON "PickSlot" ("list", "name")',
+    ),
+    ('ALTER TABLE "NameData" ADD COLUMN "weight" REAL NOT NULL DEFAULT 1',),
+    # PickSlot is created empty in a database that already has lists; fill
+    # it for each of them with the names that haven't been picked
+    (
+        """
+        INSERT INTO "PickSlot" ("list", "slot", "name")
+        SELECT
+            "namelist",
+            ROW_NUMBER() OVER (PARTITION BY "namelist" ORDER BY "name") - 1,
+            "name"
+        FROM "Name_NameList" AS link
+        WHERE NOT EXISTS (
+            SELECT 1 FROM "Pick"
+            WHERE "list" = link."namelist" AND "name" = link."name"
+        )
+        AND NOT EXISTS (SELECT 1 FROM "PickSlot" WHERE "list" = link."namelist")
+        """,
+    ),
+    # Likewise ListSlot, with every name in each list
+    (
+        """
+        INSERT INTO "ListSlot" ("list", "slot", "name")
+        SELECT
+            "namelist",
+            ROW_NUMBER() OVER (PARTITION BY "namelist" ORDER BY "name") - 1,
+            "name"
+        FROM "Name_NameList" AS link
+        WHERE NOT EXISTS (SELECT 1 FROM "ListSlot" WHERE "list" = link."namelist")
+        """,
+        'CREATE INDEX IF NOT EXISTS "idx_listslot__list_name" '
+        'ON "ListSlot" ("list", "name")',
+    ),
+]
+# Indexes Pony can't declare, because it creates the many-to-many table itself
+extra_indexes = (
+    # Lets the names in a list be read without visiting the link table
+    'CREATE INDEX IF NOT EXISTS "idx_name_namelist__namelist_name" '
+    'ON "Name_NameList" ("namelist", "name")',
+)
+
+# Full-text index of Name.value, kept up to date by triggers; the trigram
+# tokenizer lets it find any substring of 3 or more characters
+search_schema = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS "NameSearch" USING fts5('
+    "value, content='Name', content_rowid='id', tokenize='trigram')",
+    'CREATE TRIGGER IF NOT EXISTS "NameSearch_insert" AFTER INSERT ON "Name" BEGIN '
+    'INSERT INTO "NameSearch" (rowid, value) VALUES (new.id, new.value); END',
+    'CREATE TRIGGER IF NOT EXISTS "NameSearch_delete" AFTER DELETE ON "Name" BEGIN '
+    'INSERT INTO "NameSearch" ("NameSearch", rowid, value) '
+    "VALUES ('delete', old.id, old.value); END",
+    'CREATE TRIGGER IF NOT EXISTS "NameSearch_update" '
+    'AFTER UPDATE OF "value" ON "Name" BEGIN '
+    'INSERT INTO "NameSearch" ("NameSearch", rowid, value) '
+    "VALUES ('delete', old.id, old.value); "
+    'INSERT INTO "NameSearch" (rowid, value) VALUES (new.id, new.value); END',
+)
+# One row, whose number goes up with every transaction that changes a list or
+# what's been picked from it, so readers can tell cheaply that what they've
+# read, or a copy of the database, is out of date
+generation_schema = (
+    'CREATE TABLE IF NOT EXISTS "Generation" ('
+    '"id" INTEGER PRIMARY KEY CHECK ("id" = 1), "number" INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO "Generation" ("id", "number") VALUES (1, 0)',
+)
+# False if this SQLite doesn't have FTS5 with the trigram tokenizer (3.34+),
+# in which case searches read the whole Name table
+search_available = False
+
+# The queries run for every pick, import, or lookup; tests check that none of
+# them have to scan a whole table
+hot_queries = {
+    "list_id": 'SELECT "id" FROM "NameList" WHERE "title" = ?',
+    "list_names": 'SELECT "name" FROM "Name_NameList" WHERE "namelist" = ?',
+    "name_value": 'SELECT "value" FROM "Name" WHERE "id" = ?',
+    "list_fingerprint": (
+        'SELECT COUNT(*), MAX("date_added") FROM "NameData" WHERE "list" = ?'
+    ),
+    "new_names": """
+        SELECT "Name"."id"
+        FROM import_staging
+        JOIN "Name" ON "Name"."value" = import_staging.value
+        WHERE NOT EXISTS (
+            SELECT 1 FROM "Name_NameList"
+            WHERE "Name_NameList"."name" = "Name"."id"
+            AND "Name_NameList"."namelist" = ?
+        )
+    """,
+    "list_titles_page": (
+        'SELECT "title" FROM "NameList" WHERE "title" > ? ORDER BY "title" LIMIT ?'
+    ),
+    "list_names_page": """
+        SELECT "Name_NameList"."name", "Name"."value"
+        FROM "Name_NameList"
+        JOIN "Name" ON "Name"."id" = "Name_NameList"."name"
+        WHERE "Name_NameList"."namelist" = ? AND "Name_NameList"."name" > ?
+        ORDER BY "Name_NameList"."name"
+        LIMIT ?
+    """,
+    "list_name_data_page": """
+        SELECT "NameData"."name", "Name"."value", "NameData"."date_added"
+        FROM "NameData"
+        JOIN "Name" ON "Name"."id" = "NameData"."name"
+        WHERE "NameData"."list" = ? AND "NameData"."name" > ?
+        ORDER BY "NameData"."name"
+        LIMIT ?
+    """,
+    "names_page": (
+        'SELECT "id", "value" FROM "Name" WHERE "id" > ? ORDER BY "id" LIMIT ?'
+    ),
+    "list_has_name": """
+        SELECT 1
+        FROM "Name"
+        JOIN "Name_NameList" ON "Name_NameList"."name" = "Name"."id"
+        WHERE "Name"."value" = ? AND "Name_NameList"."namelist" = ?
+    """,
+    "remaining_picks": (
+        'SELECT COALESCE(MAX("slot") + 1, 0) FROM "PickSlot" WHERE "list" = ?'
+    ),
+    "pick_slots": (
+        'SELECT "slot", "name" FROM "PickSlot" WHERE "list" = ? AND "slot" IN (?, ?)'
+    ),
+    "fill_slot": 'UPDATE "PickSlot" SET "name" = ? WHERE "list" = ? AND "slot" = ?',
+    "delete_slot": 'DELETE FROM "PickSlot" WHERE "list" = ? AND "slot" = ?',
+    "removed_names": """
+        SELECT "Name_NameList"."name"
+        FROM "Name_NameList"
+        JOIN "Name" ON "Name"."id" = "Name_NameList"."name"
+        WHERE "Name_NameList"."namelist" = ?
+        AND NOT EXISTS (
+            SELECT 1 FROM import_staging WHERE import_staging.value = "Name"."value"
+        )
+    """,
+    "name_slot": 'SELECT "slot" FROM "PickSlot" WHERE "list" = ? AND "name" = ?',
+    "slot_names": """
+        SELECT "slot", "name" FROM "PickSlot"
+        WHERE "list" = ? AND "slot" IN (SELECT value FROM json_each(?))
+    """,
+    # The same as the PickSlot queries above, for ListSlot
+    "list_size": (
+        'SELECT COALESCE(MAX("slot") + 1, 0) FROM "ListSlot" WHERE "list" = ?'
+    ),
+    "list_fill_slot": (
+        'UPDATE "ListSlot" SET "name" = ? WHERE "list" = ? AND "slot" = ?'
+    ),
+    "list_name_slot": 'SELECT "slot" FROM "ListSlot" WHERE "list" = ? AND "name" = ?',
+    "list_slot_names": """
+        SELECT "slot", "name" FROM "ListSlot"
+        WHERE "list" = ? AND "slot" IN (SELECT value FROM json_each(?))
+    """,
+    "list_tail_slots": (
+        'SELECT "slot", "name" FROM "ListSlot" WHERE "list" = ? AND "slot" >= ?'
+    ),
+    "name_values": """
+        SELECT "id", "value" FROM "Name"
+        WHERE "id" IN (SELECT value FROM json_each(?))
+    """,
+    "tail_slots": (
+        'SELECT "slot", "name" FROM "PickSlot" WHERE "list" = ? AND "slot" >= ?'
+    ),
+    "name_weights": """
+        SELECT "name", "weight", (
+            SELECT COUNT(*) FROM "Pick"
+            WHERE "Pick"."list" = "NameData"."list"
+            AND "Pick"."name" = "NameData"."name"
+        )
+        FROM "NameData"
+        WHERE "list" = ?
+    """,
+    "generation": 'SELECT "number" FROM "Generation" WHERE "id" = 1',
+    "next_generation": (
+        'UPDATE "Generation" SET "number" = "number" + 1 WHERE "id" = 1'
+    ),
+    "set_name_weight": """
+        UPDATE "NameData" SET "weight" = ?
+        WHERE "list" = ? AND "name" = (SELECT "id" FROM "Name" WHERE "value" = ?)
+        RETURNING "name"
+    """,
+    "weight_tree_size": (
+        'SELECT MAX("position") FROM "PickWeight" WHERE "list" = ? AND "mode" = ?'
+    ),
+    "weight_node": """
+        SELECT "total" FROM "PickWeight"
+        WHERE "list" = ? AND "mode" = ? AND "position" = ?
+    """,
+    "weight_leaf": """
+        SELECT "name", "weight" FROM "PickWeight"
+        WHERE "list" = ? AND "mode" = ? AND "position" = ?
+    """,
+    "weight_position": """
+        SELECT "position", "weight" FROM "PickWeight"
+        WHERE "list" = ? AND "mode" = ? AND "name" = ?
+    """,
+    # The position lists are JSON arrays, so one statement reads or writes
+    # every node on a path through the tree
+    "weight_prefix_sum": """
+        SELECT COALESCE(SUM("total"), 0) FROM "PickWeight"
+        WHERE "list" = ? AND "mode" = ?
+        AND "position" IN (SELECT value FROM json_each(?))
+    """,
+    "set_weight_leaf": """
+        UPDATE "PickWeight" SET "weight" = ?
+        WHERE "list" = ? AND "mode" = ? AND "position" = ?
+    """,
+    "add_weight_totals": """
+        UPDATE "PickWeight" SET "total" = "total" + ?
+        WHERE "list" = ? AND "mode" = ?
+        AND "position" IN (SELECT value FROM json_each(?))
+    """,
+}
+SlotTable = Literal["PickSlot", "ListSlot"]
+# The hot queries empty_slots() reads the last slots of a table with, and
+# fills a slot with
+slot_queries: Dict[SlotTable, Tuple[str, str]] = {
+    "PickSlot": ("tail_slots", "fill_slot"),
+    "ListSlot": ("list_tail_slots", "list_fill_slot"),
+}
+
+
+connection_profile = connection_profiles[default_connection_profile]
+
+
+def apply_connection_profile(
+    connection: sqlite3.Connection, profile: ConnectionProfile
+) -> None:
+    for pragma, value in profile._asdict().items():
+        if value is not None:
+            connection.execute(f"PRAGMA {pragma} = {value}")
+
+
+# Set by initialize_database(read_only=True)
+opened_read_only = False
+
+
+@db.on_connect(provider="sqlite")
+def tune_connection(database: orm.Database, connection: sqlite3.Connection) -> None:
+    profile = connection_profile
+    if opened_read_only:
+        # Changing the journal mode writes to the file
+        profile = profile._replace(journal_mode=None)
+    apply_connection_profile(connection, profile)
+    if opened_read_only:
+        connection.execute("PRAGMA query_only = ON")
+    connection.set_trace_callback(count_statement)
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    return int(connection.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """
+    Applies the migrations an existing database hasn't had yet, and returns
+    the new schema version
+    """
+    version = schema_version(connection)
+    for number, statements in enumerate(migrations[version:], start=version + 1):
+        log.info(f"Migrating database schema to version {number}")
+        for statement in statements:
+            connection.execute(statement)
+        connection.execute(f"PRAGMA user_version = {number}")
+    return len(migrations)
+
+
+def initialize_database(
+    filename: SPath = default_database_file,
+    profile: str = default_connection_profile,
+    read_only: bool = False,
+) -> None:
+    """
+    Binds the entities to a SQLite database file, creating and upgrading it
+    as needed; profile is one of connection_profiles
+
+    With read_only, every connection is made query-only, so this process
+    can't change the file, and it's never created or upgraded; another
+    process has to do that first, and make every change to it.
+    """
+    global connection_profile, opened_read_only, search_available
+    if profile not in connection_profiles:
+        raise ValueError(
+            f"'{profile}' is not one of {', '.join(connection_profiles)}"
+        )
+    connection_profile = connection_profiles[profile]
+    opened_read_only = read_only
+
+    # Pony resolves relative paths against this module, not the working directory
+    if str(filename) != ":memory:":
+        filename = Path(filename).resolve()
+    if read_only and not Path(filename).is_file():
+        raise SchemaOutdatedError(
+            f"'{filename}' doesn't exist; it has to be created before it can be "
+            "opened read-only"
+        )
+    # Pony mistakes a file: URI for a relative path, so read_only can't use a
+    # mode=ro URI; tune_connection() makes the connections query-only instead
+    db.bind(provider="sqlite", filename=str(filename), create_db=not read_only)
+    with orm.db_session():
+        connection = read_connection()
+        rows = connection.execute("SELECT name FROM sqlite_master")
+        existing = {name for (name,) in rows}
+        version = schema_version(connection)
+    is_current = version == len(migrations) and schema_objects() <= existing
+    if read_only and not is_current:
+        raise SchemaOutdatedError(
+            f"'{filename}' has to be opened for writing once, to be upgraded, "
+            "before it can be opened read-only"
+        )
+    if is_current:
+        # Already set up by an earlier run, so skip Pony's check of every
+        # table and column, and the write transaction below
+        db.generate_mapping(check_tables=False, create_tables=False)
+        search_available = True
+        return
+
+    is_new = "Name" not in existing
+    # Tables are checked after migrating, which may add columns they need
+    db.generate_mapping(check_tables=False, create_tables=True)
+    with orm.db_session():
+        connection = db.get_connection()
+        if is_new:
+            connection.execute(f"PRAGMA user_version = {len(migrations)}")
+        else:
+            migrate(connection)
+        for statement in chain(extra_indexes, generation_schema):
+            connection.execute(statement)
+        create_search_index(connection)
+    db.check_tables()
+
+
+def schema_objects() -> Set[str]:
+    """
+    Names of the tables, indexes, and triggers a fully set up database has
+    """
+    statements = chain(
+        chain.from_iterable(migrations),
+        extra_indexes,
+        generation_schema,
+        search_schema,
+    )
+    created = re_compile(r'IF NOT EXISTS "(\w+)"')
+    return {
+        "Name_NameList",
+        *db.entities,
+        *(match.group(1) for match in map(created.search, statements) if match),
+    }
+
+
+def create_search_index(connection: sqlite3.Connection) -> bool:
+    """
+    Creates NameSearch and its triggers if they're missing, filling it from
+    Name the first time; returns whether full-text search is available
+    """
+    global search_available
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'NameSearch'"
+    ).fetchone()
+    try:
+        for statement in search_schema:
+            connection.execute(statement)
+    except sqlite3.OperationalError as err:
+        log.warning(f"Name search will be slow; SQLite can't create NameSearch: {err}")
+        search_available = False
+        return False
+    if not exists:
+        connection.execute(
+            'INSERT INTO "NameSearch" ("NameSearch") VALUES (\'rebuild\')'
+        )
+    search_available = True
+    return True
 
 
 def enable_debugging(enable: bool = True, enable_sql: bool = True) -> None:
@@ -63,6 +587,1286 @@ def enable_debugging(enable: bool = True, enable_sql: bool = True) -> None:
         orm.set_sql_debug(debug=True, show_values=True)
 
 
+class ImportStats(NamedTuple):
+    list_title: str
+    lines: int
+    names_added: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        if not self.seconds:
+            return float("inf")
+        return self.lines / self.seconds
+
+
+def read_connection() -> sqlite3.Connection:
+    """
+    Returns the current db_session's connection without starting a write
+    transaction, as db.get_connection() does; only use it for reading
+    """
+    # Pony has no public way to do this; db.select() does the same internally
+    return db._get_cache().prepare_connection_for_query_execution()
+
+
+# Number of SQL statements each thread has run, including Pony's
+statement_counts = threading.local()
+
+
+def count_statement(statement: str) -> None:
+    statement_counts.total = getattr(statement_counts, "total", 0) + 1
+
+
+@contextmanager
+def session(name: str) -> Iterator[None]:
+    """
+    orm.db_session(), recording how long it took and how many SQL statements
+    it ran under the session=name label
+    """
+    before = getattr(statement_counts, "total", 0)
+    try:
+        with metrics.timer("db_session_seconds", session=name), orm.db_session():
+            yield
+    finally:
+        statements = getattr(statement_counts, "total", 0) - before
+        metrics.observe("db_session_statements", statements, session=name)
+
+
+@contextmanager
+def read_transaction(name: str) -> Iterator[sqlite3.Connection]:
+    """
+    session(name), with every read through the connection it gives made in
+    one transaction, so they all see the database as it was at the first,
+    even if other connections commit meanwhile
+    """
+    with session(name):
+        connection = read_connection()
+        connection.execute("BEGIN")
+        try:
+            yield connection
+        finally:
+            connection.execute("COMMIT")
+
+
+def execute(
+    connection: Union[sqlite3.Connection, sqlite3.Cursor],
+    query: str,
+    parameters: Sequence[Any] = (),
+) -> sqlite3.Cursor:
+    """
+    Runs one of hot_queries, recording how long it took to reach the first row
+    """
+    start = perf_counter()
+    cursor = connection.execute(hot_queries[query], parameters)
+    metrics.observe("sql_seconds", perf_counter() - start, query=query)
+    return cursor
+
+
+def select_list(title: str) -> int:
+    """
+    Returns the id of the list with this title, or raises ListNotFoundError
+    """
+    with session("select_list"):
+        row = execute(read_connection(), "list_id", (title,)).fetchone()
+        if row is None:
+            raise ListNotFoundError(f"No list titled '{title}'")
+        return int(row[0])
+
+
+def bulk_import(
+    list_title: str, names: Iterable[str], chunk_size: int = default_chunk_size
+) -> ImportStats:
+    """
+    Adds names to a list, creating the list if needed
+
+    names is consumed chunk_size items at a time, so it can be a file that is
+    larger than memory. Each chunk is deduplicated in memory, staged into a
+    temporary table with executemany(), and then written to Name, the
+    Name <-> NameList link table, and NameData with set-based INSERTs, one
+    transaction per chunk. Names already in the list are skipped, so
+    NameData.date_added is kept for them.
+    """
+    start = perf_counter()
+    lines = 0
+    names_added = 0
+    with session("bulk_import"):
+        name_list = NameList.get(title=list_title) or NameList(title=list_title)
+        orm.flush()
+        list_id = name_list.id
+        cursor = db.get_connection().cursor()
+        for chunk in chunked(names, chunk_size):
+            lines += len(chunk)
+            names_added += add_names(cursor, list_id, chunk)
+            orm.commit()
+            list_changed(list_id)
+            cursor = db.get_connection().cursor()
+        cursor.execute("DROP TABLE IF EXISTS import_staging")
+
+    stats = ImportStats(
+        list_title=list_title,
+        lines=lines,
+        names_added=names_added,
+        seconds=perf_counter() - start,
+    )
+    metrics.increment("import_lines_total", stats.lines)
+    metrics.increment("names_imported_total", stats.names_added)
+    metrics.observe("import_seconds", stats.seconds)
+    log.info(
+        f"Imported {stats.names_added} new names from {stats.lines} lines into "
+        f"'{list_title}' ({stats.rows_per_second:.0f} rows/sec)"
+    )
+    return stats
+
+
+def add_names(cursor: sqlite3.Cursor, list_id: int, names: Iterable[str]) -> int:
+    """
+    Does the work of bulk_import() for one chunk of names, in the transaction
+    cursor is in, and returns how many were new to the list
+    """
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS import_staging "
+        "(value TEXT PRIMARY KEY) WITHOUT ROWID"
+    )
+    # dict keeps the order of the file, unlike set
+    unique_names = dict.fromkeys(filter(None, (name.strip() for name in names)))
+    cursor.execute("DELETE FROM import_staging")
+    cursor.executemany(
+        "INSERT INTO import_staging (value) VALUES (?)",
+        ((name,) for name in unique_names),
+    )
+    cursor.execute(
+        'INSERT OR IGNORE INTO "Name" ("value") SELECT value FROM import_staging'
+    )
+    new_name_ids = [
+        name_id for (name_id,) in execute(cursor, "new_names", (list_id,))
+    ]
+    date_added = datetime2timestamp(time_now())
+    cursor.executemany(
+        'INSERT INTO "Name_NameList" ("name", "namelist") VALUES (?, ?)',
+        ((name_id, list_id) for name_id in new_name_ids),
+    )
+    cursor.executemany(
+        'INSERT INTO "NameData" ("name", "list", "date_added") VALUES (?, ?, ?)',
+        ((name_id, list_id, date_added) for name_id in new_name_ids),
+    )
+    # New names haven't been picked yet
+    add_slots(cursor, list_id, new_name_ids)
+    if new_name_ids:
+        drop_weight_trees(cursor, list_id)
+        next_generation(cursor)
+    return len(new_name_ids)
+
+
+class SyncStats(NamedTuple):
+    list_title: str
+    lines: int
+    names_added: int
+    names_removed: int
+    seconds: float
+
+
+def sync_import(
+    list_title: str, names: Iterable[str], chunk_size: int = default_chunk_size
+) -> SyncStats:
+    """
+    Makes the list contain exactly names, adding and removing only the
+    difference, and returns what changed
+
+    names is streamed into a temporary table, which SQLite keeps sorted, and
+    both sides are compared there, so neither is held in memory. Every change
+    is made in one transaction. Names that stay in the list keep their
+    NameData.date_added, and whether they've been picked.
+    """
+    start = perf_counter()
+    lines = 0
+    with session("sync_import"):
+        name_list = NameList.get(title=list_title) or NameList(title=list_title)
+        orm.flush()
+        list_id = name_list.id
+        cursor = db.get_connection().cursor()
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_staging "
+            "(value TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        cursor.execute("DELETE FROM import_staging")
+        for chunk in chunked(names, chunk_size):
+            lines += len(chunk)
+            stripped = [name for name in (line.strip() for line in chunk) if name]
+            # One statement per chunk is several times faster than one per name
+            cursor.execute(
+                "INSERT OR IGNORE INTO import_staging (value) "
+                "SELECT value FROM json_each(?)",
+                (json.dumps(stripped),),
+            )
+
+        removed = [
+            name_id for (name_id,) in execute(cursor, "removed_names", (list_id,))
+        ]
+        cursor.execute(
+            'INSERT OR IGNORE INTO "Name" ("value") SELECT value FROM import_staging'
+        )
+        added = [name_id for (name_id,) in execute(cursor, "new_names", (list_id,))]
+        if added or removed:
+            # Built again when they're next needed; the trees refer to the
+            # removed names, so they go first
+            drop_weight_trees(cursor, list_id)
+        remove_names(cursor, list_id, removed)
+
+        date_added = datetime2timestamp(time_now())
+        cursor.executemany(
+            'INSERT INTO "Name_NameList" ("name", "namelist") VALUES (?, ?)',
+            ((name_id, list_id) for name_id in added),
+        )
+        cursor.executemany(
+            'INSERT INTO "NameData" ("name", "list", "date_added") VALUES (?, ?, ?)',
+            ((name_id, list_id, date_added) for name_id in added),
+        )
+        add_slots(cursor, list_id, added)
+        if added or removed:
+            next_generation(cursor)
+        cursor.execute("DROP TABLE import_staging")
+    list_changed(list_id)
+
+    stats = SyncStats(
+        list_title=list_title,
+        lines=lines,
+        names_added=len(added),
+        names_removed=len(removed),
+        seconds=perf_counter() - start,
+    )
+    metrics.increment("import_lines_total", stats.lines)
+    metrics.increment("names_imported_total", stats.names_added)
+    metrics.increment("names_removed_total", stats.names_removed)
+    metrics.observe("import_seconds", stats.seconds)
+    log.info(
+        f"Synced '{list_title}' with {stats.lines} lines: {stats.names_added} "
+        f"names added, {stats.names_removed} removed, in {stats.seconds:.2f}s"
+    )
+    return stats
+
+
+def add_slots(cursor: sqlite3.Cursor, list_id: int, name_ids: List[int]) -> None:
+    """
+    Gives names just added to a list the next ListSlots and PickSlots
+    """
+    (first_slot,) = execute(cursor, "list_size", (list_id,)).fetchone()
+    cursor.executemany(
+        'INSERT INTO "ListSlot" ("list", "slot", "name") VALUES (?, ?, ?)',
+        ((list_id, slot, name_id) for slot, name_id in enumerate(name_ids, first_slot)),
+    )
+    first_slot = remaining_picks(cursor, list_id)
+    cursor.executemany(
+        'INSERT INTO "PickSlot" ("list", "slot", "name") VALUES (?, ?, ?)',
+        ((list_id, slot, name_id) for slot, name_id in enumerate(name_ids, first_slot)),
+    )
+
+
+def remove_names(cursor: sqlite3.Cursor, list_id: int, name_ids: List[int]) -> None:
+    """
+    Takes names out of a list, keeping its ListSlots and PickSlots numbered
+    with no gaps: each emptied slot is filled from the end, the same way
+    pick() does it
+
+    Picks of the names are kept, and names left in no list, that were never
+    picked, are deleted.
+    """
+    removed_slots = [
+        row[0]
+        for name_id in name_ids
+        for row in execute(cursor, "name_slot", (list_id, name_id))
+    ]
+    empty_slots(cursor, list_id, removed_slots, remaining_picks(cursor, list_id))
+    removed_slots = [
+        row[0]
+        for name_id in name_ids
+        for row in execute(cursor, "list_name_slot", (list_id, name_id))
+    ]
+    (size,) = execute(cursor, "list_size", (list_id,)).fetchone()
+    empty_slots(cursor, list_id, removed_slots, size, "ListSlot")
+
+    cursor.executemany(
+        'DELETE FROM "Name_NameList" WHERE "namelist" = ? AND "name" = ?',
+        ((list_id, name_id) for name_id in name_ids),
+    )
+    cursor.executemany(
+        'DELETE FROM "NameData" WHERE "list" = ? AND "name" = ?',
+        ((list_id, name_id) for name_id in name_ids),
+    )
+    cursor.executemany(
+        """
+        DELETE FROM "Name" WHERE "id" = ?1
+        AND NOT EXISTS (SELECT 1 FROM "Name_NameList" WHERE "name" = ?1)
+        AND NOT EXISTS (SELECT 1 FROM "Pick" WHERE "name" = ?1)
+        """,
+        ((name_id,) for name_id in name_ids),
+    )
+
+
+def empty_slots(
+    cursor: sqlite3.Cursor,
+    list_id: int,
+    slots: Iterable[int],
+    remaining: int,
+    table: SlotTable = "PickSlot",
+) -> None:
+    """
+    Deletes the names in slots from a list's PickSlots, or ListSlots, of
+    which there are remaining, moving names from the end into the emptied
+    slots below the new end, so the numbering has no gaps
+    """
+    queries = slot_queries[table]
+    emptied = set(slots)
+    remaining -= len(emptied)
+    holes = sorted(slot for slot in emptied if slot < remaining)
+    movers = sorted(
+        (slot, name_id)
+        for slot, name_id in execute(cursor, queries[0], (list_id, remaining))
+        if slot not in emptied
+    )
+    assert len(holes) == len(movers), f"{table} numbering has gaps"
+    cursor.executemany(
+        hot_queries[queries[1]],
+        ((name_id, list_id, hole) for hole, (_, name_id) in zip(holes, movers)),
+    )
+    cursor.execute(
+        f'DELETE FROM "{table}" WHERE "list" = ? AND "slot" >= ?', (list_id, remaining)
+    )
+
+
+# Incremented whenever the names in a list change, so cached information about
+# a list can tell it's out of date
+list_versions: Dict[int, int] = dict()
+
+
+def list_changed(list_id: int) -> None:
+    list_versions[list_id] = list_versions.get(list_id, 0) + 1
+
+
+def list_version(list_id: int) -> int:
+    return list_versions.get(list_id, 0)
+
+
+def count_lists() -> int:
+    with session("count_lists"):
+        row = read_connection().execute('SELECT COUNT(*) FROM "NameList"').fetchone()
+        return int(row[0])
+
+
+def count_list_names(list_id: int) -> int:
+    with session("count_list_names"):
+        row = read_connection().execute(
+            'SELECT COUNT(*) FROM "Name_NameList" WHERE "namelist" = ?', (list_id,)
+        ).fetchone()
+        return int(row[0])
+
+
+def list_fingerprint(list_id: int) -> Tuple[int, Optional[str]]:
+    """
+    The number of names in a list, and when the newest was added; changes
+    whenever names are added to or removed from the list
+    """
+    with session("list_fingerprint"):
+        return list_fingerprint_in(read_connection(), list_id)
+
+
+def list_fingerprint_in(
+    connection: sqlite3.Connection, list_id: int
+) -> Tuple[int, Optional[str]]:
+    count, last_added = execute(connection, "list_fingerprint", (list_id,)).fetchone()
+    return int(count), last_added
+
+
+def list_has_name(list_id: int, name: str) -> bool:
+    with session("list_has_name"):
+        row = execute(read_connection(), "list_has_name", (name, list_id)).fetchone()
+        return row is not None
+
+
+def iter_list_titles(page_size: int = default_page_size) -> Iterator[str]:
+    """
+    Yields the title of every list in order, reading page_size at a time
+
+    Each page is read in its own db_session, so nothing is held open between
+    pages, and nothing is loaded into Pony's identity map
+    """
+    last_title = ""
+    while True:
+        with session("iter_list_titles"):
+            titles = [
+                title
+                for (title,) in execute(
+                    read_connection(), "list_titles_page", (last_title, page_size)
+                )
+            ]
+        yield from titles
+        if len(titles) < page_size:
+            return
+        last_title = titles[-1]
+
+
+def iter_list_names(list_id: int, page_size: int = default_page_size) -> Iterator[str]:
+    """
+    Yields every name in a list, reading page_size at a time, in the same
+    way as iter_list_titles()
+    """
+    last_id = 0
+    while True:
+        with session("iter_list_names"):
+            rows = execute(
+                read_connection(), "list_names_page", (list_id, last_id, page_size)
+            ).fetchall()
+        for _, value in rows:
+            yield value
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_list_names_in(
+    connection: sqlite3.Connection, list_id: int, page_size: int = default_page_size
+) -> Iterator[str]:
+    """
+    Like iter_list_names(), but reads every page through connection, so a
+    read_transaction() sees them all as they were at the same moment
+    """
+    last_id = 0
+    while True:
+        rows = execute(
+            connection, "list_names_page", (list_id, last_id, page_size)
+        ).fetchall()
+        for _, value in rows:
+            yield value
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_list_name_data_in(
+    connection: sqlite3.Connection, list_id: int, page_size: int = default_page_size
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yields every name in a list with when it was added, as an ISO 8601 string,
+    reading every page through connection, like iter_list_names_in()
+    """
+    last_id = 0
+    while True:
+        rows = execute(
+            connection, "list_name_data_page", (list_id, last_id, page_size)
+        ).fetchall()
+        for _, value, date_added in rows:
+            yield value, date_added.replace(" ", "T", 1)
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_names(page_size: int = default_page_size) -> Iterator[str]:
+    """
+    Yields every name in the database, from any list, in the same way as
+    iter_list_titles()
+    """
+    last_id = 0
+    while True:
+        with session("iter_names"):
+            rows = execute(
+                read_connection(), "names_page", (last_id, page_size)
+            ).fetchall()
+        for _, value in rows:
+            yield value
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+class SearchResult(NamedTuple):
+    name: str
+    # Higher is a better match
+    score: float
+
+
+def fts_phrase(text: str) -> str:
+    """
+    Quotes text so FTS5 reads it as one string, not as query syntax
+    """
+    return '"' + text.replace('"', '""') + '"'
+
+
+def prefix_end(prefix: str) -> Optional[str]:
+    """
+    The first string after every string that starts with prefix, in SQLite's
+    BINARY order, or None if there isn't one
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    # Surrogates can't be stored as UTF-8
+    if 0xD800 <= following <= 0xDFFF:
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+
+def capitalizations(text: str) -> List[str]:
+    """
+    Every way of writing text in upper and lower case
+    """
+    cases = [
+        {letter} | {case for case in (letter.lower(), letter.upper()) if len(case) == 1}
+        for letter in text
+    ]
+    return sorted({"".join(letters) for letters in product(*cases)})
+
+
+def search_names(
+    query: str,
+    mode: SearchMode = "substring",
+    list_title: Optional[str] = None,
+    limit: int = 20,
+    after: Optional[str] = None,
+) -> List[SearchResult]:
+    """
+    Finds names, ignoring case, that start with query ('prefix'), contain it
+    ('substring'), or share as many 3-letter pieces with it as possible
+    ('fuzzy'), best matches first
+
+    Only names in the list titled list_title are searched, if it's given. The
+    next page of results starts after the name after, the last of the page
+    before.
+
+    Queries shorter than 3 characters can't use the trigram index, and are
+    matched in alphabetical order instead. A prefix is looked up in the
+    unique index on Name.value once for each of its capitalizations, reading
+    about limit names from each; other modes read names in order until limit
+    of them have matched.
+    """
+    if mode not in search_modes:
+        raise ValueError(f"'{mode}' is not one of {', '.join(search_modes)}")
+    if limit < 0:
+        raise ValueError(f"limit can't be negative; got {limit}")
+    list_parameters: List[Union[str, int]] = []
+    list_filter = ""
+    if list_title is not None:
+        list_filter = (
+            'JOIN "Name_NameList" ON "Name_NameList"."name" = "Name"."id" '
+            'AND "Name_NameList"."namelist" = ?'
+        )
+        list_parameters.append(select_list(title=list_title))
+    parameters: List[Union[str, int]] = []
+    after_filter = "" if after is None else 'AND "Name"."value" > ?'
+    after_parameters = [] if after is None else [after]
+
+    if mode == "prefix" and len(query) < 3:
+        pages = []
+        for prefix in capitalizations(query):
+            end = prefix_end(prefix)
+            end_filter = "" if end is None else 'AND "Name"."value" < ?'
+            pages.append(
+                f"""
+                SELECT * FROM (
+                    SELECT "Name"."value" AS value
+                    FROM "Name" {list_filter}
+                    WHERE "Name"."value" >= ? {end_filter} {after_filter}
+                    ORDER BY "Name"."value"
+                    LIMIT ?
+                )
+                """
+            )
+            parameters += list_parameters + [prefix]
+            parameters += ([] if end is None else [end]) + after_parameters
+            parameters.append(limit)
+        # The capitalizations' ranges don't overlap
+        sql = f"""
+            SELECT value, 0.0 FROM ({" UNION ALL ".join(pages)})
+            ORDER BY value
+            LIMIT ?
+        """
+    elif not search_available or len(query) < 3:
+        position = "= 1" if mode == "prefix" else "> 0"
+        sql = f"""
+            SELECT "Name"."value", 0.0
+            FROM "Name" {list_filter}
+            WHERE instr(lower("Name"."value"), lower(?)) {position} {after_filter}
+            ORDER BY "Name"."value"
+            LIMIT ?
+        """
+        parameters += list_parameters + [query] + after_parameters
+    else:
+        if mode == "fuzzy":
+            lowered = query.lower()
+            trigrams = dict.fromkeys(
+                lowered[i : i + 3] for i in range(len(lowered) - 2)
+            )
+            match = " OR ".join(fts_phrase(trigram) for trigram in trigrams)
+        else:
+            match = fts_phrase(query)
+        prefix_filter = ""
+        if mode == "prefix":
+            prefix_filter = 'AND instr(lower("Name"."value"), lower(?)) = 1'
+        if after is not None:
+            # Scores after's row the same way, to carry on from it
+            after_filter = """
+                AND (bm25("NameSearch"), length("Name"."value"), "Name"."value")
+                > ((
+                    SELECT bm25("NameSearch") FROM "NameSearch"
+                    WHERE "NameSearch" MATCH ? AND rowid = (
+                        SELECT "id" FROM "Name" WHERE "value" = ?
+                    )
+                ), length(?), ?)
+            """
+            after_parameters = [match, after, after, after]
+        sql = f"""
+            SELECT "Name"."value", -bm25("NameSearch")
+            FROM "NameSearch"
+            JOIN "Name" ON "Name"."id" = "NameSearch".rowid
+            {list_filter}
+            WHERE "NameSearch" MATCH ? {prefix_filter} {after_filter}
+            ORDER BY bm25("NameSearch"), length("Name"."value"), "Name"."value"
+            LIMIT ?
+        """
+        parameters += list_parameters + [match]
+        if mode == "prefix":
+            parameters.append(query)
+        parameters += after_parameters
+    parameters.append(limit)
+
+    with session("search_names"):
+        rows = read_connection().execute(sql, parameters).fetchall()
+    return [SearchResult(name=name, score=score) for name, score in rows]
+
+
+def next_generation(cursor: sqlite3.Cursor) -> None:
+    """
+    Records that the transaction cursor is in changes what readers see
+    """
+    execute(cursor, "next_generation")
+
+
+def generation() -> int:
+    """
+    The number of the latest committed change to any list; see
+    generation_schema
+    """
+    with session("generation"):
+        (number,) = execute(read_connection(), "generation").fetchone()
+        return int(number)
+
+
+def remaining_picks(cursor: sqlite3.Cursor, list_id: int) -> int:
+    """
+    Number of names in the list that haven't been picked, which is also the
+    next free PickSlot.slot
+    """
+    execute(cursor, "remaining_picks", (list_id,))
+    return int(cursor.fetchone()[0])
+
+
+def pick(list_title: str, rng: Optional[Random] = None) -> str:
+    """
+    Picks a random name from the list that hasn't been picked before, and
+    records the pick
+
+    The random slot is filled with the name from the last slot, so each pick
+    touches a couple of rows no matter how big the list is. Picks happen
+    inside an IMMEDIATE transaction, so two pickers can never get the same
+    name, even from different processes.
+    """
+    start = perf_counter()
+    list_id = select_list(title=list_title)
+    with session("pick"):
+        name = pick_in(db.get_connection().cursor(), list_id, list_title, rng)
+    metrics.increment("picks_total")
+    metrics.observe("pick_seconds", perf_counter() - start)
+    return name
+
+
+def pick_in(
+    cursor: sqlite3.Cursor,
+    list_id: int,
+    list_title: str,
+    rng: Optional[Random] = None,
+) -> str:
+    """
+    Does the work of pick() in the transaction cursor is in
+    """
+    remaining = remaining_picks(cursor, list_id)
+    if remaining == 0:
+        raise NoNamesLeftError(f"Every name in '{list_title}' has been picked")
+
+    slot = rng.randrange(remaining) if rng is not None else randrange(remaining)
+    last_slot = remaining - 1
+    execute(cursor, "pick_slots", (list_id, slot, last_slot))
+    names = dict(cursor.fetchall())
+    if slot != last_slot:
+        execute(cursor, "fill_slot", (names[last_slot], list_id, slot))
+    execute(cursor, "delete_slot", (list_id, last_slot))
+    cursor.execute(
+        'INSERT INTO "Pick" ("name", "list", "date_picked") VALUES (?, ?, ?)',
+        (names[slot], list_id, datetime2timestamp(time_now())),
+    )
+    record_fair_pick(cursor, list_id, names[slot])
+    next_generation(cursor)
+    execute(cursor, "name_value", (names[slot],))
+    return str(cursor.fetchone()[0])
+
+
+def floyd_sample(population: int, k: int, rng: Optional[Random] = None) -> List[int]:
+    """
+    k different numbers from range(population), in random order, drawing k
+    random numbers with Robert Floyd's algorithm
+    """
+    rng = rng or Random()
+    chosen: Dict[int, None] = dict()
+    for top in range(population - k, population):
+        number = rng.randrange(top + 1)
+        chosen[top if number in chosen else number] = None
+    sample = list(chosen)
+    rng.shuffle(sample)
+    return sample
+
+
+def pick_many(
+    list_title: str,
+    k: int,
+    exclude_picked: bool = True,
+    rng: Optional[Random] = None,
+) -> List[str]:
+    """
+    Picks k different random names from the list, and records every pick in
+    one transaction
+
+    With exclude_picked, only names that haven't been picked are chosen, and
+    they're used up like with pick(): the chosen PickSlots are filled from
+    the end of the list, so a pick takes time in proportion to k, not to the
+    size of the list. Without it, any name in the list can be chosen, and
+    PickSlot isn't changed; the names are found by their ListSlots instead,
+    which takes time in proportion to k too.
+    """
+    if k < 0:
+        raise ValueError(f"k can't be negative; got {k}")
+    start = perf_counter()
+    list_id = select_list(title=list_title)
+    with session("pick_many"):
+        cursor = db.get_connection().cursor()
+        names = pick_many_in(cursor, list_id, list_title, k, exclude_picked, rng)
+    metrics.increment("picks_total", k)
+    metrics.observe("pick_seconds", perf_counter() - start)
+    return names
+
+
+def pick_many_in(
+    cursor: sqlite3.Cursor,
+    list_id: int,
+    list_title: str,
+    k: int,
+    exclude_picked: bool = True,
+    rng: Optional[Random] = None,
+) -> List[str]:
+    """
+    Does the work of pick_many() in the transaction cursor is in
+    """
+    if exclude_picked:
+        population = remaining_picks(cursor, list_id)
+        if k > population:
+            raise NoNamesLeftError(
+                f"Only {population} names in '{list_title}' haven't been picked"
+            )
+        numbers = floyd_sample(population, k, rng)
+        rows = execute(cursor, "slot_names", (list_id, json.dumps(numbers))).fetchall()
+        empty_slots(cursor, list_id, numbers, population)
+    else:
+        (population,) = execute(cursor, "list_size", (list_id,)).fetchone()
+        if k > population:
+            raise NoNamesLeftError(f"'{list_title}' has only {population} names")
+        numbers = floyd_sample(population, k, rng)
+        rows = execute(
+            cursor, "list_slot_names", (list_id, json.dumps(numbers))
+        ).fetchall()
+    found = dict(rows)
+    name_ids = [found[number] for number in numbers]
+
+    date_picked = datetime2timestamp(time_now())
+    cursor.executemany(
+        'INSERT INTO "Pick" ("name", "list", "date_picked") VALUES (?, ?, ?)',
+        ((name_id, list_id, date_picked) for name_id in name_ids),
+    )
+    for name_id in name_ids:
+        record_fair_pick(cursor, list_id, name_id)
+    next_generation(cursor)
+    values = dict(execute(cursor, "name_values", (json.dumps(name_ids),)).fetchall())
+    return [values[name_id] for name_id in name_ids]
+
+
+def pick_lists(
+    counts: Dict[str, int], rng: Optional[Random] = None
+) -> Dict[str, List[str]]:
+    """
+    Picks counts[title] different names that haven't been picked from each
+    list, all in one transaction, so if any list is missing or has too few
+    names left, nothing is picked from any of them
+    """
+    start = perf_counter()
+    with session("pick_lists"):
+        names = pick_lists_in(db.get_connection().cursor(), counts, rng)
+    metrics.increment("picks_total", sum(counts.values()))
+    metrics.observe("pick_seconds", perf_counter() - start)
+    return names
+
+
+def pick_lists_in(
+    cursor: sqlite3.Cursor, counts: Dict[str, int], rng: Optional[Random] = None
+) -> Dict[str, List[str]]:
+    """
+    Does the work of pick_lists() in the transaction cursor is in
+    """
+    for k in counts.values():
+        if k < 0:
+            raise ValueError(f"k can't be negative; got {k}")
+    return {
+        title: pick_many_in(cursor, list_id_in(cursor, title), title, k, rng=rng)
+        for title, k in counts.items()
+    }
+
+
+def reset_picks(list_title: str) -> int:
+    """
+    Makes every name in the list available to be picked again, and returns
+    how many there are
+
+    The history of picks in Pick is kept.
+    """
+    list_id = select_list(title=list_title)
+    with session("reset_picks"):
+        connection = db.get_connection()
+        connection.execute('DELETE FROM "PickSlot" WHERE "list" = ?', (list_id,))
+        names = execute(connection, "list_names", (list_id,))
+        connection.executemany(
+            'INSERT INTO "PickSlot" ("list", "slot", "name") VALUES (?, ?, ?)',
+            ((list_id, slot, name_id) for slot, (name_id,) in enumerate(names)),
+        )
+        next_generation(connection.cursor())
+        return remaining_picks(connection.cursor(), list_id)
+
+
+def drop_weight_trees(
+    cursor: sqlite3.Cursor, list_id: int, mode: Optional[WeightMode] = None
+) -> None:
+    """
+    Deletes a list's PickWeight trees, or just its tree for mode, to be built
+    again; after names are added or removed, say
+    """
+    if mode is None:
+        cursor.execute('DELETE FROM "PickWeight" WHERE "list" = ?', (list_id,))
+    else:
+        cursor.execute(
+            'DELETE FROM "PickWeight" WHERE "list" = ? AND "mode" = ?',
+            (list_id, mode),
+        )
+
+
+def build_weight_tree(cursor: sqlite3.Cursor, list_id: int, mode: WeightMode) -> int:
+    """
+    Fills PickWeight for a list and mode from NameData and Pick, and returns
+    how many names it holds
+
+    'fair' weights count only the picks each name has had beyond the least
+    picked name's, which are all a pick chooses between
+    """
+    rows = execute(cursor, "name_weights", (list_id,)).fetchall()
+    if mode == "fair":
+        least = min((picks for _, _, picks in rows), default=0)
+        weights = [weight * fair_decay ** (picks - least) for _, weight, picks in rows]
+    else:
+        weights = [weight for _, weight, _ in rows]
+    totals = [0.0] + weights
+    for position in range(1, len(totals)):
+        parent = position + (position & -position)
+        if parent < len(totals):
+            totals[parent] += totals[position]
+    cursor.executemany(
+        'INSERT INTO "PickWeight" ("list", "mode", "position", "name", "weight", '
+        '"total") VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (list_id, mode, position, name_id, weight, totals[position])
+            for position, ((name_id, _, _), weight) in enumerate(
+                zip(rows, weights), start=1
+            )
+        ),
+    )
+    return len(rows)
+
+
+def weight_tree_size(cursor: sqlite3.Cursor, list_id: int, mode: WeightMode) -> int:
+    """
+    Number of names in a list's tree for mode, building it first if needed
+    """
+    (size,) = execute(cursor, "weight_tree_size", (list_id, mode)).fetchone()
+    if size is None:
+        return build_weight_tree(cursor, list_id, mode)
+    return int(size)
+
+
+def set_leaf_weight(
+    cursor: sqlite3.Cursor,
+    list_id: int,
+    mode: WeightMode,
+    position: int,
+    old_weight: float,
+    weight: float,
+) -> None:
+    """
+    Changes the weight at position, and every total that includes it
+    """
+    size = weight_tree_size(cursor, list_id, mode)
+    parents = []
+    while position <= size:
+        parents.append(position)
+        position += position & -position
+    execute(cursor, "set_weight_leaf", (weight, list_id, mode, parents[0]))
+    execute(
+        cursor,
+        "add_weight_totals",
+        (weight - old_weight, list_id, mode, json.dumps(parents)),
+    )
+
+
+def record_fair_pick(cursor: sqlite3.Cursor, list_id: int, name_id: int) -> None:
+    """
+    Lowers the weight of a name that was just picked in the list's 'fair'
+    tree, if it has one
+    """
+    row = execute(cursor, "weight_position", (list_id, "fair", name_id)).fetchone()
+    if row is not None:
+        position, weight = row
+        set_leaf_weight(cursor, list_id, "fair", position, weight, weight * fair_decay)
+
+
+def weighted_pick(
+    list_title: str, mode: WeightMode = "weight", rng: Optional[Random] = None
+) -> str:
+    """
+    Picks a random name from the list, each with a chance proportional to its
+    weight, and records the pick
+
+    In 'weight' mode, a name's weight is its NameData.weight. In 'fair' mode,
+    that's multiplied by fair_decay for each time the name has been picked,
+    so the names picked least often come up most. Unlike pick(), names can be
+    picked again, and PickSlot isn't changed.
+
+    The weights are kept in a PickWeight tree, so a pick reads about log2(n)
+    rows to find the name, and writes as many to lower its weight in 'fair'
+    mode. The tree is built the first time it's needed, which reads the
+    whole list; in 'fair' mode, it's built again whenever its weights add up
+    to less than fair_rebuild_below, with each name's weight counting only
+    the picks it's had beyond the least picked name's.
+    """
+    if mode not in weight_modes:
+        raise ValueError(f"'{mode}' is not one of {', '.join(weight_modes)}")
+    start = perf_counter()
+    list_id = select_list(title=list_title)
+    with session("weighted_pick"):
+        cursor = db.get_connection().cursor()
+        size = weight_tree_size(cursor, list_id, mode)
+        # The totals of these positions add up to every weight in the tree
+        roots = []
+        position = size
+        while position > 0:
+            roots.append(position)
+            position -= position & -position
+        (total,) = execute(
+            cursor, "weight_prefix_sum", (list_id, mode, json.dumps(roots))
+        ).fetchone()
+        if mode == "fair" and total < fair_rebuild_below:
+            drop_weight_trees(cursor, list_id, mode)
+            build_weight_tree(cursor, list_id, mode)
+            (total,) = execute(
+                cursor, "weight_prefix_sum", (list_id, mode, json.dumps(roots))
+            ).fetchone()
+        if total <= 0:
+            raise NoNamesLeftError(f"No name in '{list_title}' has any weight")
+
+        # Walks down the tree to the first position whose running total is
+        # more than target
+        target = (rng.random() if rng is not None else random()) * total
+        position = 0
+        step = 1 << (size.bit_length() - 1)
+        while step:
+            if position + step <= size:
+                execute(cursor, "weight_node", (list_id, mode, position + step))
+                (node_total,) = cursor.fetchone()
+                if node_total <= target:
+                    position += step
+                    target -= node_total
+            step >>= 1
+        # Rounding can leave target at the very end of the last name
+        position = min(position + 1, size)
+
+        execute(cursor, "weight_leaf", (list_id, mode, position))
+        name_id, _ = cursor.fetchone()
+        cursor.execute(
+            'INSERT INTO "Pick" ("name", "list", "date_picked") VALUES (?, ?, ?)',
+            (name_id, list_id, datetime2timestamp(time_now())),
+        )
+        record_fair_pick(cursor, list_id, name_id)
+        next_generation(cursor)
+        execute(cursor, "name_value", (name_id,))
+        name = str(cursor.fetchone()[0])
+    metrics.increment("picks_total")
+    metrics.observe("pick_seconds", perf_counter() - start)
+    return name
+
+
+def set_weight(list_title: str, name: str, weight: float) -> None:
+    """
+    Sets how likely weighted_pick() is to pick a name in the list, updating
+    the list's 'weight' tree in place; its 'fair' tree is built again
+    """
+    if not 0 <= weight < float("inf"):
+        raise ValueError(f"weight must be a finite number, at least 0; got {weight}")
+    list_id = select_list(title=list_title)
+    with session("set_weight"):
+        cursor = db.get_connection().cursor()
+        row = execute(cursor, "set_name_weight", (weight, list_id, name)).fetchone()
+        if row is None:
+            raise NameNotFoundError(f"'{name}' isn't in '{list_title}'")
+        (name_id,) = row
+        next_generation(cursor)
+        row = execute(
+            cursor, "weight_position", (list_id, "weight", name_id)
+        ).fetchone()
+        if row is not None:
+            position, old_weight = row
+            set_leaf_weight(cursor, list_id, "weight", position, old_weight, weight)
+        drop_weight_trees(cursor, list_id, "fair")
+
+
+T = TypeVar("T")
+
+
+def list_id_in(cursor: sqlite3.Cursor, title: str) -> int:
+    """
+    Like select_list(), in the transaction cursor is in
+    """
+    row = execute(cursor, "list_id", (title,)).fetchone()
+    if row is None:
+        raise ListNotFoundError(f"No list titled '{title}'")
+    return int(row[0])
+
+
+class WriteBatch:
+    """
+    What a WriteBehindQueue gives each write: the cursor of the transaction
+    it's part of, and a way to run code once that's committed
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self.cursor = cursor
+        self.callbacks: List[Callable[[], None]] = []
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        self.callbacks.append(callback)
+
+
+Write = Callable[[WriteBatch], Any]
+
+
+class WriteBehindQueue:
+    """
+    Runs writes on one thread, committing many at a time, so a busy process
+    pays for one transaction and fsync() per group instead of per write
+
+    A group is committed once it has group_size writes, or group_delay
+    seconds after its first write arrived. Each write runs in a SAVEPOINT,
+    so one that raises is rolled back alone. The Future submit() returns
+    resolves only after the write's group is committed, so a write whose
+    Future has a result survives the process crashing; with the 'fast'
+    connection profile, it can still be lost to a power failure.
+
+    At most max_pending writes can wait; after that, submit() blocks, and
+    raises WriteQueueFullError if it's still full after timeout seconds.
+    """
+
+    def __init__(
+        self,
+        group_size: int = default_group_size,
+        group_delay: float = default_group_delay,
+        max_pending: int = default_write_queue_size,
+    ) -> None:
+        if group_size < 1:
+            raise ValueError(f"group_size must be at least 1; got {group_size}")
+        self.group_size = group_size
+        self.group_delay = group_delay
+        self.pending: "queue.Queue[Optional[Tuple[Future[Any], Write]]]" = (
+            queue.Queue(maxsize=max_pending)
+        )
+        self.closed = False
+        # Writes accepted while open that aren't queued yet; close() waits
+        # for them, so its sentinel can't go in ahead of a write, leaving it
+        # behind to never run
+        self.submitting = 0
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(
+            target=self.run, name="namepicker-writer", daemon=True
+        )
+        self.thread.start()
+
+    def submit(
+        self, write: Callable[[WriteBatch], T], timeout: Optional[float] = None
+    ) -> "Future[T]":
+        future: "Future[T]" = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The write-behind queue is closed")
+            self.submitting += 1
+        # Not holding the lock, which would make every other submit() wait
+        # while this one waits for room
+        try:
+            self.pending.put((future, write), timeout=timeout)
+        except queue.Full:
+            raise WriteQueueFullError(
+                f"{self.pending.maxsize} writes are already waiting"
+            ) from None
+        finally:
+            with self.lock:
+                self.submitting -= 1
+                self.lock.notify_all()
+        return future
+
+    def pick(
+        self,
+        list_title: str,
+        rng: Optional[Random] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[str]":
+        """
+        Like pick(), but without waiting
+        """
+
+        def write(batch: WriteBatch) -> str:
+            list_id = list_id_in(batch.cursor, list_title)
+            name = pick_in(batch.cursor, list_id, list_title, rng)
+            batch.after_commit(lambda: metrics.increment("picks_total"))
+            return name
+
+        return self.submit(write, timeout=timeout)
+
+    def pick_lists(
+        self,
+        counts: Dict[str, int],
+        rng: Optional[Random] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[Dict[str, List[str]]]":
+        """
+        Like pick_lists(), but without waiting
+        """
+
+        def write(batch: WriteBatch) -> Dict[str, List[str]]:
+            names = pick_lists_in(batch.cursor, counts, rng)
+            batch.after_commit(
+                lambda: metrics.increment("picks_total", sum(counts.values()))
+            )
+            return names
+
+        return self.submit(write, timeout=timeout)
+
+    def add_names(
+        self, list_title: str, names: List[str], timeout: Optional[float] = None
+    ) -> "Future[int]":
+        """
+        Like bulk_import() of one chunk of names, but without waiting; the
+        Future resolves to how many names were new to the list
+        """
+
+        def write(batch: WriteBatch) -> int:
+            batch.cursor.execute(
+                'INSERT OR IGNORE INTO "NameList" ("title") VALUES (?)', (list_title,)
+            )
+            list_id = list_id_in(batch.cursor, list_title)
+            added = add_names(batch.cursor, list_id, names)
+            batch.after_commit(lambda: list_changed(list_id))
+            batch.after_commit(
+                lambda: metrics.increment("names_imported_total", added)
+            )
+            return added
+
+        return self.submit(write, timeout=timeout)
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self.pending.get()
+            if first is None:
+                return
+            group = [first]
+            deadline = monotonic() + self.group_delay
+            while len(group) < self.group_size:
+                try:
+                    item = self.pending.get(timeout=max(deadline - monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            self.commit(group)
+
+    def commit(self, group: List[Tuple["Future[Any]", Write]]) -> None:
+        outcomes: List[Tuple["Future[Any]", Any, Optional[BaseException]]] = []
+        callbacks: List[Callable[[], None]] = []
+        # Writes whose Futures were cancelled are skipped
+        group = [
+            (future, write)
+            for future, write in group
+            if future.set_running_or_notify_cancel()
+        ]
+        try:
+            with session("write_behind"):
+                batch = WriteBatch(db.get_connection().cursor())
+                for future, write in group:
+                    batch.callbacks = []
+                    batch.cursor.execute("SAVEPOINT write_behind")
+                    try:
+                        result = write(batch)
+                    except Exception as err:
+                        batch.cursor.execute("ROLLBACK TO write_behind")
+                        outcomes.append((future, None, err))
+                    else:
+                        callbacks.extend(batch.callbacks)
+                        outcomes.append((future, result, None))
+                    batch.cursor.execute("RELEASE write_behind")
+        except Exception as err:
+            log.exception(f"Failed to commit {len(group)} writes")
+            for future, _ in group:
+                future.set_exception(err)
+            return
+
+        metrics.observe("write_group_size", len(group))
+        for callback in callbacks:
+            callback()
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self) -> None:
+        """
+        Commits every write already submitted, and stops the thread
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.lock.wait_for(lambda: not self.submitting)
+        self.pending.put(None)
+        self.thread.join()
+
+    def __enter__(self) -> "WriteBehindQueue":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
 #@orm.db_session()
 #def select_list(list_title: str) -> Iterator[NameTuple]:
 #    if not isinstance(list_title, str):
@@ -70,5 +1874,3 @@ def enable_debugging(enable: bool = True, enable_sql: bool = True) -> None:
 #    query = NameList.select(name for name in Name if list_title in name.lists)
 #    for item in query:
 #        yield NameTuple(value=item.value, lists=[l.title for l in item.lists])
-
-
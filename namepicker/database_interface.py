@@ -1,9 +1,23 @@
 """
 Uses database.py to provide a (mostly) typed interface to the database
 """
-from typing import Iterable, Iterator, Union, Optional
+from collections import OrderedDict
+from typing import Collection, Iterator, Mapping, Optional, Tuple, Union
 from pathlib import Path
-from .database import ListNotFoundError, select_list
+from .database import (
+    ImportStats,
+    ListNotFoundError,
+    SyncStats,
+    bulk_import,
+    count_list_names,
+    count_lists,
+    iter_list_names,
+    iter_list_titles,
+    list_has_name,
+    list_version,
+    select_list,
+    sync_import,
+)
 
 # def save_names()
 # 
@@ -15,6 +29,9 @@ from .database import ListNotFoundError, select_list
 
 SPath = Union[str, Path]
 
+# Number of lists NameList remembers the database ids and sizes of
+default_cache_size = 128
+
 class FileError(Exception):
     """
     Generic file error
@@ -41,26 +58,99 @@ class FileError(Exception):
 #     date_added: datetime
 
 
-class NameList:
-    def __contains__(self, list_title: str) -> bool:
+class ListNames(Collection[str]):
+    """
+    The names in one list, read from the database only when they're needed
+    """
+    def __init__(self, title: str, list_id: int) -> None:
+        self.title = title
+        self.list_id = list_id
+        self._length: Optional[int] = None
+        self._version = -1
+
+    def __iter__(self) -> Iterator[str]:
+        return iter_list_names(self.list_id)
+
+    def __len__(self) -> int:
+        # Counted again only after the list is changed
+        version = list_version(self.list_id)
+        if self._length is None or version != self._version:
+            self._length = count_list_names(self.list_id)
+            self._version = version
+        return self._length
+
+    def __contains__(self, name: object) -> bool:
+        if not isinstance(name, str):
+            return False
+        return list_has_name(self.list_id, name)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(title={self.title!r}, list_id={self.list_id})"
+
+    def __eq__(self, other: object) -> bool:
+        # The same list, so the same names
+        if isinstance(other, ListNames):
+            return (self.title, self.list_id) == (other.title, other.list_id)
+        return NotImplemented
+
+
+class NameList(Mapping[str, ListNames]):
+    """
+    Maps the title of every list in the database to its names
+
+    Nothing is loaded up front: titles and names are paged in as they're
+    iterated over, and the most recently used cache_size lists are kept.
+    A cached list is only looked up again once database.list_changed() has
+    been called for it, by an import, a sync, or removing the list, so one
+    that has been removed, or removed and made again, isn't handed out.
+    Changes made by other processes aren't seen until clear_cache()
+    """
+    def __init__(self, cache_size: int = default_cache_size) -> None:
+        self.cache_size = cache_size
+        # Each list, with its list_version() when it was looked up
+        self._cache: "OrderedDict[str, Tuple[ListNames, int]]" = OrderedDict()
+
+    def __contains__(self, list_title: object) -> bool:
         if not isinstance(list_title, str):
             return False
         try:
-            select_list(title=list_title)
-        except ListNotFoundError as err:
+            self[list_title]
+        except KeyError:
             return False
-        
+
         return True
-    
-    def __getitem__
-    def __iter__
-    def __len__
-    def keys
-    def items
-    def values
-    def get
-    def __eq__
-    def __ne__
+
+    def __getitem__(self, list_title: str) -> ListNames:
+        cached = self._cache.get(list_title)
+        if cached is not None and cached[1] == list_version(cached[0].list_id):
+            self._cache.move_to_end(list_title)
+            return cached[0]
+
+        try:
+            list_id = select_list(title=list_title)
+        except ListNotFoundError as err:
+            self._cache.pop(list_title, None)
+            raise KeyError(list_title) from err
+
+        if cached is not None and cached[0].list_id == list_id:
+            names = cached[0]
+        else:
+            names = ListNames(title=list_title, list_id=list_id)
+        self._cache[list_title] = (names, list_version(list_id))
+        self._cache.move_to_end(list_title)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter_list_titles()
+
+    def __len__(self) -> int:
+        return count_lists()
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
 
 def lines_in_file(filename: SPath) -> Iterator[str]:
     path = Path(filename)
@@ -78,7 +168,7 @@ def lines_in_file(filename: SPath) -> Iterator[str]:
         for line in f:
             yield line
 
-def import_file(filename: SPath, title: Optional[str] = None) -> NameList:
+def import_file(filename: SPath, title: Optional[str] = None) -> ImportStats:
     path = Path(filename)
     
     if not (title or path.name):
@@ -89,7 +179,17 @@ def import_file(filename: SPath, title: Optional[str] = None) -> NameList:
     else:
         list_title = path.name
     
-    for name in lines_in_file(path):
-        add_names(name=name, list_title=list_title)
-    
-    return NameList[list_title]
+    return bulk_import(list_title=list_title, names=lines_in_file(path))
+
+
+def sync_file(filename: SPath, title: Optional[str] = None) -> SyncStats:
+    """
+    Like import_file(), but also removes names from the list that are no
+    longer in the file
+    """
+    path = Path(filename)
+    list_title = title if title is not None else path.name
+    if not list_title:
+        raise ValueError("No title specified, and can't use filename as title of list")
+
+    return sync_import(list_title=list_title, names=lines_in_file(path))
@@ -0,0 +1,294 @@
+"""
+Streams the names in a list, or generated names, to files that other tools
+can read: one name per line, CSV, JSON Lines, or Arrow and Parquet
+
+Rows are read and written a chunk at a time, through a large buffer, so
+exports take the same memory however big they are. Lists are exported with
+when each name was added; generated names have only the name column.
+
+Arrow and Parquet need pyarrow, which is installed with the 'columnar' extra.
+"""
+import csv
+import io
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from importlib.util import find_spec
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    BinaryIO,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from .iterators import chunked
+from .metrics import metrics
+from .settings import (
+    ExportFormat,
+    default_export_format,
+    export_formats,
+    export_suffixes,
+)
+
+SPath = Union[str, Path]
+# A value for each column; dates are ISO 8601 strings
+Row = Tuple[str, ...]
+
+has_pyarrow = find_spec("pyarrow") is not None
+
+# Rows written at a time; for Parquet, also the rows in each row group
+default_export_chunk_size = 65_536
+# Bytes buffered before each write to the file
+write_buffer_size = 1024 * 1024
+
+list_columns = ("name", "date_added")
+name_columns = ("name",)
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportStats(NamedTuple):
+    # None for standard output
+    path: Optional[Path]
+    format: ExportFormat
+    rows: int
+    seconds: float
+
+
+def export_format(path: Optional[SPath], format: Optional[str] = None) -> ExportFormat:
+    """
+    The format to write path in: format if it's given, or else the one its
+    suffix stands for
+    """
+    if format is None:
+        suffix = Path(path).suffix.lower() if path is not None else ""
+        return export_suffixes.get(suffix, default_export_format)
+    for known in export_formats:
+        if format == known:
+            return known
+    raise ValueError(f"'{format}' is not one of {', '.join(export_formats)}")
+
+
+class ChunkWriter(ABC):
+    """
+    Writes rows to a binary file in one format; rows are tuples with a value
+    for each of columns
+    """
+
+    def __init__(self, file: BinaryIO, columns: Sequence[str]) -> None:
+        self.file = file
+        self.columns = tuple(columns)
+
+    @abstractmethod
+    def write(self, rows: Sequence[Row]) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class TextWriter(ChunkWriter):
+    """
+    The first column only, one value per line
+    """
+
+    def write(self, rows: Sequence[Row]) -> None:
+        text = "\n".join(row[0] for row in rows) + "\n"
+        self.file.write(text.encode("utf-8"))
+
+
+class CSVWriter(ChunkWriter):
+    def __init__(self, file: BinaryIO, columns: Sequence[str]) -> None:
+        super().__init__(file, columns)
+        self.write([self.columns])
+
+    def write(self, rows: Sequence[Row]) -> None:
+        text = io.StringIO()
+        csv.writer(text, lineterminator="\n").writerows(rows)
+        self.file.write(text.getvalue().encode("utf-8"))
+
+
+class JSONLinesWriter(ChunkWriter):
+    def __init__(self, file: BinaryIO, columns: Sequence[str]) -> None:
+        super().__init__(file, columns)
+        # json.dumps() with options makes a new encoder every call
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, rows: Sequence[Row]) -> None:
+        encode, columns = self.encode, self.columns
+        lines = [encode(dict(zip(columns, row))) + "\n" for row in rows]
+        self.file.write("".join(lines).encode("utf-8"))
+
+
+class BatchWriter(Protocol):
+    """
+    What ArrowWriter needs of pyarrow's IPC and Parquet file writers
+    """
+
+    def write_batch(self, batch: object) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class ArrowWriter(ChunkWriter):
+    """
+    An Arrow IPC file, or a Parquet file, with one record batch or row group
+    per chunk; date_added is stored as a timestamp
+    """
+
+    def __init__(
+        self, file: BinaryIO, columns: Sequence[str], parquet: bool = False
+    ) -> None:
+        super().__init__(file, columns)
+        if not has_pyarrow:
+            raise ExportError(
+                "Arrow and Parquet files need pyarrow; install namepicker[columnar]"
+            )
+        import pyarrow
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                (column, pyarrow.timestamp("us", tz="UTC"))
+                if column == "date_added"
+                else (column, pyarrow.string())
+                for column in self.columns
+            ]
+        )
+        self.writer: BatchWriter
+        if parquet:
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(file, self.schema)
+        else:
+            import pyarrow.ipc
+
+            self.writer = pyarrow.ipc.new_file(file, self.schema)
+
+    def write(self, rows: Sequence[Row]) -> None:
+        arrays = [
+            self.pyarrow.array(values, self.pyarrow.string()).cast(field.type)
+            for values, field in zip(zip(*rows), self.schema)
+        ]
+        self.writer.write_batch(
+            self.pyarrow.record_batch(arrays, schema=self.schema)
+        )
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def open_writer(
+    file: BinaryIO, format: ExportFormat, columns: Sequence[str]
+) -> ChunkWriter:
+    if format == "text":
+        return TextWriter(file, columns)
+    if format == "csv":
+        return CSVWriter(file, columns)
+    if format == "jsonl":
+        return JSONLinesWriter(file, columns)
+    return ArrowWriter(file, columns, parquet=format == "parquet")
+
+
+@contextmanager
+def output_file(path: Optional[SPath]) -> Iterator[BinaryIO]:
+    """
+    A buffered binary file to export to, standing for standard output if
+    path is None or '-'
+
+    Files are written under a temporary name, and only replace path once
+    everything has been written.
+    """
+    if path is None or str(path) == "-":
+        sys.stdout.flush()
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+        return
+    path = Path(path)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with temporary.open("wb", buffering=write_buffer_size) as file:
+            yield file
+        os.replace(temporary, path)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+
+def export_chunks(
+    chunks: Iterable[Sequence[Row]],
+    path: Optional[SPath],
+    columns: Sequence[str],
+    format: Optional[str] = None,
+) -> ExportStats:
+    """
+    Writes each chunk of rows as it arrives, and returns how many there were
+    """
+    start = perf_counter()
+    resolved = export_format(path, format)
+    rows = 0
+    with output_file(path) as file:
+        writer = open_writer(file, resolved, columns)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                rows += len(chunk)
+        finally:
+            writer.close()
+    stats = ExportStats(
+        path=None if path is None or str(path) == "-" else Path(path),
+        format=resolved,
+        rows=rows,
+        seconds=perf_counter() - start,
+    )
+    metrics.increment("rows_exported_total", stats.rows, format=resolved)
+    metrics.observe("export_seconds", stats.seconds, format=resolved)
+    return stats
+
+
+def export_list(
+    list_title: str,
+    path: Optional[SPath],
+    format: Optional[str] = None,
+    chunk_size: int = default_export_chunk_size,
+) -> ExportStats:
+    """
+    Writes every name in a list, with when it was added, to path, or to
+    standard output if it's None or '-'
+    """
+    # Imported here, so exporting generated names doesn't need Pony
+    from . import database
+
+    # Every page is read in one transaction, so the file doesn't mix the list
+    # from before and after a change made while it's written
+    with database.read_transaction("export_list") as connection:
+        list_id = database.list_id_in(connection.cursor(), list_title)
+        rows = database.iter_list_name_data_in(connection, list_id, chunk_size)
+        return export_chunks(chunked(rows, chunk_size), path, list_columns, format)
+
+
+def export_names(
+    names: Iterable[str],
+    path: Optional[SPath],
+    format: Optional[str] = None,
+    chunk_size: int = default_export_chunk_size,
+) -> ExportStats:
+    """
+    Writes names, like those from generate.rand_names(), to path, or to
+    standard output if it's None or '-'; names is read chunk_size at a time,
+    so it can be endless if it's cut off with islice()
+    """
+    rows = ((name,) for name in names)
+    return export_chunks(chunked(rows, chunk_size), path, name_columns, format)
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
+import hashlib
 import json
+import math
+import mmap
+import os
+import struct
 import sys
 import typing
+from array import array
+from bisect import bisect_right
 from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from csv import DictReader
-from itertools import accumulate, islice
+from importlib import resources
+from importlib.util import find_spec
+from itertools import accumulate, count as counter, islice
 from pathlib import Path
-from random import choices, randint
+from random import Random, choices, randint, random
 from re import compile as re_compile
 from string import ascii_lowercase
 from typing import (
@@ -14,12 +24,17 @@ from typing import (
     Callable,
     Deque,
     Dict,
+    Iterable,
     Iterator,
     List,
+    Literal,
+    NamedTuple,
     Optional,
+    Tuple,
     TypedDict,
     TypeVar,
     Union,
+    cast,
 )
 
 assert sys.version_info >= (
@@ -27,8 +42,17 @@ assert sys.version_info >= (
     8,
 ), f"Python 3.8 or higher required\ndetected version: {sys.version}"
 
+# NumPy is optional, and only used to generate large batches of names; it's
+# imported the first time it's used, since importing it is slow. The engine
+# that uses it is in numpy_engine.py, which can't be imported when this file
+# is run as a script.
+has_numpy = bool(__package__) and find_spec("numpy") is not None
+
 
 default_config_file = "./generate_config.json"
+default_census_file = "./Names_2010Census.csv"
+# Letter weights and n-gram models computed from the census file are kept here
+default_cache_dir = "./generate_cache"
 SPath = Union[str, Path]
 
 
@@ -36,6 +60,9 @@ class Config(TypedDict):
     min_length: int
     max_length: int
     letter_weights: Dict[str, float]
+    # Names are generated from an n-gram model of the census names when this
+    # is 2 or more; otherwise letters are drawn independently by letter_weights
+    ngram_order: int
 
 
 default_weights = {
@@ -68,18 +95,26 @@ default_weights = {
     " ": 1.7729694845357168e-06,
 }
 default_tries: int = 3
+Engine = Literal["python", "numpy"]
 default_config: Config = {
     "max_length": 8,
     "min_length": 3,
     "letter_weights": default_weights,
+    "ngram_order": 1,
 }
+default_model_file = "./generate_model.bin"
+# Names each worker process generates at a time in parallel_rand_names()
+default_chunk_size = 100_000
+# Pad the start of names, and mark their end, when training n-gram models
+start_symbol = "^"
+end_symbol = "$"
 
 
-def name_list() -> Iterator[str]:
+def name_list(source: SPath = default_census_file) -> Iterator[str]:
     """Parses names out of file linked from:
     https://www.census.gov/topics/population/genealogy/data/2010_surnames.html"""
 
-    path = Path("Names_2010Census.csv").resolve()
+    path = Path(source).resolve()
 
     if not path.is_file():
         raise FileNotFoundError(f"'{path}' is not a file")
@@ -90,9 +125,9 @@ def name_list() -> Iterator[str]:
             yield row["name"].lower()
 
 
-def letter_weights() -> Dict[str, float]:
+def count_letter_weights(names: Iterable[str]) -> Dict[str, float]:
     letter_counts: typing.Counter[str] = Counter()
-    for name in name_list():
+    for name in names:
         letter_counts.update(name)
 
     total_num_letters = sum(letter_counts[letter] for letter in letter_counts)
@@ -101,7 +136,568 @@ def letter_weights() -> Dict[str, float]:
     }
 
 
-def rand_name(length: int, weights: Dict[str, float]) -> str:
+class SourceStamp(NamedTuple):
+    """Identifies the contents of the file a cache was computed from"""
+
+    size: int
+    mtime_ns: int
+    digest: bytes
+
+
+cache_magic = b"NPCACHE1"
+cache_header = struct.Struct("<Qq32s")
+
+
+def hash_file(path: SPath) -> bytes:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def source_stamp(source: SPath) -> SourceStamp:
+    stat = Path(source).stat()
+    return SourceStamp(
+        size=stat.st_size, mtime_ns=stat.st_mtime_ns, digest=hash_file(source)
+    )
+
+
+def write_cache(cache_file: SPath, source: SPath, payload: bytes) -> None:
+    """Atomically replaces cache_file with payload, stamped with the current
+    size, mtime, and hash of source"""
+    path = Path(cache_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stamp = source_stamp(source)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_bytes(
+        cache_magic
+        + cache_header.pack(stamp.size, stamp.mtime_ns, stamp.digest)
+        + payload
+    )
+    os.replace(temporary, path)
+
+
+def read_cache(cache_file: SPath, source: SPath) -> Optional[memoryview]:
+    """Memory-maps cache_file, and returns its payload if it was computed from
+    the current contents of source, otherwise None
+
+    The file is only hashed when its size or mtime differ from the stamp; if
+    the contents turn out to be the same, the stamp is refreshed"""
+    path = Path(cache_file)
+    if not path.is_file():
+        return None
+
+    with path.open("rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+    header_size = len(cache_magic) + cache_header.size
+    if len(mapped) < header_size or mapped[: len(cache_magic)] != cache_magic:
+        return None
+    size, mtime_ns, digest = cast(
+        Tuple[int, int, bytes], cache_header.unpack_from(mapped, len(cache_magic))
+    )
+
+    stat = Path(source).stat()
+    if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        if hash_file(source) != digest:
+            return None
+        payload = mapped[header_size:]
+        write_cache(path, source, payload)
+        return memoryview(payload)
+
+    return memoryview(mapped)[header_size:]
+
+
+def letter_weights(
+    source: SPath = default_census_file, cache_dir: Optional[SPath] = default_cache_dir
+) -> Dict[str, float]:
+    """Frequency of each letter in the census names
+
+    Cached in cache_dir, unless it's None, until the census file changes"""
+    cache_file = Path(cache_dir) / "letter_weights.bin" if cache_dir else None
+    payload = read_cache(cache_file, source) if cache_file else None
+    if payload is not None:
+        (letters_size,) = cast(Tuple[int], struct.unpack_from("<H", payload))
+        letters = bytes(payload[2 : 2 + letters_size]).decode("utf-8")
+        weights = array("d")
+        weights.frombytes(payload[2 + letters_size :])
+        if sys.byteorder != "little":
+            weights.byteswap()
+        return dict(zip(letters, weights))
+
+    computed = count_letter_weights(name_list(source))
+    if cache_file:
+        encoded_letters = "".join(computed).encode("utf-8")
+        weights = array("d", computed.values())
+        if sys.byteorder != "little":
+            weights.byteswap()
+        write_cache(
+            cache_file,
+            source,
+            struct.pack("<H", len(encoded_letters))
+            + encoded_letters
+            + weights.tobytes(),
+        )
+    return computed
+
+
+class LetterSampler:
+    """Draws letters according to a dictionary of weights in constant time,
+    using Vose's alias method
+
+    The tables are built once, so a sampler should be reused for every name
+    instead of calling choices() with the weights each time"""
+
+    def __init__(self, weights: Dict[str, float], rng: Optional[Random] = None) -> None:
+        if not weights:
+            raise ValueError("Need at least one letter to sample from")
+        if any(weight < 0 for weight in weights.values()):
+            raise ValueError(f"Weights can't be negative: {weights}")
+        total = sum(weights.values())
+        if total <= 0:
+            raise ValueError(f"Weights must add up to more than 0: {weights}")
+
+        self.weights = weights
+        self.letters = list(weights)
+        size = len(self.letters)
+        scaled = [weight * size / total for weight in weights.values()]
+        self.probabilities = [1.0] * size
+        alias = list(range(size))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probabilities[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Anything left over is only short of 1 because of rounding
+        self.aliases = [self.letters[i] for i in alias]
+        self.random: Callable[[], float] = rng.random if rng is not None else random
+
+    def letter(self) -> str:
+        # The integer part of one uniform draw picks the column, and the
+        # fractional part decides between the column and its alias
+        draw = self.random() * len(self.letters)
+        column = int(draw)
+        if draw - column < self.probabilities[column]:
+            return self.letters[column]
+        return self.aliases[column]
+
+    def letters_of(self, length: int) -> str:
+        letters = self.letters
+        aliases = self.aliases
+        probabilities = self.probabilities
+        size = len(letters)
+        rand = self.random
+        sample = []
+        for _ in range(length):
+            draw = rand() * size
+            column = int(draw)
+            if draw - column < probabilities[column]:
+                sample.append(letters[column])
+            else:
+                sample.append(aliases[column])
+        return "".join(sample)
+
+    def name(self, length: int) -> str:
+        return self.letters_of(length).capitalize()
+
+
+# Either a list, or a view of uint32 counts in a serialized model
+CumulativeCounts = Union[List[int], memoryview]
+
+
+class NgramModel:
+    """Character n-gram model of names
+
+    Each letter is drawn based on the order - 1 letters before it, using a
+    table of cumulative counts for that context"""
+
+    magic = b"NPNGRAM1"
+    # How many times name() starts over before giving up on min_length
+    max_restarts = 1000
+
+    def __init__(
+        self,
+        order: int,
+        tables: Dict[str, Tuple[str, CumulativeCounts]],
+        rng: Optional[Random] = None,
+    ) -> None:
+        if order < 1:
+            raise ValueError(f"order must be at least 1; got {order}")
+        if start_symbol * (order - 1) not in tables:
+            raise ValueError("Model has no table for the start of a name")
+        self.order = order
+        # context -> (symbols that can follow it, cumulative counts of each)
+        self.tables = tables
+        self.random: Callable[[], float] = rng.random if rng is not None else random
+
+    @classmethod
+    def train(cls, names: Iterable[str], order: int) -> "NgramModel":
+        """Counts n-grams in one pass over names
+
+        Memory depends on the number of distinct contexts, which is limited by
+        the alphabet and order, not by how many names there are"""
+        if order < 1:
+            raise ValueError(f"order must be at least 1; got {order}")
+        context_size = order - 1
+        padding = start_symbol * context_size
+        counts: Dict[str, typing.Counter[str]] = {}
+        for name in names:
+            if start_symbol in name or end_symbol in name:
+                raise ValueError(
+                    f"Names can't contain '{start_symbol}' or '{end_symbol}': {name}"
+                )
+            padded = padding + name + end_symbol
+            for i in range(context_size, len(padded)):
+                context = padded[i - context_size : i]
+                if context not in counts:
+                    counts[context] = Counter()
+                counts[context][padded[i]] += 1
+
+        if not counts:
+            raise ValueError("Can't train a model without any names")
+
+        tables: Dict[str, Tuple[str, CumulativeCounts]] = dict()
+        for context, followers in counts.items():
+            symbols = "".join(sorted(followers))
+            tables[context] = (
+                symbols,
+                list(accumulate(followers[symbol] for symbol in symbols)),
+            )
+        return cls(order=order, tables=tables)
+
+    def name(
+        self, min_length: int = 0, max_length: int = 8, rng: Optional[Random] = None
+    ) -> str:
+        """A name drawn with rng, or with the model's own random stream"""
+        context_size = self.order - 1
+        tables = self.tables
+        rand = rng.random if rng is not None else self.random
+        for _ in range(self.max_restarts):
+            letters: List[str] = []
+            context = start_symbol * context_size
+            while len(letters) < max_length:
+                symbols, cumulative = tables[context]
+                total = cumulative[-1]
+                symbol = symbols[bisect_right(cumulative, rand() * total)]
+                if symbol == end_symbol:
+                    if len(letters) >= min_length:
+                        break
+                    # Too short to end, so draw again from every other symbol
+                    end = symbols.index(end_symbol)
+                    before = cumulative[end - 1] if end else 0
+                    ending = cumulative[end] - before
+                    if ending == total:
+                        # This context can only end a name, so start over
+                        break
+                    draw = rand() * (total - ending)
+                    if draw >= before:
+                        draw += ending
+                    symbol = symbols[bisect_right(cumulative, draw)]
+                letters.append(symbol)
+                if context_size:
+                    context = (context + symbol)[-context_size:]
+            if len(letters) >= min_length:
+                return "".join(letters).capitalize()
+
+        raise ValueError(f"Model can't make names of at least {min_length} letters")
+
+    def to_bytes(self) -> bytes:
+        """Serializes the model as:
+        magic, order, number of contexts, alphabet,
+        then for each context: its letters as alphabet indices, and one
+        cumulative uint32 count for every letter in the alphabet"""
+        symbols_used = set(start_symbol)
+        for symbols, _ in self.tables.values():
+            symbols_used.update(symbols)
+        alphabet = "".join(sorted(symbols_used))
+        if len(alphabet) > 255:
+            raise ValueError("Can't serialize a model with more than 255 symbols")
+        index = {symbol: i for i, symbol in enumerate(alphabet)}
+        encoded_alphabet = alphabet.encode("utf-8")
+        parts = [
+            self.magic,
+            struct.pack("<HIH", self.order, len(self.tables), len(encoded_alphabet)),
+            encoded_alphabet,
+        ]
+        for context, (symbols, cumulative) in self.tables.items():
+            parts.append(bytes(index[symbol] for symbol in context))
+            counts = dict()
+            previous = 0
+            for symbol, running in zip(symbols, cumulative):
+                counts[symbol] = running - previous
+                previous = running
+            row = array("I", accumulate(counts.get(symbol, 0) for symbol in alphabet))
+            if sys.byteorder != "little":
+                row.byteswap()
+            parts.append(row.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(
+        cls, data: Union[bytes, memoryview], rng: Optional[Random] = None
+    ) -> "NgramModel":
+        """Loads a model from to_bytes()
+
+        On little-endian machines, the count tables are read in place instead
+        of being copied, so a memory-mapped model is shared between processes"""
+        view = memoryview(data)
+        if bytes(view[: len(cls.magic)]) != cls.magic:
+            raise ValueError("Not an n-gram model file")
+        offset = len(cls.magic)
+        order, num_contexts, alphabet_size = cast(
+            Tuple[int, int, int], struct.unpack_from("<HIH", view, offset)
+        )
+        offset += struct.calcsize("<HIH")
+        alphabet = bytes(view[offset : offset + alphabet_size]).decode("utf-8")
+        offset += alphabet_size
+        context_size = order - 1
+        row_size = len(alphabet) * 4
+        if offset + num_contexts * (context_size + row_size) != len(view):
+            raise ValueError("n-gram model file is the wrong size")
+
+        tables: Dict[str, Tuple[str, CumulativeCounts]] = dict()
+        for _ in range(num_contexts):
+            context = "".join(alphabet[i] for i in view[offset : offset + context_size])
+            offset += context_size
+            row = view[offset : offset + row_size]
+            offset += row_size
+            # Letters that never follow this context repeat the previous
+            # cumulative count, so bisect_right() never lands on them
+            if sys.byteorder == "little":
+                tables[context] = (alphabet, row.cast("I"))
+            else:
+                swapped = array("I", bytes(row))
+                swapped.byteswap()
+                tables[context] = (alphabet, swapped.tolist())
+
+        return cls(order=order, tables=tables, rng=rng)
+
+    def save(self, path: SPath = default_model_file) -> None:
+        Path(path).write_bytes(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: SPath = default_model_file) -> "NgramModel":
+        return cls.from_bytes(Path(path).read_bytes())
+
+
+Weights = Union[Dict[str, float], LetterSampler, NgramModel]
+
+
+class PackedNameSet:
+    """Exact set of names, stored without a Python object for each one
+
+    Names are kept UTF-8 encoded and length-prefixed in one bytearray, and
+    found through an open-addressing table of offsets into it, so each name
+    costs its length plus roughly 12 bytes"""
+
+    max_load = 0.7
+
+    def __init__(self, capacity: int = 1024) -> None:
+        size = 1
+        while size * self.max_load < capacity:
+            size *= 2
+        self.blob = bytearray()
+        # Offset of each name in blob, plus 1 so 0 can mean an empty slot
+        self.slots = array("Q", bytes(8 * size))
+        self.count = 0
+
+    def _find(self, record: bytes) -> int:
+        """Index of the slot holding record, or of the empty slot it belongs in"""
+        slots = self.slots
+        mask = len(slots) - 1
+        index = hash(record) & mask
+        while True:
+            offset = slots[index]
+            if not offset or self.blob.startswith(record, offset - 1):
+                return index
+            index = (index + 1) & mask
+
+    @staticmethod
+    def _record(name: str) -> bytes:
+        encoded = name.encode("utf-8")
+        if len(encoded) > 255:
+            raise ValueError(f"Names can't be more than 255 bytes long: {name}")
+        return bytes((len(encoded),)) + encoded
+
+    def add(self, name: str) -> bool:
+        """Adds name, and returns whether it was new"""
+        record = self._record(name)
+        index = self._find(record)
+        if self.slots[index]:
+            return False
+        self.slots[index] = len(self.blob) + 1
+        self.blob += record
+        self.count += 1
+        if self.count > len(self.slots) * self.max_load:
+            self._grow()
+        return True
+
+    def _grow(self) -> None:
+        old_slots = self.slots
+        self.slots = array("Q", bytes(16 * len(old_slots)))
+        blob = self.blob
+        for offset in old_slots:
+            if offset:
+                length = blob[offset - 1]
+                record = bytes(blob[offset - 1 : offset + length])
+                self.slots[self._find(record)] = offset
+
+    def __contains__(self, name: object) -> bool:
+        if not isinstance(name, str):
+            return False
+        return bool(self.slots[self._find(self._record(name))])
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class BloomFilter:
+    """Approximate set of names in a fixed amount of memory
+
+    add() and `in` can mistake a new name for one already seen, at about
+    false_positive_rate once capacity names have been added, but never the
+    other way around"""
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.001) -> None:
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1; got {capacity}")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(
+                "false_positive_rate must be between 0 and 1; "
+                f"got {false_positive_rate}"
+            )
+        bits = -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        self.num_bits = max(8, math.ceil(bits))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, name: str) -> Iterator[int]:
+        # Double hashing: k positions from two independent 64-bit hashes
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, name: str) -> bool:
+        """Adds name, and returns whether it was (probably) new"""
+        new = False
+        bits = self.bits
+        for position in self._positions(name):
+            byte, bit = divmod(position, 8)
+            if not bits[byte] & (1 << bit):
+                bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, name: object) -> bool:
+        if not isinstance(name, str):
+            return False
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(name)
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+
+NameSet = Union[PackedNameSet, BloomFilter]
+# How many duplicates in a row unique_names() accepts before deciding that
+# there are no new names left to make
+max_duplicates_in_a_row = 100_000
+
+
+def unique_names(names: Iterable[str], seen: NameSet) -> Iterator[str]:
+    """Yields only the names that aren't in seen yet, adding them to it"""
+    duplicates = 0
+    for name in names:
+        if seen.add(name):
+            duplicates = 0
+            yield name
+        else:
+            duplicates += 1
+            if duplicates >= max_duplicates_in_a_row:
+                raise ValueError(
+                    f"Only found {len(seen)} unique names; can't make any more"
+                )
+
+
+def bundled_ngram_model(order: int) -> Optional[NgramModel]:
+    """The model of this order shipped as a resource of this package, if there
+    is one; a PyOxidizer build reads it from memory, without touching the disk
+
+    Resources are made with bundle_ngram_model()"""
+    package = __name__.rpartition(".")[0]
+    if not package:
+        # Run as a script
+        return None
+    name = f"ngram{order}.bin"
+    try:
+        if hasattr(resources, "files"):
+            payload = resources.files(package).joinpath(name).read_bytes()
+        else:
+            payload = resources.read_binary(package, name)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return NgramModel.from_bytes(payload)
+
+
+def bundle_ngram_model(
+    order: int, package_dir: SPath, source: SPath = default_census_file
+) -> Path:
+    """Trains a model on the census names, and saves it in package_dir, the
+    namepicker directory of the source tree being built, for
+    bundled_ngram_model() to find once it's packaged"""
+    path = Path(package_dir) / f"ngram{order}.bin"
+    NgramModel.train(name_list(source), order=order).save(path)
+    return path
+
+
+def ngram_model(
+    order: int,
+    source: SPath = default_census_file,
+    cache_dir: Optional[SPath] = default_cache_dir,
+) -> NgramModel:
+    """Trains a model on the census names, or memory-maps the cached one
+
+    Cached in cache_dir, unless it's None, until the census file changes. If
+    there's no census file, the bundled model of this order is used."""
+    if not Path(source).is_file():
+        bundled = bundled_ngram_model(order)
+        if bundled is not None:
+            return bundled
+    if not cache_dir:
+        return NgramModel.train(name_list(source), order=order)
+
+    cache_file = Path(cache_dir) / f"ngram{order}.bin"
+    payload = read_cache(cache_file, source)
+    if payload is None:
+        write_cache(
+            cache_file, source, NgramModel.train(name_list(source), order).to_bytes()
+        )
+        payload = read_cache(cache_file, source)
+        assert payload is not None, f"Cache was just written: {cache_file}"
+    return NgramModel.from_bytes(payload)
+
+
+def rand_name(length: int, weights: Union[Dict[str, float], LetterSampler]) -> str:
+    if isinstance(weights, LetterSampler):
+        return weights.name(length)
     sample_of_letters = choices(
         list(weights.keys()), weights=list(weights.values()), k=length
     )
@@ -111,64 +707,323 @@ def rand_name(length: int, weights: Dict[str, float]) -> str:
 def rand_names(
     min_length: int = 3,
     max_length: int = 8,
-    weights: Dict[str, float] = default_weights,
+    weights: Weights = default_weights,
+    rng: Optional[Random] = None,
+    seen: Optional[NameSet] = None,
 ) -> Iterator[str]:
+    """Generates names forever
+
+    If rng is given, every random draw comes from it, so the names can be
+    reproduced by seeding it the same way
+
+    If seen is given, only names that aren't in it are generated, and each
+    one is added to it"""
+    if seen is not None:
+        yield from unique_names(
+            rand_names(min_length, max_length, weights=weights, rng=rng), seen
+        )
+        return
+
+    if isinstance(weights, NgramModel):
+        while True:
+            yield weights.name(min_length=min_length, max_length=max_length, rng=rng)
+
+    if isinstance(weights, LetterSampler) and rng is None:
+        sampler = weights
+    else:
+        if isinstance(weights, LetterSampler):
+            weights = weights.weights
+        sampler = LetterSampler(weights, rng=rng)
+    rand_length = rng.randint if rng is not None else randint
     while True:
-        yield rand_name(length=randint(min_length, max_length), weights=weights)
+        yield sampler.name(rand_length(min_length, max_length))
 
 
 def rand_list(
-    count: int, min_length: int, max_length: int, weights: Dict[str, float]
+    count: int,
+    min_length: int,
+    max_length: int,
+    weights: Weights,
+    engine: Optional[Engine] = None,
+    unique: bool = False,
+    seen: Optional[NameSet] = None,
+    exclude: Iterable[str] = (),
 ) -> List[str]:
-    return list(
-        islice(
-            rand_names(min_length=min_length, max_length=max_length, weights=weights),
-            count,
+    """Generates count names
+
+    engine picks how: 'numpy' is much faster for large counts, and is used by
+    default when NumPy is installed; 'python' is always available, and is the
+    only engine for n-gram models
+
+    If unique, no name appears twice, or appears in exclude; seen can be a
+    BloomFilter to save memory, and defaults to a PackedNameSet"""
+    if engine is None:
+        use_numpy = has_numpy and not isinstance(weights, NgramModel)
+        engine = "numpy" if use_numpy else "python"
+    if engine not in ("python", "numpy"):
+        raise ValueError(f"Unknown engine '{engine}'")
+    if engine == "numpy" and isinstance(weights, NgramModel):
+        raise ValueError("The 'numpy' engine can't use n-gram models")
+
+    if unique or seen is not None:
+        if seen is None:
+            seen = PackedNameSet(capacity=count)
+        for name in exclude:
+            seen.add(name)
+
+    if engine == "python":
+        names = rand_names(
+            min_length=min_length, max_length=max_length, weights=weights, seen=seen
         )
-    )
+        return list(islice(names, count))
+
+    from .numpy_engine import numpy_rand_list
+
+    if isinstance(weights, LetterSampler):
+        weights = weights.weights
+    assert isinstance(weights, dict)
+    if seen is None:
+        return numpy_rand_list(
+            count=count, min_length=min_length, max_length=max_length, weights=weights
+        )
+
+    found: List[str] = []
+    while len(found) < count:
+        batch = numpy_rand_list(
+            count=max(1024, count - len(found)),
+            min_length=min_length,
+            max_length=max_length,
+            weights=weights,
+        )
+        new_names = [name for name in batch if seen.add(name)]
+        if not new_names:
+            raise ValueError(
+                f"Only found {len(seen)} unique names; can't make any more"
+            )
+        found.extend(new_names[: count - len(found)])
+    return found
 
 
-def printlist(names: List[str]) -> None:
-    print(*names, sep="\n")
+def chunk_seed(seed: int, chunk: int) -> int:
+    """Derives an independent seed for each chunk of a parallel run
+
+    Hashing keeps the streams of neighbouring chunks unrelated, unlike
+    seed + chunk"""
+    digest = hashlib.sha256(f"namepicker:{seed}:{chunk}".encode("ascii")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class ChunkTask(NamedTuple):
+    chunk: int
+    seed: int
+    # Number of names in the chunk
+    size: int
+    min_length: int
+    max_length: int
+    # letter_weights, or a serialized NgramModel
+    weights: Union[Dict[str, float], bytes]
+    engine: Engine
+
+
+def generate_chunk(task: ChunkTask) -> List[str]:
+    """Runs in a worker process; the names only depend on the task"""
+    seed = chunk_seed(task.seed, task.chunk)
+    if isinstance(task.weights, bytes):
+        weights: Weights = NgramModel.from_bytes(task.weights)
+    else:
+        weights = task.weights
+    if task.engine == "numpy" and isinstance(weights, dict):
+        from .numpy_engine import numpy_rand_list
+
+        return numpy_rand_list(
+            count=task.size,
+            min_length=task.min_length,
+            max_length=task.max_length,
+            weights=weights,
+            seed=seed,
+        )
+    names = rand_names(
+        min_length=task.min_length,
+        max_length=task.max_length,
+        weights=weights,
+        rng=Random(seed),
+    )
+    return list(islice(names, task.size))
+
+
+def parallel_rand_names(
+    count: Optional[int],
+    min_length: int,
+    max_length: int,
+    weights: Weights,
+    seed: int,
+    processes: Optional[int] = None,
+    chunk_size: int = default_chunk_size,
+    engine: Optional[Engine] = None,
+) -> Iterator[str]:
+    """Generates count names across a pool of processes, yielding them in order;
+    if count is None, names are generated until the generator is closed
+
+    The names are split into chunks of chunk_size, and each chunk gets its
+    own random stream derived from seed and the chunk's position. The output
+    only depends on the arguments other than processes, so a run can be
+    reproduced exactly on a machine with any number of cores.
+
+    engine defaults to 'python', whose streams are the same everywhere;
+    'numpy' is faster, but NumPy doesn't promise the same names from a seed
+    across its versions, so they're only reproducible with the same NumPy.
+
+    Only a few chunks per process are in flight at once, so memory stays
+    bounded however many names are asked for. When count is None, pass a
+    chunk_size near the number of names that will be read, or closing the
+    generator waits for chunks nobody reads."""
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1; got {chunk_size}")
+    if engine is None:
+        engine = "python"
+    if isinstance(weights, NgramModel):
+        task_weights: Union[Dict[str, float], bytes] = weights.to_bytes()
+    elif isinstance(weights, LetterSampler):
+        task_weights = weights.weights
+    else:
+        task_weights = weights
+
+    starts: Iterable[int] = counter(0, chunk_size)
+    if count is not None:
+        starts = range(0, count, chunk_size)
+    tasks = (
+        ChunkTask(
+            chunk=chunk,
+            seed=seed,
+            size=chunk_size if count is None else min(chunk_size, count - start),
+            min_length=min_length,
+            max_length=max_length,
+            weights=task_weights,
+            engine=engine,
+        )
+        for chunk, start in enumerate(starts)
+    )
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        in_flight: Deque["Future[List[str]]"] = deque()
+        window = 2 * (processes or os.cpu_count() or 1)
+        # Without a count, the chunks that will be read are unknown, so the
+        # window starts at one and doubles with each chunk read, and a short
+        # run doesn't start a process for every core
+        limit = window if count is not None else 1
+        try:
+            for task in islice(tasks, limit):
+                in_flight.append(pool.submit(generate_chunk, task))
+            while in_flight:
+                names = in_flight.popleft().result()
+                limit = min(2 * limit, window)
+                for task in islice(tasks, limit - len(in_flight)):
+                    in_flight.append(pool.submit(generate_chunk, task))
+                yield from names
+        finally:
+            # Closed early, so the pool only waits for chunks already started
+            for future in in_flight:
+                future.cancel()
+
+
+def printlist(names: Iterable[str], chunk_size: int = 10_000) -> None:
+    """
+    Prints one name on each line, chunk_size names per write, so names can be
+    a generator of any length
+    """
+    iterator = iter(names)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        sys.stdout.write("\n".join(chunk) + "\n")
+
+
+class PrefixNode:
+    __slots__ = ("children", "count", "option", "terminal")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "PrefixNode"] = dict()
+        # Number of options that start with the prefix this node stands for
+        self.count = 0
+        # One of those options; the only one when count is 1
+        self.option = ""
+        # The option that is exactly this prefix, if there is one
+        self.terminal: Optional[str] = None
+
+
+class PrefixIndex:
+    """Trie of options, for finding the shortest prefix that tells each option
+    apart from the others, and which option a typed prefix means
+
+    Building the index and finding every unique prefix take time proportional
+    to the total length of the options; looking up a prefix takes time
+    proportional to its length"""
+
+    def __init__(self, options: Iterable[str]) -> None:
+        self.options = list(options)
+        counts = Counter(self.options)
+        duplicates = [option for option, count in counts.items() if count > 1]
+        if duplicates:
+            raise ValueError(f"Can't have duplicate items!\n{', '.join(duplicates)}")
+
+        self.root = PrefixNode()
+        for option in self.options:
+            node = self.root
+            node.count += 1
+            node.option = option
+            for character in option:
+                child = node.children.get(character)
+                if child is None:
+                    child = node.children[character] = PrefixNode()
+                node = child
+                node.count += 1
+                node.option = option
+            node.terminal = option
+
+    def _node(self, prefix: str) -> Optional[PrefixNode]:
+        node = self.root
+        for character in prefix:
+            child = node.children.get(character)
+            if child is None:
+                return None
+            node = child
+        return node
+
+    def unique_prefix(self, option: str) -> str:
+        """Shortest prefix of option that no other option starts with
+
+        If option is the beginning of another option, there isn't one, so the
+        whole option is returned; find() prefers exact matches"""
+        node = self.root
+        for length, character in enumerate(option, start=1):
+            node = node.children[character]
+            if node.count == 1:
+                return option[:length]
+        return option
+
+    def unique_prefixes(self) -> Dict[str, str]:
+        return {option: self.unique_prefix(option) for option in self.options}
+
+    def count(self, prefix: str) -> int:
+        """Number of options that start with prefix"""
+        node = self._node(prefix)
+        return node.count if node is not None else 0
+
+    def find(self, prefix: str) -> Optional[str]:
+        """The option prefix is exactly, or else the only option starting with
+        it; None if there are none, or more than one"""
+        node = self._node(prefix)
+        if node is None:
+            return None
+        if node.terminal is not None:
+            return node.terminal
+        if node.count == 1:
+            return node.option
+        return None
 
 
 def find_unique_prefixes(options: List[str]) -> Dict[str, str]:
-    if len(set(options)) != len(options):
-        duplicates = ", ".join(filter(lambda s: options.count(s) > 1, options))
-        raise ValueError(f"Can't have duplicate items!\n{duplicates}")
-
-    # Create an unlinked copy for this destructive algorithm
-    options_duplicate = list(options)
-    unique_prefixes: Dict[str, str] = dict()
-    options_duplicate.sort()
-    while options_duplicate:
-        for i, option in enumerate(options_duplicate):
-            options_copy = list(options_duplicate)
-            del options_copy[i]
-            for prefix in accumulate(option):
-                if not list(filter(lambda s: s.startswith(prefix), options_copy)):
-                    if option in unique_prefixes:
-                        raise ValueError(
-                            f"""Somehow found duplicate prefix:
-options:
-{options}
-options_duplicate:
-{options_duplicate}
-option: {option}
-prefix: {prefix}
-unique_prefixes:
-{unique_prefixes}"""
-                        )
-                    unique_prefixes[option] = prefix
-                    break
-
-        for option in unique_prefixes:
-            if option in options_duplicate:
-                index = options_duplicate.index(option)
-                del options_duplicate[index]
-
-    # Recreate dictionary to ensure order of options
-    return {option: unique_prefixes[option] for option in options}
+    return PrefixIndex(options).unique_prefixes()
 
 
 def input_options(
@@ -183,21 +1038,20 @@ def input_options(
     if not all(options):
         raise ValueError("Empty string cannot be used as an option")
 
-    option_prefixes = find_unique_prefixes(options)
+    index = PrefixIndex(options)
+    option_prefixes = index.unique_prefixes()
     option_string = " ".join(
         f"[{ option_prefixes[option].upper() }]{ option.replace(option_prefixes[option], '') }"
         for option in option_prefixes
     )
 
     def find_matching_option(option: str) -> str:
-        matching_options = list(
-            filter(lambda s: s.startswith(option), option_prefixes.keys())
-        )
-        if len(matching_options) < 1:
+        matching_option = index.find(option)
+        if matching_option is not None:
+            return matching_option
+        elif index.count(option) < 1:
             print(f"'{option}' does not match any of '{option_string}'")
             return ""
-        elif len(matching_options) == 1:
-            return matching_options[0]
         else:
             print(f"'{option}' too ambiguous for '{option_string}'")
             return ""
@@ -258,6 +1112,8 @@ def valid_config(config: Config) -> Config:
             )
         # NOTE: Does not recurse into dictionaries
         # if isinstance(config[key], dict):
+    if config["ngram_order"] < 1:
+        raise ValueError(f"'ngram_order' must be at least 1: {config['ngram_order']}")
 
     return config
 
@@ -364,7 +1220,8 @@ def read_config(path: SPath = default_config_file) -> Config:
     except UnicodeError as err:
         raise UnicodeError(f"Can't read file: '{config_file}'") from err
 
-    config = json.loads(contents)
+    # Fill in keys added since the file was written
+    config = cast(Config, {**default_config, **json.loads(contents)})
 
     return valid_config(config)
 
@@ -372,6 +1229,11 @@ def read_config(path: SPath = default_config_file) -> Config:
 def main() -> None:
     config = create_config(default_config_file)
 
+    weights: Weights
+    if config["ngram_order"] > 1:
+        weights = ngram_model(config["ngram_order"])
+    else:
+        weights = LetterSampler(config["letter_weights"])
     num = 1
     print("Type anything except a number to quit")
     while True:
@@ -389,7 +1251,7 @@ def main() -> None:
                 count=num,
                 min_length=config["min_length"],
                 max_length=config["max_length"],
-                weights=config["letter_weights"],
+                weights=weights,
             )
         )
 
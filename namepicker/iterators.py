@@ -0,0 +1,25 @@
+"""
+Helpers for working through iterables that may be larger than memory
+
+Only imports from the standard library, so exporting generated names doesn't
+need Pony.
+"""
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Splits an iterable into lists of at most size items, without reading
+    more than one list's worth ahead
+    """
+    if size < 1:
+        raise ValueError(f"size must be at least 1; got {size}")
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,314 @@
+"""
+Counters and latency histograms for the hot paths, cheap enough to leave on
+
+Everything is recorded in the module-level metrics registry, which can be
+read in-process with metrics.snapshot(), or dumped with metrics.to_json() or
+metrics.to_prometheus()
+"""
+import json
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    cast,
+)
+
+if TYPE_CHECKING:
+    import cProfile
+
+# Upper bounds, in seconds, of the latency buckets; one more bucket holds
+# everything slower
+default_buckets = (
+    0.000_05,
+    0.000_1,
+    0.000_25,
+    0.000_5,
+    0.001,
+    0.002_5,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+count_buckets = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+
+
+class CounterSnapshot(TypedDict):
+    name: str
+    labels: Dict[str, str]
+    value: float
+
+
+class HistogramSnapshot(TypedDict):
+    name: str
+    labels: Dict[str, str]
+    count: int
+    sum: float
+    p50: float
+    p99: float
+    # Observations in each bucket, by its upper bound
+    buckets: Dict[str, int]
+
+
+class Snapshot(TypedDict):
+    counters: List[CounterSnapshot]
+    histograms: List[HistogramSnapshot]
+
+
+# What pstats keeps for each function: its file, line and name, and then
+# its call counts, own and cumulative seconds, and the same for each caller
+Function = Tuple[str, int, str]
+CallerStats = Tuple[int, int, float, float]
+FunctionStats = Tuple[int, int, float, float, Dict[Function, CallerStats]]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...] = default_buckets) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket the value at this fraction of observations
+        falls in; infinite if it's past the last bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Named counters and histograms, each optionally split by labels
+
+    Safe to update from any thread.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[Key, float] = dict()
+        self.histograms: Dict[Key, Histogram] = dict()
+        # Text shown for each metric name in to_prometheus()
+        self.descriptions: Dict[str, str] = dict()
+        # Histograms that don't measure seconds need their own buckets
+        self.buckets: Dict[str, Tuple[float, ...]] = dict()
+
+    def describe(
+        self,
+        name: str,
+        description: str,
+        buckets: Optional[Tuple[float, ...]] = None,
+    ) -> None:
+        self.descriptions[name] = description
+        if buckets is not None:
+            self.buckets[name] = buckets
+
+    def increment(self, name: str, amount: float = 1, **labels: object) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                buckets = self.buckets.get(name, default_buckets)
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        """
+        Observes how many seconds the body took, even if it raised
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Snapshot:
+        """
+        Every counter and histogram, as plain data that's safe to keep
+        """
+        with self.lock:
+            counters: List[CounterSnapshot] = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms: List[HistogramSnapshot] = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    "buckets": dict(
+                        zip(
+                            [*map(str, histogram.buckets), "+Inf"],
+                            histogram.counts,
+                        )
+                    ),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Everything, in Prometheus' text exposition format
+        """
+        lines: List[str] = []
+        described: Set[str] = set()
+
+        def header(name: str, kind: str) -> None:
+            if name in described:
+                return
+            described.add(name)
+            if name in self.descriptions:
+                lines.append(f"# HELP {name} {self.descriptions[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                header(name, "histogram")
+                cumulative = 0
+                bounds = [*map(str, histogram.buckets), "+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", bound),)
+                    lines.append(
+                        f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def label_key(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def write_folded_stacks(profile: "cProfile.Profile", path: Path) -> None:
+    """
+    Writes a profile as one line per call stack, with the microseconds spent
+    in its last function, the format flamegraph.pl and speedscope read
+
+    cProfile only records which function called which, so time is split
+    between a function's callers in proportion to how much each caller spent
+    in it.
+    """
+    import pstats
+
+    stats = cast(
+        Dict[Function, FunctionStats],
+        pstats.Stats(profile).stats,  # type: ignore[attr-defined]
+    )
+    callees: Dict[Function, Dict[Function, float]] = {
+        function: dict() for function in stats
+    }
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, dict())[function] = cumulative
+
+    def label(function: Function) -> str:
+        filename, line, name = function
+        return f"{name} ({Path(filename).name}:{line})".replace(";", ",")
+
+    lines: List[str] = []
+
+    def walk(function: Function, seconds: float, stack: List[str]) -> None:
+        _, _, own, cumulative, _ = stats[function]
+        if not cumulative or seconds < 1e-6 or len(stack) > 200:
+            return
+        stack = stack + [label(function)]
+        share = seconds / cumulative
+        if own * share >= 1e-6:
+            lines.append(f"{';'.join(stack)} {round(own * share * 1e6)}")
+        for callee, callee_seconds in callees.get(function, dict()).items():
+            if label(callee) not in stack:
+                walk(callee, callee_seconds * share, stack)
+
+    for function, (_, _, _, cumulative, callers) in stats.items():
+        if not callers:
+            walk(function, cumulative, [])
+    path.write_text("\n".join(lines) + "\n")
+
+
+metrics = Metrics()
+metrics.describe("names_imported_total", "Names added to lists by imports")
+metrics.describe("names_removed_total", "Names taken out of lists by syncs")
+metrics.describe("import_lines_total", "Lines read by imports")
+metrics.describe("import_seconds", "Time taken by each import")
+metrics.describe("picks_total", "Names picked")
+metrics.describe("pick_seconds", "Time taken by each pick")
+metrics.describe("names_generated_total", "Names generated")
+metrics.describe("generate_batch_seconds", "Time taken to generate each batch")
+metrics.describe("rows_exported_total", "Rows written by exports")
+metrics.describe("export_seconds", "Time taken by each export")
+metrics.describe("sql_seconds", "Time taken by each named query, until its first row")
+metrics.describe("db_session_seconds", "Time taken by each database session")
+metrics.describe(
+    "db_session_statements", "SQL statements run by each session", count_buckets
+)
+metrics.describe(
+    "write_group_size", "Writes committed together by write-behind", count_buckets
+)
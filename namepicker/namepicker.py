@@ -2,16 +2,34 @@
 Main file to run the program
 """
 
+from time import perf_counter, sleep
+
+started = perf_counter()
+
 import logging
 import sys
 from argparse import ArgumentParser, ArgumentTypeError, Namespace
-from datetime import datetime, timedelta
+from contextlib import contextmanager
 from enum import IntEnum
+from itertools import islice
 from pathlib import Path
-from typing import Dict, NamedTuple, Tuple, Union
+from random import SystemRandom
+from typing import Dict, Iterator, List, NamedTuple, Optional, TextIO, Tuple, Union
 from warnings import warn
 
-from database_interface import save_lists, save_names, select_lists, select_names
+# The database, generate, and server modules are slow to import, so each
+# command imports only the ones it uses
+from .settings import (
+    connection_profiles,
+    default_connection_profile,
+    default_database_file,
+    default_host,
+    default_port,
+    default_workers,
+    export_formats,
+    search_modes,
+    weight_modes,
+)
 
 
 # Record loglevel name in the logging module (e.g. WARNING, INFO, etc)
@@ -35,12 +53,6 @@ def map_logging_level_names_to_values() -> Dict[str, int]:
     return log_levels
 
 
-log_levels = map_logging_level_names_to_values()
-# Map level name -> level value
-reverse_log_levels = {log_levels[name]: name for name in log_levels}
-# Add alias for WARN
-log_levels["WARN"] = log_levels["WARNING"]
-
 # # NOTE: mypy appears to only be satisfied with a static value here;
 # # it reports an error on any dynamic assignment of Enum content
 # LogLevel = IntEnum("LogLevel", log_levels)
@@ -76,11 +88,20 @@ class LogLevel(IntEnum):
     WARNING  = 30
 
 
-def check_LogLevel(log_levels: Dict[str, int] = log_levels) -> bool:
+# Map level name -> level value
+# Built from LogLevel, instead of by looking through the logging module, so
+# that importing this module stays fast; check_LogLevel() is run by the tests
+log_levels = {name: int(level) for name, level in LogLevel.__members__.items()}
+reverse_log_levels = {log_levels[name]: name for name in log_levels}
+
+
+def check_LogLevel(log_levels: Optional[Dict[str, int]] = None) -> bool:
     """
     Validate that the statically defined LogLevels matches what's currently
     defined in the logging module
     """
+    if log_levels is None:
+        log_levels = map_logging_level_names_to_values()
     for name in log_levels:
         # Does the name match?
         if not name in LogLevel.__members__:
@@ -93,17 +114,6 @@ def check_LogLevel(log_levels: Dict[str, int] = log_levels) -> bool:
     return True
 
 
-nl = "\n"
-assert check_LogLevel(), f"""
-Python's built-in 'logging' module has changed logging levels; LogLevel needs updating:
-LogLevel:
-{nl.join(f'{name} = {value}' for name, value in LogLevel.__members__.items())}
-
-logging:
-{nl.join(f'{name} = {value}' for name, value in log_levels.items())}
-"""
-
-
 def setup_logging(level: Union[str, int, LogLevel] = LogLevel.INFO) -> logging.Logger:
     """
     Set's up very, very simple logging
@@ -153,22 +163,523 @@ def arguments() -> Namespace:
         type=ExistingPath,
         help="Path to a file containing a name on each line; list name will be the file name",
     )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Make each --list contain exactly the names in its file, removing "
+        "names that aren't there anymore; only the differences are written",
+    )
     parser.add_argument(
         "--log",
         type=to_LogLevel,
         default=LogLevel.INFO,
         help=f"verbosity of debug messages; one of: {', '.join(log_levels)}",
     )
+    parser.add_argument(
+        "--database",
+        type=Path,
+        default=Path(default_database_file),
+        help="Path to the database file; created if it doesn't exist",
+    )
+    parser.add_argument(
+        "--sqlite-profile",
+        choices=list(connection_profiles),
+        default=default_connection_profile,
+        help="SQLite tuning applied to every connection; 'fast' uses WAL mode, "
+        "so readers don't block the writer",
+    )
+    parser.add_argument(
+        "--read-only",
+        action="store_true",
+        help="Open the database so this process can only read it, while "
+        "another one makes every change; it must already exist",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Print how long each step of starting up took, and which packages "
+        "it imported, to stderr; 'python -X importtime' has more detail",
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["prometheus", "json"],
+        help="Print counters and latency histograms for picks, imports, name "
+        "generation, and SQL queries to stderr when done",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FILE",
+        help="Run under cProfile, saving the stats to FILE, and the same "
+        "profile as folded stacks for flame graph tools to FILE.folded; "
+        "worker processes aren't profiled",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    pick_parser = subparsers.add_parser(
+        "pick", help="Pick a random name from a list that hasn't been picked before"
+    )
+    pick_parser.add_argument("title", help="Title of the list to pick from")
+    pick_parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="Make every name in the list available to be picked again first",
+    )
+    pick_parser.add_argument(
+        "--count",
+        type=int,
+        default=1,
+        help="Pick this many different names at once, one on each line",
+    )
+    pick_parser.add_argument(
+        "--include-picked",
+        action="store_true",
+        help="With --count, also pick from names that were picked before",
+    )
+    pick_parser.add_argument(
+        "--weighted",
+        choices=weight_modes,
+        help="Pick by weight instead, where names can come up again; 'fair' "
+        "also favours names picked less often",
+    )
+
+    weight_parser = subparsers.add_parser(
+        "weight", help="Set how likely a name is to be picked with --weighted"
+    )
+    weight_parser.add_argument("title", help="Title of the list the name is in")
+    weight_parser.add_argument("name")
+    weight_parser.add_argument(
+        "weight", type=float, help="Relative to the other names; 1 by default"
+    )
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Print randomly generated names, one on each line"
+    )
+    generate_parser.add_argument("count", type=int, help="How many names to make")
+    generate_parser.add_argument(
+        "--seed",
+        type=int,
+        help="Makes the output reproducible, for any number of processes; "
+        "a random seed is chosen and logged, with the engine, if not given",
+    )
+    generate_parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes; defaults to the number of cores",
+    )
+    generate_parser.add_argument(
+        "--min-length", type=int, help="Defaults to the configured min_length"
+    )
+    generate_parser.add_argument(
+        "--max-length", type=int, help="Defaults to the configured max_length"
+    )
+    generate_parser.add_argument(
+        "--ngram-order",
+        type=int,
+        default=1,
+        help="Generate from a model of this many letters of the census names, "
+        "or the model bundled with the package; 1 draws letters independently",
+    )
+    generate_parser.add_argument(
+        "--engine",
+        choices=["python", "numpy"],
+        help="Defaults to 'numpy' when NumPy is installed and --seed isn't "
+        "given; names from 'numpy' can change with the NumPy version",
+    )
+    generate_parser.add_argument(
+        "--unique", action="store_true", help="Never print the same name twice"
+    )
+    generate_parser.add_argument(
+        "--false-positive-rate",
+        type=float,
+        help="With --unique, remember names in a Bloom filter, which uses much "
+        "less memory, but skips this fraction of new names",
+    )
+    generate_parser.add_argument(
+        "--exclude-database",
+        action="store_true",
+        help="With --unique, also skip names already in the database",
+    )
+    generate_parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="FILE",
+        help="Write the names to FILE instead of printing them",
+    )
+    generate_parser.add_argument(
+        "--format",
+        choices=export_formats,
+        help="Defaults to the one FILE's extension stands for, or 'text'",
+    )
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Write every name in a list, with when it was added, to a file",
+    )
+    export_parser.add_argument("title", help="Title of the list to export")
+    export_parser.add_argument(
+        "file", nargs="?", type=Path, help="Defaults to standard output"
+    )
+    export_parser.add_argument(
+        "--format",
+        choices=export_formats,
+        help="Defaults to the one FILE's extension stands for, or 'text'",
+    )
+
+    search_parser = subparsers.add_parser(
+        "search", help="Print names matching a search, best matches first"
+    )
+    search_parser.add_argument("query")
+    search_parser.add_argument(
+        "--in", dest="in_list", metavar="TITLE", help="Only search this list"
+    )
+    search_parser.add_argument(
+        "--mode",
+        choices=search_modes,
+        default="substring",
+        help="'fuzzy' also finds names with spelling differences",
+    )
+    search_parser.add_argument("--limit", type=int, default=20)
+    search_parser.add_argument(
+        "--after",
+        metavar="NAME",
+        help="Start after this name, the last one printed by the same search",
+    )
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="Save every name in a list to a compact, read-only file"
+    )
+    snapshot_parser.add_argument("title", help="Title of the list to save")
+    snapshot_parser.add_argument("file", type=Path)
+
+    draw_parser = subparsers.add_parser(
+        "draw",
+        help="Print random names from a snapshot file, without opening the "
+        "database or recording what was picked",
+    )
+    draw_parser.add_argument("file", type=ExistingPath)
+    draw_parser.add_argument(
+        "--count", type=int, default=1, help="How many different names to print"
+    )
+
+    replica_parser = subparsers.add_parser(
+        "replica",
+        help="Copy the database into a directory for read-only workers, "
+        "if it's changed since the last copy",
+    )
+    replica_parser.add_argument("directory", type=Path)
+    replica_parser.add_argument(
+        "--every",
+        type=float,
+        metavar="SECONDS",
+        help="Keep copying, checking for changes this often, until interrupted",
+    )
+    replica_parser.add_argument(
+        "--keep", type=int, default=2, help="Number of copies to leave"
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run an HTTP service for picking and generating names"
+    )
+    serve_parser.add_argument("--host", default=default_host)
+    serve_parser.add_argument("--port", type=int, default=default_port)
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=default_workers,
+        help="Number of threads, each with its own database connection",
+    )
+    serve_parser.add_argument(
+        "--write-behind",
+        action="store_true",
+        help="Commit picks in groups from one writer thread, which is faster "
+        "when many clients pick at once",
+    )
 
     return parser.parse_args()
 
 
+class StartupStage(NamedTuple):
+    name: str
+    seconds: float
+    # This package's modules, and other top-level packages outside the
+    # standard library, first imported during this stage
+    modules: Tuple[str, ...]
+
+
+startup_stages: List[StartupStage] = []
+
+
+@contextmanager
+def startup_stage(name: str) -> Iterator[None]:
+    """
+    Records how long the body takes, and what it imports, in startup_stages
+    """
+    before = set(sys.modules)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        stdlib = getattr(sys, "stdlib_module_names", ())
+        modules = set()
+        for module in sys.modules.keys() - before:
+            package = module.partition(".")[0]
+            if package == __package__:
+                modules.add(module)
+            elif package not in stdlib and not package.startswith("_"):
+                modules.add(package)
+        startup_stages.append(StartupStage(name, seconds, tuple(sorted(modules))))
+
+
+def print_startup_profile(file: TextIO = sys.stderr) -> None:
+    for stage in startup_stages:
+        imported = f"  imported {', '.join(stage.modules)}" if stage.modules else ""
+        print(f"{stage.seconds * 1000:9.1f} ms  {stage.name}{imported}", file=file)
+    total = sum(stage.seconds for stage in startup_stages)
+    print(f"{total * 1000:9.1f} ms  total", file=file)
+
+
+def print_generated_names(args: Namespace) -> None:
+    from . import generate
+    from .export import ExportError, export_chunks, name_columns
+    from .metrics import metrics
+
+    seed, engine = args.seed, args.engine
+    if engine is None:
+        # Only the 'python' engine gives the same names for a seed everywhere
+        use_numpy = generate.has_numpy and seed is None and args.ngram_order == 1
+        engine = "numpy" if use_numpy else "python"
+    if seed is None:
+        seed = SystemRandom().randrange(2 ** 63)
+        logging.getLogger("namepicker").info(
+            f"Generating names with --seed {seed} --engine {engine}"
+        )
+    config = generate.default_config
+    weights: generate.Weights = config["letter_weights"]
+    if args.ngram_order > 1:
+        try:
+            weights = generate.ngram_model(args.ngram_order)
+        except FileNotFoundError as err:
+            sys.exit(f"{err}, and no model of order {args.ngram_order} is bundled")
+    min_length, max_length = args.min_length, args.max_length
+    names = generate.parallel_rand_names(
+        # --unique reads names until it has enough, which is usually not many
+        # more than it asked for
+        count=None if args.unique else args.count,
+        min_length=config["min_length"] if min_length is None else min_length,
+        max_length=config["max_length"] if max_length is None else max_length,
+        weights=weights,
+        seed=seed,
+        processes=args.processes,
+        chunk_size=max(min(args.count, generate.default_chunk_size), 1),
+        engine=engine,
+    )
+    if args.unique:
+        seen: generate.NameSet
+        if args.false_positive_rate is not None:
+            seen = generate.BloomFilter(args.count, args.false_positive_rate)
+        else:
+            seen = generate.PackedNameSet(capacity=args.count)
+        if args.exclude_database:
+            from .database import SchemaOutdatedError, initialize_database, iter_names
+
+            try:
+                initialize_database(
+                    args.database, profile=args.sqlite_profile, read_only=args.read_only
+                )
+            except SchemaOutdatedError as err:
+                sys.exit(str(err))
+            for name in iter_names():
+                seen.add(name)
+        names = islice(generate.unique_names(names, seen), args.count)
+
+    def chunks() -> Iterator[List[Tuple[str]]]:
+        while True:
+            with metrics.timer("generate_batch_seconds"):
+                chunk = [(name,) for name in islice(names, 10_000)]
+            if not chunk:
+                return
+            metrics.increment("names_generated_total", len(chunk))
+            yield chunk
+
+    try:
+        export_chunks(chunks(), args.output, name_columns, args.format)
+    except ExportError as err:
+        sys.exit(str(err))
+
+
+# Commands that never change the database, so they can run with --read-only
+read_only_commands = ("generate", "draw", "search", "snapshot", "export", "replica")
+
+
+def run_command(args: Namespace) -> None:
+    writes = args.list or args.command not in (None, *read_only_commands)
+    if args.read_only and writes:
+        sys.exit(
+            "Can't change the database with --read-only; it can only be used "
+            f"with {', '.join(read_only_commands)}"
+        )
+    if args.command == "generate":
+        # Doesn't need the database
+        with startup_stage("generate"):
+            print_generated_names(args)
+        return
+    if args.command == "draw":
+        # Doesn't need the database either
+        with startup_stage("draw"):
+            from .snapshot import Snapshot, SnapshotError
+
+            try:
+                with Snapshot(args.file, verify=False) as snapshot:
+                    names = snapshot.sample(args.count)
+            except (SnapshotError, ValueError) as err:
+                sys.exit(str(err))
+            print(*names, sep="\n")
+        return
+    if args.command is None and not args.list:
+        return
+
+    with startup_stage("import database"):
+        from .database import (
+            ListNotFoundError,
+            NameNotFoundError,
+            NoNamesLeftError,
+            SchemaOutdatedError,
+            initialize_database,
+            pick,
+            pick_many,
+            reset_picks,
+            search_names,
+            set_weight,
+            weighted_pick,
+        )
+        from .database_interface import import_file, sync_file
+    with startup_stage("initialize database"):
+        try:
+            initialize_database(
+                args.database, profile=args.sqlite_profile, read_only=args.read_only
+            )
+        except SchemaOutdatedError as err:
+            sys.exit(str(err))
+    if args.list:
+        with startup_stage("import lists"):
+            for path in args.list:
+                if args.sync:
+                    sync_file(path)
+                else:
+                    import_file(path)
+
+    if args.command == "pick":
+        with startup_stage("pick"):
+            try:
+                if args.reset:
+                    reset_picks(args.title)
+                if args.weighted:
+                    if args.count != 1:
+                        sys.exit("--count can't be used with --weighted")
+                    print(weighted_pick(args.title, mode=args.weighted))
+                elif args.count != 1 or args.include_picked:
+                    names = pick_many(
+                        args.title,
+                        args.count,
+                        exclude_picked=not args.include_picked,
+                    )
+                    print(*names, sep="\n")
+                else:
+                    print(pick(args.title))
+            except (ListNotFoundError, NoNamesLeftError, ValueError) as err:
+                sys.exit(str(err))
+    elif args.command == "weight":
+        with startup_stage("weight"):
+            try:
+                set_weight(args.title, args.name, args.weight)
+            except (ListNotFoundError, NameNotFoundError, ValueError) as err:
+                sys.exit(str(err))
+    elif args.command == "search":
+        with startup_stage("search"):
+            try:
+                results = search_names(
+                    args.query,
+                    mode=args.mode,
+                    list_title=args.in_list,
+                    limit=args.limit,
+                    after=args.after,
+                )
+            except (ListNotFoundError, ValueError) as err:
+                sys.exit(str(err))
+            for result in results:
+                print(result.name)
+    elif args.command == "snapshot":
+        from .snapshot import export_snapshot
+
+        try:
+            export_snapshot(args.title, args.file)
+        except ListNotFoundError as err:
+            sys.exit(str(err))
+    elif args.command == "export":
+        from .export import ExportError, export_list
+
+        try:
+            export_list(args.title, args.file, format=args.format)
+        except (ListNotFoundError, ExportError) as err:
+            sys.exit(str(err))
+    elif args.command == "replica":
+        from .replica import publish_replica
+
+        while True:
+            path = publish_replica(args.database, args.directory, keep=args.keep)
+            if path is not None:
+                logging.getLogger("namepicker").info(f"Copied the database to {path}")
+            if args.every is None:
+                break
+            try:
+                sleep(args.every)
+            except KeyboardInterrupt:
+                break
+    elif args.command == "serve":
+        from . import server
+
+        server.serve(
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            write_behind=args.write_behind,
+        )
+
+
 def main() -> None:
-    args = arguments()
-    setup_logging(level=args.log)
-    for path in args.list:
-        with path.open() as f:
-            add_list(title=path.name, names=(name for name in f))
+    startup_stages.append(
+        StartupStage("import namepicker", perf_counter() - started, ())
+    )
+    with startup_stage("parse arguments"):
+        args = arguments()
+        setup_logging(level=args.log)
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_command(args)
+    finally:
+        if profiler is not None:
+            from .metrics import write_folded_stacks
+
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            folded = args.profile.with_name(args.profile.name + ".folded")
+            write_folded_stacks(profiler, folded)
+        if args.metrics is not None:
+            from .metrics import metrics
+
+            if args.metrics == "json":
+                print(metrics.to_json(), file=sys.stderr)
+            else:
+                print(metrics.to_prometheus(), file=sys.stderr, end="")
+        if args.startup_profile:
+            print_startup_profile()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+"""
+The 'numpy' engine of generate.rand_list(), kept apart because NumPy's array
+types can't be checked as strictly as the rest of generate.py
+"""
+from typing import Dict, List, Optional
+
+# Number of names drawn at once; bounds the engine's memory use
+numpy_batch_size = 1_000_000
+
+
+def numpy_rand_list(
+    count: int,
+    min_length: int,
+    max_length: int,
+    weights: Dict[str, float],
+    seed: Optional[int] = None,
+) -> List[str]:
+    """Same as rand_list(), but draws every length and letter for a batch of
+    names with a few NumPy array operations, and decodes the batch into
+    strings all at once"""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is needed for the 'numpy' engine") from None
+    from .generate import LetterSampler
+
+    if min_length < 0 or max_length < min_length:
+        raise ValueError(f"Bad name lengths: {min_length} to {max_length}")
+    if any(len(letter) != 1 for letter in weights):
+        raise ValueError(f"Every key in weights must be one character: {weights}")
+    # Let LetterSampler validate the weights
+    LetterSampler(weights)
+
+    generator = numpy.random.default_rng(seed)
+    letters = list(weights)
+    probabilities = numpy.array(list(weights.values()), dtype=numpy.float64)
+    probabilities /= probabilities.sum()
+    # str.capitalize() uppercases the first letter and lowercases the rest
+    first_codes = numpy.array([ord(letter.upper()[0]) for letter in letters])
+    rest_codes = numpy.array([ord(letter.lower()[0]) for letter in letters])
+    is_ascii = max(first_codes.max(), rest_codes.max()) < 128
+    dtype = numpy.dtype("u1" if is_ascii else "<u4")
+    encoding = "ascii" if is_ascii else "utf-32-le"
+    first_codes = first_codes.astype(dtype)
+    rest_codes = rest_codes.astype(dtype)
+    newline = ord("\n")
+
+    names: List[str] = []
+    while len(names) < count:
+        batch = min(numpy_batch_size, count - len(names))
+        lengths = generator.integers(min_length, max_length + 1, size=batch)
+        total = int(lengths.sum())
+        indices = generator.choice(len(letters), size=total, p=probabilities)
+        codes = rest_codes[indices]
+        starts = (numpy.cumsum(lengths) - lengths)[lengths > 0]
+        codes[starts] = first_codes[indices[starts]]
+
+        # Each name is followed by a newline, so the batch decodes as one string
+        text = numpy.full(total + batch, newline, dtype=dtype)
+        text[numpy.arange(total) + numpy.repeat(numpy.arange(batch), lengths)] = codes
+        names.extend(text.tobytes().decode(encoding).split("\n")[:batch])
+
+    return names
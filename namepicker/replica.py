@@ -0,0 +1,311 @@
+"""
+Read-only replicas of the database, for worker processes that only read
+while one writer process makes every change
+
+A Replica reads with plain sqlite3 connections, one for each thread, without
+Pony's sessions or its per-process lock. It reads one of:
+
+    the database file itself, opened with a mode=ro URI; every commit is seen
+    straight away, but each read still takes SQLite's shared lock on the file
+
+    the newest copy that publish_replica() has made in a directory, opened
+    with immutable=1, so SQLite takes no locks and never checks the file for
+    changes; workers move to a newer copy once one has been published
+
+Each copy is named after the generation number (see
+database.generation_schema) it was taken at, and the directory's CURRENT file
+names the newest one, so a worker finds out whether its copy is stale by
+calling stat() on CURRENT, at most once every check_interval seconds.
+"""
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from random import Random
+from time import monotonic
+from typing import Iterator, List, Optional, Tuple, Union, cast
+
+from .database import (
+    ListNotFoundError,
+    NoNamesLeftError,
+    default_page_size,
+    execute,
+    floyd_sample,
+)
+
+SPath = Union[str, Path]
+
+replica_prefix = "replica-"
+current_file_name = "CURRENT"
+# Seconds between checks for a newer copy
+default_check_interval = 1.0
+# Copies left in the directory after publishing; readers still using an older
+# one keep reading it until they move on, even once it's deleted
+default_keep = 2
+
+
+class ReplicaError(Exception):
+    pass
+
+
+def read_only_uri(path: SPath, immutable: bool = False) -> str:
+    uri = Path(path).resolve().as_uri()
+    return uri + ("?immutable=1" if immutable else "?mode=ro")
+
+
+def current_replica(directory: SPath) -> Optional[Tuple[int, Path]]:
+    """
+    The generation and path of the newest copy in directory, or None if
+    nothing has been published there
+    """
+    directory = Path(directory)
+    try:
+        number, name = (directory / current_file_name).read_text().split()
+    except FileNotFoundError:
+        return None
+    return int(number), directory / name
+
+
+def publish_replica(
+    database_file: SPath, directory: SPath, keep: int = default_keep
+) -> Optional[Path]:
+    """
+    Copies the database into directory, if it's changed since the last copy,
+    and returns the new copy's path
+
+    The copy is made with SQLite's backup API, which reads one consistent
+    view of the database; in WAL mode, the writer isn't blocked meanwhile.
+    """
+    if keep < 1:
+        raise ValueError(f"keep must be at least 1; got {keep}")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    current = current_replica(directory)
+    temporary = directory / f"{replica_prefix}{os.getpid()}.tmp"
+    source = sqlite3.connect(read_only_uri(database_file), uri=True)
+    try:
+        (number,) = cast(Tuple[int], execute(source, "generation").fetchone())
+        if current is not None and current[0] == number:
+            return None
+        copy = sqlite3.connect(str(temporary))
+        try:
+            source.backup(copy)
+            # Readers of an immutable file can't use its write-ahead log
+            copy.execute("PRAGMA journal_mode = DELETE")
+            # The backup can include commits made since number was read
+            (number,) = cast(Tuple[int], execute(copy, "generation").fetchone())
+        finally:
+            copy.close()
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+
+    path = directory / f"{replica_prefix}{number:012d}.sqlitedb"
+    os.replace(temporary, path)
+    pointer = directory / f"{current_file_name}.{os.getpid()}.tmp"
+    pointer.write_text(f"{number} {path.name}\n")
+    os.replace(pointer, directory / current_file_name)
+
+    copies = sorted(directory.glob(f"{replica_prefix}*.sqlitedb"))
+    for old in copies[: max(len(copies) - keep, 0)]:
+        try:
+            old.unlink()
+        except OSError:
+            # Windows can't delete files that are open
+            pass
+    return path
+
+
+class ReplicaLocal(threading.local):
+    """
+    What a Replica keeps for each thread
+    """
+
+    connection: Optional[sqlite3.Connection] = None
+    # Generation of the copy being read, and CURRENT's inode and mtime when it
+    # was last read
+    generation: Optional[int] = None
+    stamp: Optional[Tuple[int, int]] = None
+    next_check = 0.0
+
+
+class Replica:
+    """
+    Reads lists from a database file, or from the copies published to a
+    directory; see the module's description
+
+    Safe to share between threads, each of which gets its own connection.
+    """
+
+    def __init__(
+        self, source: SPath, check_interval: float = default_check_interval
+    ) -> None:
+        self.source = Path(source)
+        self.published = self.source.is_dir()
+        if not self.published and not self.source.is_file():
+            raise ReplicaError(f"'{self.source}' is not a database or a directory")
+        self.check_interval = check_interval
+        self.local = ReplicaLocal()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        The calling thread's connection, moved to the newest copy first if
+        it's time to check for one
+        """
+        local = self.local
+        if local.connection is None:
+            self.refresh()
+        elif self.published and monotonic() >= local.next_check:
+            self.refresh()
+        assert local.connection is not None
+        return local.connection
+
+    def refresh(self) -> bool:
+        """
+        Moves the calling thread to the newest copy, if there's a newer one
+        than it's reading, and returns whether it moved
+        """
+        local = self.local
+        if not self.published:
+            if local.connection is None:
+                local.connection = sqlite3.connect(
+                    read_only_uri(self.source), uri=True
+                )
+                return True
+            return False
+
+        local.next_check = monotonic() + self.check_interval
+        try:
+            status = (self.source / current_file_name).stat()
+            # CURRENT is replaced, not rewritten, so its inode changes too
+            stamp: Optional[Tuple[int, int]] = (status.st_ino, status.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if stamp is not None and stamp == local.stamp:
+            return False
+        current = current_replica(self.source)
+        if current is None:
+            raise ReplicaError(f"Nothing has been published to '{self.source}'")
+        number, path = current
+        local.stamp = stamp
+        if local.generation == number:
+            return False
+        connection = sqlite3.connect(read_only_uri(path, immutable=True), uri=True)
+        if local.connection is not None:
+            local.connection.close()
+        local.connection = connection
+        local.generation = number
+        return True
+
+    def generation(self) -> int:
+        """
+        The generation of what the calling thread reads; anything read at
+        the same generation is still the same
+        """
+        (number,) = cast(
+            Tuple[int], execute(self.connection(), "generation").fetchone()
+        )
+        return number
+
+    def list_id(self, connection: sqlite3.Connection, title: str) -> int:
+        row = cast(
+            Optional[Tuple[int]], execute(connection, "list_id", (title,)).fetchone()
+        )
+        if row is None:
+            raise ListNotFoundError(f"No list titled '{title}'")
+        return row[0]
+
+    def names(
+        self, list_title: str, page_size: int = default_page_size
+    ) -> Iterator[str]:
+        """
+        Every name in a list, all from the same copy
+        """
+        connection = self.connection()
+        list_id = self.list_id(connection, list_title)
+        last_id = 0
+        while True:
+            rows = cast(
+                List[Tuple[int, str]],
+                execute(
+                    connection, "list_names_page", (list_id, last_id, page_size)
+                ).fetchall(),
+            )
+            for _, value in rows:
+                yield value
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def count(self, list_title: str) -> int:
+        connection = self.connection()
+        list_id = self.list_id(connection, list_title)
+        (count, _) = cast(
+            Tuple[int, object],
+            execute(connection, "list_fingerprint", (list_id,)).fetchone(),
+        )
+        return count
+
+    def remaining(self, list_title: str) -> int:
+        """
+        Number of names in the list that hadn't been picked yet
+        """
+        connection = self.connection()
+        list_id = self.list_id(connection, list_title)
+        return self.remaining_in(connection, list_id)
+
+    def remaining_in(self, connection: sqlite3.Connection, list_id: int) -> int:
+        (remaining,) = cast(
+            Tuple[int], execute(connection, "remaining_picks", (list_id,)).fetchone()
+        )
+        return remaining
+
+    def draw(
+        self, list_title: str, k: int = 1, rng: Optional[Random] = None
+    ) -> List[str]:
+        """
+        k different random names that hadn't been picked yet; nothing is
+        recorded, so other workers can draw the same names
+        """
+        if k < 0:
+            raise ValueError(f"k can't be negative; got {k}")
+        connection = self.connection()
+        list_id = self.list_id(connection, list_title)
+        remaining = self.remaining_in(connection, list_id)
+        if k > remaining:
+            raise NoNamesLeftError(
+                f"Only {remaining} names in '{list_title}' haven't been picked"
+            )
+        slots = floyd_sample(remaining, k, rng)
+        names = dict(
+            cast(
+                List[Tuple[int, int]],
+                execute(
+                    connection, "slot_names", (list_id, json.dumps(slots))
+                ).fetchall(),
+            )
+        )
+        name_ids = [names[slot] for slot in slots]
+        values = dict(
+            cast(
+                List[Tuple[int, str]],
+                execute(
+                    connection, "name_values", (json.dumps(name_ids),)
+                ).fetchall(),
+            )
+        )
+        return [values[name_id] for name_id in name_ids]
+
+    def close(self) -> None:
+        """
+        Closes the calling thread's connection
+        """
+        connection = self.local.connection
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+            self.local.generation = None
+            self.local.stamp = None
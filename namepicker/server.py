@@ -0,0 +1,403 @@
+"""
+HTTP service for picking names from lists and generating new names
+
+Uses only asyncio streams, so it has no dependencies beyond the rest of the
+package. Database work runs on a bounded thread pool; Pony keeps one
+connection per thread, so the pool is also the connection pool.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
+from urllib.parse import parse_qs, urlsplit
+
+from . import database
+from .generate import Config, default_config, rand_list
+from .metrics import metrics
+from .settings import default_host, default_port, default_workers
+
+log = logging.getLogger(__name__)
+
+# Largest number of names one request can generate
+max_generate = 100_000
+max_name_length = 1_000
+# Largest request body accepted, in bytes
+max_body = 1024 * 1024
+
+T = TypeVar("T")
+# A value that can be sent as JSON, or was read from it
+JSON = Union[None, bool, int, float, str, Sequence["JSON"], Mapping[str, "JSON"]]
+Response = Tuple[HTTPStatus, JSON]
+
+
+class PlainText(str):
+    """
+    A response body sent as text, instead of as JSON
+    """
+
+
+class RequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def int_parameter(
+    parameters: Dict[str, List[str]], name: str, maximum: int
+) -> Optional[int]:
+    values = parameters.get(name)
+    if not values:
+        return None
+    try:
+        value = int(values[-1])
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"'{name}' must be a number")
+    if not 0 <= value <= maximum:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, f"'{name}' must be between 0 and {maximum}"
+        )
+    return value
+
+
+class NamepickerServer:
+    """
+    Routes:
+    GET /pick?list=TITLE        one name that hasn't been picked from TITLE
+    GET /generate?count=N       N generated names; also takes min_length and
+                                max_length
+    POST /batch                 a JSON array of operations, each one of
+                                {"pick": TITLE} or {"generate": N}; every
+                                pick is made in one transaction, so if one
+                                fails, none are; responds with an array of
+                                results
+    GET /metrics                counters and latency histograms, as
+                                Prometheus text, or JSON with format=json
+
+    With write_behind, picks are committed in groups by a
+    database.WriteBehindQueue, and each response waits for its group.
+    Names are generated on a thread of their own, so large requests for them
+    don't keep the database threads from picking.
+    """
+
+    def __init__(
+        self,
+        config: Config = default_config,
+        workers: int = default_workers,
+        write_behind: bool = False,
+    ) -> None:
+        self.config = config
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="namepicker-db"
+        )
+        # Generating holds the GIL, so more threads wouldn't be faster
+        self.generator = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="namepicker-generate"
+        )
+        self.writes: Optional[database.WriteBehindQueue] = None
+        if write_behind:
+            self.writes = database.WriteBehindQueue()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def run_in_pool(
+        self, function: Callable[[], T], executor: Optional[Executor] = None
+    ) -> T:
+        """
+        Runs function on executor, the database threads by default
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            executor or self.executor, function
+        )
+
+    def pick(self, list_title: str) -> str:
+        try:
+            if self.writes is not None:
+                return self.writes.pick(list_title).result()
+            return database.pick(list_title)
+        except database.ListNotFoundError as err:
+            raise RequestError(HTTPStatus.NOT_FOUND, str(err))
+        except database.NoNamesLeftError as err:
+            raise RequestError(HTTPStatus.CONFLICT, str(err))
+
+    async def pick_later(self, list_title: str) -> str:
+        """
+        Waits for a pick from the write-behind queue, without using a thread
+        """
+        assert self.writes is not None
+        try:
+            return await asyncio.wrap_future(self.writes.pick(list_title))
+        except database.ListNotFoundError as err:
+            raise RequestError(HTTPStatus.NOT_FOUND, str(err))
+        except database.NoNamesLeftError as err:
+            raise RequestError(HTTPStatus.CONFLICT, str(err))
+
+    def generate(
+        self,
+        count: int,
+        min_length: Optional[int] = None,
+        max_length: Optional[int] = None,
+    ) -> List[str]:
+        min_length = self.config["min_length"] if min_length is None else min_length
+        max_length = self.config["max_length"] if max_length is None else max_length
+        if min_length > max_length:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST, "'min_length' is more than 'max_length'"
+            )
+        with metrics.timer("generate_batch_seconds"):
+            names = rand_list(
+                count=count,
+                min_length=min_length,
+                max_length=max_length,
+                weights=self.config["letter_weights"],
+            )
+        metrics.increment("names_generated_total", len(names))
+        return names
+
+    def pick_lists(self, counts: Dict[str, int]) -> Dict[str, List[str]]:
+        try:
+            if self.writes is not None:
+                return self.writes.pick_lists(counts).result()
+            return database.pick_lists(counts)
+        except database.ListNotFoundError as err:
+            raise RequestError(HTTPStatus.NOT_FOUND, str(err))
+        except database.NoNamesLeftError as err:
+            raise RequestError(HTTPStatus.CONFLICT, str(err))
+
+    async def run_batch(self, operations: Sequence[JSON]) -> List[JSON]:
+        """
+        Checks every operation before running any; then generates names, and
+        picks all the names asked for from each list with one pick_lists(), in
+        one transaction, so either every pick is committed or none is
+        """
+        # Each operation is a pick from a list, or a number of names to generate
+        parsed: List[Union[str, int]] = []
+        counts: Dict[str, int] = dict()
+        for operation in operations:
+            key, value = "", cast(JSON, None)
+            if isinstance(operation, Mapping) and len(operation) == 1:
+                ((key, value),) = operation.items()
+            if key == "pick" and isinstance(value, str):
+                counts[value] = counts.get(value, 0) + 1
+                parsed.append(value)
+            elif key == "generate" and type(value) is int:
+                if not 0 <= value <= max_generate:
+                    raise RequestError(
+                        HTTPStatus.BAD_REQUEST,
+                        f"'generate' must be between 0 and {max_generate}",
+                    )
+                parsed.append(value)
+            else:
+                raise RequestError(
+                    HTTPStatus.BAD_REQUEST, f"Unknown operation: {operation!r}"
+                )
+
+        # Generating can't fail now, so it's done before anything is picked
+        results: List[JSON] = []
+        for item in parsed:
+            if isinstance(item, int):
+                generate = partial(self.generate, item)
+                results.append(await self.run_in_pool(generate, self.generator))
+            else:
+                results.append(None)
+        picked: Dict[str, List[str]] = dict()
+        if counts:
+            picked = await self.run_in_pool(partial(self.pick_lists, counts))
+        names = {title: iter(names) for title, names in picked.items()}
+        for index, item in enumerate(parsed):
+            if isinstance(item, str):
+                results[index] = next(names[item])
+        return results
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Response:
+        url = urlsplit(target)
+        parameters = parse_qs(url.query)
+
+        if url.path == "/pick" and method == "GET":
+            titles = parameters.get("list")
+            if not titles:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "'list' is required")
+            if self.writes is not None:
+                name = await self.pick_later(titles[-1])
+            else:
+                name = await self.run_in_pool(partial(self.pick, titles[-1]))
+            return HTTPStatus.OK, {"name": name}
+
+        if url.path == "/generate" and method == "GET":
+            count = int_parameter(parameters, "count", max_generate)
+            generate = partial(
+                self.generate,
+                count=1 if count is None else count,
+                min_length=int_parameter(parameters, "min_length", max_name_length),
+                max_length=int_parameter(parameters, "max_length", max_name_length),
+            )
+            names = await self.run_in_pool(generate, self.generator)
+            return HTTPStatus.OK, {"names": names}
+
+        if url.path == "/batch" and method == "POST":
+            try:
+                operations = json.loads(body)
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+            if not isinstance(operations, list):
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Body must be a JSON array")
+            return HTTPStatus.OK, {"results": await self.run_batch(operations)}
+
+        if url.path == "/metrics" and method == "GET":
+            if parameters.get("format") == ["json"]:
+                # A TypedDict isn't a Mapping[str, JSON] to mypy, though it's one
+                return HTTPStatus.OK, cast(JSON, metrics.snapshot())
+            return HTTPStatus.OK, PlainText(metrics.to_prometheus())
+
+        if url.path in ("/pick", "/generate", "/batch", "/metrics"):
+            raise RequestError(
+                HTTPStatus.METHOD_NOT_ALLOWED, f"Can't {method} {url.path}"
+            )
+        raise RequestError(HTTPStatus.NOT_FOUND, f"Nothing at {url.path}")
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Answers HTTP/1.1 requests on one connection until the client closes
+        it, or asks to with 'Connection: close'
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(
+                        writer, HTTPStatus.BAD_REQUEST, {"error": "Bad request line"}
+                    )
+                    break
+
+                headers: Dict[str, str] = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                body_read = False
+                try:
+                    length = int(headers.get("content-length", "0"))
+                    if not 0 <= length <= max_body:
+                        raise RequestError(
+                            HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body is too large"
+                        )
+                    body = await reader.readexactly(length)
+                    body_read = True
+                    status, payload = await self.dispatch(method, target, body)
+                except RequestError as err:
+                    status, payload = err.status, {"error": str(err)}
+                except ValueError:
+                    status, payload = HTTPStatus.BAD_REQUEST, {"error": "Bad request"}
+                except Exception:
+                    log.exception(f"Failed to answer {method} {target}")
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    payload = {"error": "Internal server error"}
+                # Whatever is left of the body would be read as the next
+                # request
+                keep_alive = keep_alive and body_read
+
+                await self.respond(writer, status, payload, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        payload: JSON,
+        keep_alive: bool = False,
+    ) -> None:
+        if isinstance(payload, PlainText):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def start(self, host: str = default_host, port: int = default_port) -> int:
+        """
+        Starts listening, and returns the port; port 0 picks a free one
+        """
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        log.info(f"Listening on http://{host}:{port}")
+        return int(port)
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # These wait for threads, which would block the event loop
+        loop = asyncio.get_running_loop()
+        for executor in (self.generator, self.executor):
+            await loop.run_in_executor(None, partial(executor.shutdown, wait=True))
+        if self.writes is not None:
+            await loop.run_in_executor(None, self.writes.close)
+
+    async def serve_forever(
+        self, host: str = default_host, port: int = default_port
+    ) -> None:
+        await self.start(host, port)
+        assert self.server is not None
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+
+def serve(
+    host: str = default_host,
+    port: int = default_port,
+    workers: int = default_workers,
+    config: Config = default_config,
+    write_behind: bool = False,
+) -> None:
+    """
+    Runs the server until interrupted; the database must already be
+    initialized
+    """
+    server = NamepickerServer(
+        config=config, workers=workers, write_behind=write_behind
+    )
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
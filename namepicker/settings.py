@@ -0,0 +1,67 @@
+"""
+Defaults shared by the command line and the modules that do the work
+
+Only imports from the standard library, so the command line can build its
+arguments without importing Pony, NumPy, or asyncio.
+"""
+from typing import Dict, Literal, NamedTuple, Optional, Tuple
+
+default_database_file = "./namepicker.sqlitedb"
+
+
+class ConnectionProfile(NamedTuple):
+    """
+    PRAGMAs set on every new connection; None leaves SQLite's default
+    """
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    # Bytes of the database file to memory-map
+    mmap_size: Optional[int] = None
+    # Negative values are in KiB, positive values are in pages
+    cache_size: Optional[int] = None
+    temp_store: Optional[str] = None
+    # Milliseconds to wait for another connection's lock before failing
+    busy_timeout: Optional[int] = 5_000
+
+
+connection_profiles: Dict[str, ConnectionProfile] = {
+    "default": ConnectionProfile(),
+    # Readers don't block the writer, and commits don't wait for fsync();
+    # a power loss can lose the last few commits, but never corrupts the file
+    "fast": ConnectionProfile(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        mmap_size=256 * 1024 * 1024,
+        cache_size=-64_000,
+        temp_store="MEMORY",
+        busy_timeout=10_000,
+    ),
+}
+default_connection_profile = "default"
+
+SearchMode = Literal["prefix", "substring", "fuzzy"]
+search_modes: Tuple[SearchMode, ...] = ("prefix", "substring", "fuzzy")
+
+# How weighted_pick() weighs each name: by its NameData.weight alone, or also
+# by how often it's been picked before
+WeightMode = Literal["weight", "fair"]
+weight_modes: Tuple[WeightMode, ...] = ("weight", "fair")
+
+# File formats export.py can write; the columnar ones need pyarrow
+ExportFormat = Literal["text", "csv", "jsonl", "arrow", "parquet"]
+export_formats: Tuple[ExportFormat, ...] = ("text", "csv", "jsonl", "arrow", "parquet")
+# Used when no format is given, and the file name doesn't end in any of these
+default_export_format: ExportFormat = "text"
+export_suffixes: Dict[str, ExportFormat] = {
+    ".txt": "text",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".parquet": "parquet",
+}
+
+default_host = "127.0.0.1"
+default_port = 8080
+default_workers = 4
@@ -0,0 +1,254 @@
+"""
+Immutable snapshots of a list's names, for workloads that read far more than
+they write
+
+A snapshot file holds every name in a list as one UTF-8 blob, and an array of
+where each name starts in it. It's memory-mapped, so opening it costs almost
+nothing, names are decoded only when they're read, and a 10M-name list takes
+about as much memory as its file. The database stays the source of truth:
+snapshots are written from it with export_snapshot(), and is_current() tells
+whether the list has changed since.
+
+Layout, all integers little-endian:
+    header      magic, name count, blob size, offset width, metadata size,
+                and the SHA-256 of everything after the header
+    metadata    JSON: the list's title, and what the list looked like when
+                the snapshot was taken
+    blob        every name, in UTF-8, one after the other
+    padding     zeros, so the offsets start at a multiple of 8 bytes
+    offsets     count + 1 unsigned integers, offset width bytes each; name i
+                is blob[offsets[i]:offsets[i + 1]]
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from random import Random, randrange
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
+
+SPath = Union[str, Path]
+
+snapshot_magic = b"NPSNAP01"
+# count, blob size, offset width, metadata size, SHA-256
+snapshot_header = struct.Struct("<QQBI32s")
+header_size = len(snapshot_magic) + snapshot_header.size
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotMetadata(TypedDict):
+    title: str
+    # database.list_fingerprint() when the snapshot was taken
+    count: int
+    last_added: Optional[str]
+
+
+def export_snapshot(list_title: str, path: SPath) -> Path:
+    """
+    Writes every name in the list to a snapshot file, replacing it atomically,
+    and returns its path
+
+    Names are streamed from the database a page at a time, so only the
+    offsets are held in memory.
+    """
+    # Imported here, so reading snapshots doesn't need Pony
+    from . import database
+
+    path = Path(path)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    # The metadata and the names are read in one transaction, so they match
+    # even if the list is changed while the file is written
+    with database.read_transaction("export_snapshot") as connection:
+        list_id = database.list_id_in(connection.cursor(), list_title)
+        count, last_added = database.list_fingerprint_in(connection, list_id)
+        fingerprint: SnapshotMetadata = {
+            "title": list_title,
+            "count": count,
+            "last_added": last_added,
+        }
+        metadata = json.dumps(fingerprint).encode("utf-8")
+        names = database.iter_list_names_in(connection, list_id)
+        write_snapshot(temporary, metadata, names)
+    os.replace(temporary, path)
+    return path
+
+
+def write_snapshot(path: Path, metadata: bytes, names: Iterable[str]) -> None:
+    digest = hashlib.sha256()
+    with path.open("wb") as file:
+
+        def write(data: bytes) -> None:
+            file.write(data)
+            digest.update(data)
+
+        file.write(b"\0" * header_size)
+        write(metadata)
+        offsets = array("I", [0])
+        position = 0
+        for name in names:
+            encoded = name.encode("utf-8")
+            write(encoded)
+            position += len(encoded)
+            if position > 0xFFFF_FFFF and offsets.typecode == "I":
+                offsets = array("Q", offsets)
+            offsets.append(position)
+        write(b"\0" * (-(header_size + len(metadata) + position) % 8))
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        write(offsets.tobytes())
+
+        file.seek(0)
+        file.write(
+            snapshot_magic
+            + snapshot_header.pack(
+                len(offsets) - 1,
+                position,
+                offsets.itemsize,
+                len(metadata),
+                digest.digest(),
+            )
+        )
+
+
+class Snapshot:
+    """
+    A memory-mapped snapshot file, read like a sequence of names
+
+    verify checks the SHA-256 of the whole file, which reads all of it; skip
+    it to open large snapshots instantly.
+    """
+
+    def __init__(self, path: SPath, verify: bool = True) -> None:
+        self.path = Path(path)
+        with self.path.open("rb") as file:
+            try:
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"'{self.path}' is empty")
+        try:
+            self.load(verify)
+        except Exception:
+            self.mapped.close()
+            raise
+
+    def load(self, verify: bool) -> None:
+        mapped = self.mapped
+        if len(mapped) < header_size or mapped[: len(snapshot_magic)] != snapshot_magic:
+            raise SnapshotError(f"'{self.path}' is not a snapshot")
+        count, blob_size, width, metadata_size, digest = cast(
+            Tuple[int, int, int, int, bytes],
+            snapshot_header.unpack_from(mapped, len(snapshot_magic)),
+        )
+        blob_start = header_size + metadata_size
+        offsets_start = blob_start + blob_size + (-(blob_start + blob_size) % 8)
+        if width not in (4, 8) or offsets_start + (count + 1) * width != len(mapped):
+            raise SnapshotError(f"'{self.path}' is truncated or corrupt")
+        if verify:
+            checksum = hashlib.sha256()
+            for start in range(header_size, len(mapped), 1 << 20):
+                checksum.update(mapped[start : start + (1 << 20)])
+            if checksum.digest() != digest:
+                raise SnapshotError(f"'{self.path}' doesn't match its checksum")
+        try:
+            self.metadata = cast(
+                SnapshotMetadata,
+                json.loads(mapped[header_size:blob_start].decode("utf-8")),
+            )
+            self.title = self.metadata["title"]
+        except (ValueError, KeyError):
+            raise SnapshotError(f"'{self.path}' has corrupt metadata")
+
+        # Nothing can fail from here on; the mmap can't be closed while any
+        # views of it are left, even ones held by a traceback
+        view = memoryview(mapped)
+        self.blob = view[blob_start : blob_start + blob_size]
+        offsets = view[offsets_start:]
+        self.offsets: Sequence[int]
+        if sys.byteorder == "little":
+            self.offsets = offsets.cast("I") if width == 4 else offsets.cast("Q")
+        else:
+            swapped = (
+                array("I", bytes(offsets)) if width == 4 else array("Q", bytes(offsets))
+            )
+            swapped.byteswap()
+            self.offsets = swapped
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(f"Snapshot has {self.count} names; no index {index}")
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return str(self.blob[start:end], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.count):
+            yield self[index]
+
+    def pick(self, rng: Optional[Random] = None) -> str:
+        """
+        A random name; unlike database.pick(), nothing is recorded, so the
+        same name can come up again
+        """
+        if not self.count:
+            raise IndexError(f"Snapshot of '{self.title}' has no names")
+        return self[rng.randrange(self.count) if rng else randrange(self.count)]
+
+    def sample(self, k: int, rng: Optional[Random] = None) -> List[str]:
+        """
+        k different random names
+        """
+        if not 0 <= k <= self.count:
+            raise ValueError(f"Snapshot of '{self.title}' has {self.count} names")
+        indexes = (rng or Random()).sample(range(self.count), k)
+        return [self[index] for index in indexes]
+
+    def is_current(self) -> bool:
+        """
+        Whether the list in the database looks the same as when the snapshot
+        was taken: it has the same number of names, and none added since
+        """
+        from . import database
+
+        list_id = database.select_list(title=self.title)
+        count, last_added = database.list_fingerprint(list_id)
+        return (count, last_added) == (
+            self.metadata["count"],
+            self.metadata["last_added"],
+        )
+
+    def close(self) -> None:
+        # The views have to be released before the map can be closed
+        self.blob.release()
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.mapped.close()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<Snapshot of '{self.title}': {self.count} names from {self.path}>"
@@ -14,25 +14,29 @@ def make_dist():
 def make_exe(dist):
     # This variable defines the configuration of the
     # embedded Python interpreter.
+    #
+    # Every module is imported from bytecode compiled at build time and kept
+    # in the executable, so starting up doesn't look for files: there's no
+    # filesystem importer, no site module, and no sys.path.
     python_config = PythonInterpreterConfig(
     #     bytes_warning=0,
-    #     dont_write_bytecode=True,
-    #     ignore_environment=True,
+         dont_write_bytecode=True,
+         ignore_environment=True,
     #     inspect=False,
     #     interactive=False,
     #     isolated=False,
     #     legacy_windows_fs_encoding=False,
     #     legacy_windows_stdio=False,
-    #     no_site=True,
-    #     no_user_site_directory=True,
+         no_site=True,
+         no_user_site_directory=True,
     #     optimize_level=2,
     #     parser_debug=False,
     #     stdio_encoding=None,
     #     unbuffered_stdio=False,
-    #     filesystem_importer=False,
-    #     sys_frozen=False,
+         filesystem_importer=False,
+         sys_frozen=True,
     #     sys_meipass=False,
-    #     sys_paths=None,
+         sys_paths=[],
     #     raw_allocator=None,
     #     terminfo_resolution="dynamic",
     #     terminfo_dirs=None,
@@ -40,7 +44,7 @@ def make_exe(dist):
     #     verbose=0,
     #     write_modules_directory_env=None,
     #     run_eval=None,
-         run_module="generate",
+         run_module="namepicker.namepicker",
     #     run_noop=False,
     #     run_repl=True,
     )
@@ -61,9 +65,10 @@ def make_exe(dist):
     # resources, and other options. The returned object represents the
     # standalone executable that will be built.
     exe = dist.to_python_executable(
-        name="names",
+        name="namepicker",
         config=python_config,
         # Embed all extension modules, making this a fully-featured Python.
+        # The database needs _sqlite3, which links against SQLite.
         extension_module_filter='all',
 
         # Only package the minimal set of extension modules needed to initialize
@@ -83,7 +88,7 @@ def make_exe(dist):
         # Include Python module sources. This isn't strictly required and it does
         # make binary sizes larger. But having the sources can be useful for
         # activities such as debugging.
-        include_sources=True,
+        include_sources=False,
 
         # Whether to include non-module resource data/files.
         include_resources=False,
@@ -96,7 +101,10 @@ def make_exe(dist):
     # `pip_install()` returns objects representing installed files.
     # `add_in_memory_python_resources()` adds these objects to the binary,
     # marking them for in-memory loading.
-    #exe.add_in_memory_python_resources(dist.pip_install(["appdirs"]))
+    #
+    # NumPy isn't included; the 'generate' command uses its pure Python
+    # engine without it.
+    exe.add_in_memory_python_resources(dist.pip_install(["pony>=0.7.13,<0.8"]))
 
     # Invoke `pip install` using a requirements file and add the collected resources
     # to our binary.
@@ -107,9 +115,14 @@ def make_exe(dist):
     # Read Python files from a local directory and add them to our embedded
     # context, taking just the resources belonging to the `foo` and `bar`
     # Python packages.
+    #
+    # Package data files come along too: from this directory, run
+    #   python -c "from namepicker.generate import bundle_ngram_model; bundle_ngram_model(3, 'namepicker')"
+    # with the census file present before building, and `namepicker generate
+    # --ngram-order 3` will read namepicker/ngram3.bin from memory.
     exe.add_in_memory_python_resources(dist.read_package_root(
-        path="dev",
-        packages=["generate"],
+        path=".",
+        packages=["namepicker"],
     ))
 
     # Discover Python files from a virtualenv and add them to our embedded
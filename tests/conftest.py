@@ -0,0 +1,38 @@
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from pony import orm
+
+from namepicker import database
+
+
+@pytest.fixture(scope="session")
+def database_file(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """
+    Pony can only bind a Database once per process, so every test shares one
+    file, and the db fixture empties it before each test
+    """
+    path = tmp_path_factory.mktemp("database") / "namepicker.sqlitedb"
+    database.initialize_database(path)
+    return path
+
+
+@pytest.fixture
+def db(database_file: Path) -> Iterator[Path]:
+    with orm.db_session():
+        connection = database.db.get_connection()
+        tables = [
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                # Kept in sync by triggers on Name
+                "AND name NOT LIKE 'NameSearch%' "
+                # Always has its one row
+                "AND name != 'Generation'"
+            )
+        ]
+        for table in tables:
+            connection.execute(f'DELETE FROM "{table}"')
+    yield database_file
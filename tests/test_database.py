@@ -0,0 +1,540 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from random import Random
+from typing import Dict, List
+
+import pytest
+from pony import orm
+
+from namepicker import database
+
+
+def test_bulk_import(db: Path) -> None:
+    names = ["alice\n", "bob\n", "alice\n", "\n", "  carol  \n"]
+    stats = database.bulk_import("roster", names, chunk_size=2)
+    assert stats.lines == 5
+    assert stats.names_added == 3
+    assert stats.rows_per_second > 0
+
+    with orm.db_session():
+        roster = database.NameList.get(title="roster")
+        assert {name.value for name in roster.names} == {"alice", "bob", "carol"}
+        assert orm.count(data for data in database.NameData) == 3
+
+
+def test_bulk_import_keeps_existing_names(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    with orm.db_session():
+        alice = database.Name.get(value="alice")
+        first_added = database.NameData.get(name=alice).date_added
+
+    stats = database.bulk_import("roster", ["alice", "carol"])
+    database.bulk_import("other", ["alice"])
+    assert stats.names_added == 1
+
+    with orm.db_session():
+        assert database.Name.select().count() == 3
+        alice = database.Name.get(value="alice")
+        assert {name_list.title for name_list in alice.lists} == {"roster", "other"}
+        roster = database.NameList.get(title="roster")
+        assert database.NameData.get(name=alice, list=roster).date_added == first_added
+
+
+def test_pick_without_repeats(db: Path) -> None:
+    names = [f"name{i}" for i in range(50)]
+    database.bulk_import("roster", names)
+    rng = Random(1)
+    picked = [database.pick("roster", rng=rng) for _ in names]
+    assert sorted(picked) == sorted(names)
+    with pytest.raises(database.NoNamesLeftError):
+        database.pick("roster")
+
+    database.bulk_import("roster", ["late"])
+    assert database.pick("roster") == "late"
+
+    assert database.reset_picks("roster") == 51
+    with orm.db_session():
+        assert database.Pick.select().count() == 51
+
+
+def test_pick_many(db: Path) -> None:
+    names = [f"name{i}" for i in range(30)]
+    database.bulk_import("roster", names)
+    rng = Random(1)
+    team = database.pick_many("roster", 12, rng=rng)
+    assert len(set(team)) == 12
+    rest = database.pick_many("roster", 18, rng=rng)
+    assert sorted(team + rest) == sorted(names)
+    with pytest.raises(database.NoNamesLeftError):
+        database.pick_many("roster", 1)
+    assert database.pick_many("roster", 0) == []
+
+    # Already picked names can come up again
+    again = database.pick_many("roster", 30, exclude_picked=False, rng=rng)
+    assert sorted(again) == sorted(names)
+    with pytest.raises(database.NoNamesLeftError):
+        database.pick_many("roster", 31, exclude_picked=False)
+    sample = database.pick_many("roster", 5, exclude_picked=False, rng=rng)
+    assert len(set(sample)) == 5 and set(sample) <= set(names)
+    with orm.db_session():
+        assert database.Pick.select().count() == 65
+        assert not database.PickWeight.select().exists()
+
+
+def test_floyd_sample() -> None:
+    rng = Random(1)
+    assert sorted(database.floyd_sample(10, 10, rng)) == list(range(10))
+    firsts = Counter(database.floyd_sample(4, 2, rng)[0] for _ in range(4000))
+    assert all(900 < firsts[number] < 1100 for number in range(4))
+
+
+def test_write_behind(db: Path) -> None:
+    database.bulk_import("roster", [f"name{i}" for i in range(100)])
+    with database.WriteBehindQueue(group_size=16) as writes:
+        picks = [writes.pick("roster") for _ in range(50)]
+        missing = writes.pick("missing")
+        added = writes.add_names("roster", ["name0", "new", "new"])
+        names = [future.result() for future in picks]
+        assert len(set(names)) == 50
+        # A failing write doesn't roll back the others in its group
+        with pytest.raises(database.ListNotFoundError):
+            missing.result()
+        assert added.result() == 1
+    with orm.db_session():
+        assert database.Pick.select().count() == 50
+        assert database.PickSlot.select().count() == 51
+    with pytest.raises(RuntimeError):
+        writes.pick("roster")
+
+
+def test_write_behind_back_pressure(db: Path) -> None:
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking(batch: database.WriteBatch) -> None:
+        started.set()
+        release.wait()
+
+    with database.WriteBehindQueue(group_size=1, max_pending=2) as writes:
+        first = writes.submit(blocking)
+        started.wait()
+        queued = [writes.add_names("roster", [f"name{i}"]) for i in range(2)]
+        # One submit() waiting for room doesn't hold up the others
+        waiting: List["Future[int]"] = []
+        waiter = threading.Thread(
+            target=lambda: waiting.append(writes.add_names("roster", ["waiter"]))
+        )
+        waiter.start()
+        time.sleep(0.1)
+        started_at = time.monotonic()
+        with pytest.raises(database.WriteQueueFullError):
+            writes.add_names("roster", ["late"], timeout=0.05)
+        assert time.monotonic() - started_at < 1
+        release.set()
+        assert first.result() is None
+        assert [future.result() for future in queued] == [1, 1]
+        waiter.join()
+        assert waiting[0].result() == 1
+
+
+def test_write_behind_close_while_submitting(db: Path) -> None:
+    writes = database.WriteBehindQueue(group_size=4)
+    futures = []
+
+    def submit() -> None:
+        for _ in range(200):
+            try:
+                futures.append(writes.submit(lambda batch: None))
+            except RuntimeError:
+                return
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    writes.close()
+    for thread in threads:
+        thread.join()
+    # Every write that was accepted ran, so none of these wait forever
+    assert all(future.result(timeout=5) is None for future in futures)
+
+
+# Picks through a WriteBehindQueue, prints the names whose picks are
+# committed, and exits without committing the rest
+crashing_writer = """
+import os, sys
+from namepicker import database
+
+database.initialize_database(sys.argv[1])
+database.bulk_import("roster", [f"name{i}" for i in range(500)])
+writes = database.WriteBehindQueue(group_size=16)
+picks = [writes.pick("roster") for _ in range(400)]
+for future in picks[:100]:
+    print(future.result(), flush=True)
+os._exit(1)
+"""
+
+
+def test_write_behind_crash(tmp_path: Path) -> None:
+    path = tmp_path / "crash.sqlitedb"
+    output = subprocess.run(
+        [sys.executable, "-c", crashing_writer, str(path)],
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 1, output.stderr
+    committed = output.stdout.split()
+    assert len(committed) == 100
+
+    connection = sqlite3.connect(str(path))
+    assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    picked = [
+        value
+        for (value,) in connection.execute(
+            'SELECT "Name"."value" FROM "Pick" '
+            'JOIN "Name" ON "Name"."id" = "Pick"."name"'
+        )
+    ]
+    assert set(committed) <= set(picked)
+    assert len(set(picked)) == len(picked)
+    (slots,) = connection.execute('SELECT COUNT(*) FROM "PickSlot"').fetchone()
+    assert slots + len(picked) == 500
+
+
+def weight_trees() -> Dict[str, Dict[int, float]]:
+    """
+    Every node's total in each PickWeight tree
+    """
+    with orm.db_session():
+        trees: Dict[str, Dict[int, float]] = dict()
+        for node in database.PickWeight.select():
+            trees.setdefault(node.mode, dict())[node.position] = node.total
+        return trees
+
+
+def test_weighted_pick(db: Path) -> None:
+    database.bulk_import("roster", ["heavy", "light", "none"])
+    database.set_weight("roster", "heavy", 9.0)
+    database.set_weight("roster", "none", 0.0)
+    rng = Random(1)
+    picked = Counter(database.weighted_pick("roster", rng=rng) for _ in range(1000))
+    assert picked["none"] == 0
+    assert 850 < picked["heavy"] < 950
+    # Weighted picks don't use up names
+    assert database.reset_picks("roster") == 3
+
+    # Changing a weight updates the tree in place, to what building it gives
+    database.set_weight("roster", "light", 4.0)
+    updated = weight_trees()
+    with orm.db_session():
+        database.PickWeight.select().delete(bulk=True)
+    database.weighted_pick("roster", rng=rng)
+    assert weight_trees() == updated
+
+    with pytest.raises(database.NameNotFoundError):
+        database.set_weight("roster", "missing", 1.0)
+    with pytest.raises(ValueError):
+        database.set_weight("roster", "light", -1.0)
+
+
+def test_fair_pick_long_run(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    rng = Random(1)
+    # Enough for weights halved at every pick to underflow
+    picked = Counter(
+        database.weighted_pick("roster", mode="fair", rng=rng) for _ in range(2500)
+    )
+    assert max(picked.values()) - min(picked.values()) <= 2
+    # The tree is built again from the pick counts before its weights get small;
+    # position 2 totals both
+    assert weight_trees()["fair"][2] >= database.fair_rebuild_below
+
+
+def test_fair_pick(db: Path) -> None:
+    names = [f"name{i}" for i in range(20)]
+    database.bulk_import("roster", names)
+    rng = Random(1)
+    picked = Counter(
+        database.weighted_pick("roster", mode="fair", rng=rng) for _ in range(200)
+    )
+    # Names that come up lose half their weight each time
+    assert set(picked) == set(names)
+    assert max(picked.values()) - min(picked.values()) <= 6
+
+    # Plain picks count too
+    before = weight_trees()["fair"]
+    database.pick("roster", rng=rng)
+    assert sum(weight_trees()["fair"].values()) < sum(before.values())
+
+    # Adding names rebuilds the trees
+    database.bulk_import("roster", ["late"])
+    assert weight_trees() == dict()
+    assert database.weighted_pick("roster", mode="fair", rng=rng)
+    assert len(weight_trees()["fair"]) == 21
+
+    # A sync that changes nothing keeps them
+    trees = weight_trees()
+    database.sync_import("roster", names + ["late"])
+    assert weight_trees() == trees
+
+    database.sync_import("roster", ["only"])
+    assert weight_trees() == dict()
+    assert database.weighted_pick("roster", mode="fair") == "only"
+
+
+def test_sync_import(db: Path) -> None:
+    database.bulk_import("roster", [f"name{i}" for i in range(20)])
+    # A name shared with another list stays in the database
+    database.bulk_import("other", ["name3"])
+    rng = Random(3)
+    picked = {database.pick("roster", rng=rng) for _ in range(5)}
+    in_roster = lambda data: data.list.title == "roster"  # noqa: E731
+    with orm.db_session():
+        added_before = {
+            data.name.value: data.date_added
+            for data in database.NameData.select(in_roster)
+        }
+
+    lines = [f"name{i}\n" for i in range(20) if i not in (3, 7, 8, 19)]
+    stats = database.sync_import("roster", lines + ["new\n", "new\n", "\n"])
+    assert (stats.lines, stats.names_added, stats.names_removed) == (19, 1, 4)
+
+    expected = {line.strip() for line in lines} | {"new"}
+    assert set(database.iter_list_names(database.select_list("roster"))) == expected
+    with orm.db_session():
+        for data in database.NameData.select(in_roster):
+            if data.name.value != "new":
+                assert data.date_added == added_before[data.name.value]
+        slots = orm.select(
+            slot.slot for slot in database.PickSlot if slot.list.title == "roster"
+        )
+        assert sorted(slots) == list(range(len(slots)))
+        slots = orm.select(
+            (slot.slot, slot.name.value)
+            for slot in database.ListSlot
+            if slot.list.title == "roster"
+        )
+        assert sorted(slot for slot, _ in slots) == list(range(len(expected)))
+        assert {value for _, value in slots} == expected
+        assert orm.exists(name for name in database.Name if name.value == "name3")
+        # Not in any list, and never picked
+        unpicked = {"name7", "name8", "name19"} - picked
+        assert not orm.exists(
+            name for name in database.Name if name.value in unpicked
+        )
+
+    remaining = []
+    while True:
+        try:
+            remaining.append(database.pick("roster", rng=rng))
+        except database.NoNamesLeftError:
+            break
+    assert sorted(remaining) == sorted(expected - picked)
+
+    stats = database.sync_import("roster", lines + ["new"])
+    assert (stats.names_added, stats.names_removed) == (0, 0)
+
+
+def test_pick_from_missing_list(db: Path) -> None:
+    with pytest.raises(database.ListNotFoundError):
+        database.pick("missing")
+
+
+def test_concurrent_picks(db: Path) -> None:
+    names = [f"name{i}" for i in range(200)]
+    database.bulk_import("roster", names)
+
+    def picker() -> List[str]:
+        picked = []
+        while True:
+            try:
+                picked.append(database.pick("roster"))
+            except database.NoNamesLeftError:
+                return picked
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: picker(), range(4)))
+    assert sorted(chain.from_iterable(results)) == sorted(names)
+
+
+def test_hot_queries_use_indexes(db: Path) -> None:
+    with orm.db_session():
+        connection = database.db.get_connection()
+        connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_staging "
+            "(value TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        for name, query in database.hot_queries.items():
+            parameters = [1] * query.count("?")
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {query}", parameters)
+            for row in plan:
+                detail = row[-1]
+                # Each row of the staging table, and of JSON arrays passed as
+                # parameters, is meant to be read
+                meant = "import_staging" in detail or "json_each" in detail
+                if detail.startswith("SCAN") and not meant:
+                    pytest.fail(f"'{name}' scans a whole table: {detail}\n{query}")
+        connection.execute("DROP TABLE import_staging")
+
+
+def test_migrate() -> None:
+    connection = sqlite3.connect(":memory:")
+    connection.execute('CREATE TABLE "NameData" ("name", "list", "date_added")')
+    connection.execute('CREATE TABLE "Pick" ("name", "list", "date_picked")')
+    connection.execute('CREATE TABLE "PickSlot" ("list", "slot", "name")')
+    connection.execute('CREATE TABLE "ListSlot" ("list", "slot", "name")')
+    connection.execute('CREATE TABLE "Name_NameList" ("name", "namelist")')
+    connection.execute(
+        'INSERT INTO "Name_NameList" VALUES (1, 1), (2, 1), (3, 1), (3, 2)'
+    )
+    connection.execute('INSERT INTO "Pick" VALUES (2, 1, 0)')
+    assert database.migrate(connection) == len(database.migrations)
+    assert database.schema_version(connection) == len(database.migrations)
+    indexes = {
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert {"idx_namedata__list_name", "idx_pick__list_name"} <= indexes
+    assert "idx_namedata__list_date_added" not in indexes
+    columns = [row[1] for row in connection.execute('PRAGMA table_info("NameData")')]
+    assert "weight" in columns
+    # The names that haven't been picked, in slots numbered from 0
+    slots = connection.execute(
+        'SELECT "list", "slot", "name" FROM "PickSlot" ORDER BY "list", "slot"'
+    )
+    assert slots.fetchall() == [(1, 0, 1), (1, 1, 3), (2, 0, 3)]
+    slots = connection.execute(
+        'SELECT "list", "slot", "name" FROM "ListSlot" ORDER BY "list", "slot"'
+    )
+    assert slots.fetchall() == [(1, 0, 1), (1, 1, 2), (1, 2, 3), (2, 0, 3)]
+    # Nothing left to do
+    assert database.migrate(connection) == len(database.migrations)
+
+
+# The tables of a database made before picks were recorded
+baseline_schema = """
+CREATE TABLE "Name" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "value" TEXT UNIQUE NOT NULL
+);
+CREATE TABLE "NameList" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "title" TEXT UNIQUE NOT NULL
+);
+CREATE TABLE "NameData" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "name" INTEGER NOT NULL REFERENCES "Name" ("id") ON DELETE CASCADE,
+  "list" INTEGER NOT NULL REFERENCES "NameList" ("id") ON DELETE CASCADE,
+  "date_added" DATETIME NOT NULL
+);
+CREATE INDEX "idx_namedata__list" ON "NameData" ("list");
+CREATE INDEX "idx_namedata__name" ON "NameData" ("name");
+CREATE TABLE "Name_NameList" (
+  "name" INTEGER NOT NULL REFERENCES "Name" ("id") ON DELETE CASCADE,
+  "namelist" INTEGER NOT NULL REFERENCES "NameList" ("id") ON DELETE CASCADE,
+  PRIMARY KEY ("name", "namelist")
+);
+CREATE INDEX "idx_name_namelist" ON "Name_NameList" ("namelist");
+INSERT INTO "Name" ("value") VALUES ('ann'), ('bob'), ('cat');
+INSERT INTO "NameList" ("title") VALUES ('team'), ('solo');
+INSERT INTO "Name_NameList" ("name", "namelist") VALUES (1, 1), (2, 1), (3, 2);
+"""
+
+upgrading_picker = """
+import sys
+from namepicker import database
+
+database.initialize_database(sys.argv[1])
+print(sorted([database.pick("team"), database.pick("team")]))
+print(database.pick("solo"))
+"""
+
+
+def test_upgrade_from_baseline(tmp_path: Path) -> None:
+    path = tmp_path / "baseline.sqlitedb"
+    connection = sqlite3.connect(str(path))
+    connection.executescript(baseline_schema)
+    connection.close()
+    output = subprocess.run(
+        [sys.executable, "-c", upgrading_picker, str(path)],
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 0, output.stderr
+    assert output.stdout.split("\n") == ["['ann', 'bob']", "cat", ""]
+
+
+def test_apply_connection_profile(tmp_path: Path) -> None:
+    connection = sqlite3.connect(str(tmp_path / "tuned.sqlitedb"))
+    database.apply_connection_profile(connection, database.connection_profiles["fast"])
+    pragma = lambda name: connection.execute(f"PRAGMA {name}").fetchone()[0]
+    assert pragma("journal_mode") == "wal"
+    # NORMAL
+    assert pragma("synchronous") == 1
+    assert pragma("cache_size") == -64_000
+    # MEMORY
+    assert pragma("temp_store") == 2
+    assert pragma("busy_timeout") == 10_000
+
+
+def test_iter_names(db: Path) -> None:
+    database.bulk_import("one", ["alice", "bob"])
+    database.bulk_import("two", ["bob", "carol"])
+    assert list(database.iter_names(page_size=2)) == ["alice", "bob", "carol"]
+
+
+def test_search_names(db: Path) -> None:
+    database.bulk_import("one", ["Annabel", "Hannah", "Joanna", "Bob"])
+    database.bulk_import("two", ["Anne", "Annie"])
+
+    def names(query: str, **kwargs) -> List[str]:
+        return [result.name for result in database.search_names(query, **kwargs)]
+
+    assert database.search_available
+    assert sorted(names("anna")) == ["Annabel", "Hannah", "Joanna"]
+    assert names("Ann", mode="prefix") == ["Anne", "Annie", "Annabel"]
+    assert names("ann", mode="prefix", list_title="one") == ["Annabel"]
+    # Too short for the trigram index, so in alphabetical order
+    assert names("b", mode="prefix") == ["Bob"]
+    assert names("aN", mode="prefix") == ["Annabel", "Anne", "Annie"]
+    assert names("nn") == ["Annabel", "Anne", "Annie", "Hannah", "Joanna"]
+    assert names("Hanah", mode="fuzzy")[0] == "Hannah"
+    assert names('"', mode="fuzzy") == []
+
+    for query, mode in [("ann", "substring"), ("nn", "fuzzy"), ("an", "prefix")]:
+        everything = names(query, mode=mode, limit=10)
+        first = names(query, mode=mode, limit=2)
+        second = names(query, mode=mode, limit=2, after=first[-1])
+        assert first + second == everything[:4]
+
+    with pytest.raises(database.ListNotFoundError):
+        database.search_names("ann", list_title="three")
+
+
+def test_prefix_ranges() -> None:
+    assert database.capitalizations("a1") == ["A1", "a1"]
+    # "ß".upper() is "SS", which isn't a capitalization of one letter
+    assert database.capitalizations("ß") == ["ß"]
+    assert database.prefix_end("ab") == "ac"
+    assert database.prefix_end("a\ud7ff") == "a\ue000"
+    assert database.prefix_end("a\U0010ffff") == "b"
+    assert database.prefix_end("") is None
+
+
+def test_search_index_follows_name_table(db: Path) -> None:
+    database.bulk_import("one", ["Quentin"])
+    with orm.db_session():
+        connection = database.db.get_connection()
+        connection.execute(
+            'UPDATE "Name" SET "value" = \'Quincy\' WHERE "value" = \'Quentin\''
+        )
+    assert [result.name for result in database.search_names("uinc")] == ["Quincy"]
+    assert database.search_names("ntin") == []
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+from pony import orm
+
+from namepicker import database, database_interface
+from namepicker.database_interface import FileError, NameList, import_file
+
+
+def test_import_file(db: Path, tmp_path: Path) -> None:
+    roster = tmp_path / "roster.txt"
+    roster.write_text("alice\nbob\nalice\n")
+    stats = import_file(roster)
+    assert stats.list_title == "roster.txt"
+    assert stats.names_added == 2
+    with orm.db_session():
+        assert database.NameList.get(title="roster.txt").names.count() == 2
+
+
+def test_import_missing_file(tmp_path: Path) -> None:
+    with pytest.raises(FileError):
+        import_file(tmp_path / "missing.txt")
+
+
+def test_name_list_mapping(db: Path) -> None:
+    database.bulk_import("b-list", ["carol", "alice"])
+    database.bulk_import("a-list", ["bob"])
+    lists = NameList(cache_size=1)
+
+    assert len(lists) == 2
+    assert list(lists) == ["a-list", "b-list"]
+    assert "a-list" in lists
+    assert "missing" not in lists
+    assert 1 not in lists
+    assert lists.get("missing") is None
+    with pytest.raises(KeyError):
+        lists["missing"]
+
+    b_list = lists["b-list"]
+    assert b_list.title == "b-list"
+    assert sorted(b_list) == ["alice", "carol"]
+    assert len(b_list) == 2
+    assert "alice" in b_list
+    assert "bob" not in b_list
+    assert {title: sorted(names) for title, names in lists.items()} == {
+        "a-list": ["bob"],
+        "b-list": ["alice", "carol"],
+    }
+
+    # Writes are seen by lists that are already cached
+    database.bulk_import("b-list", ["dave"])
+    assert len(b_list) == 3
+    assert lists == NameList()
+    database.bulk_import("c-list", ["erin"])
+    assert lists != {title: lists[title] for title in ["a-list", "b-list"]}
+
+    # A list removed after it was cached is gone from the cache too
+    assert lists["b-list"] == b_list
+    with orm.db_session():
+        database.NameList.get(title="b-list").delete()
+    assert "b-list" not in lists
+    database.bulk_import("b-list", ["frank"])
+    assert sorted(lists["b-list"]) == ["frank"]
+
+
+def test_name_list_cache(db: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    database.bulk_import("roster", ["alice"])
+    lookups = []
+    select_list = database_interface.select_list
+
+    def counted(title: str) -> int:
+        lookups.append(title)
+        return select_list(title)
+
+    monkeypatch.setattr(database_interface, "select_list", counted)
+    lists = NameList()
+    roster = lists["roster"]
+    assert lists["roster"] is roster and "roster" in lists
+    assert lookups == ["roster"]
+    # Looked up again once the list has changed
+    database.sync_import("roster", ["bob"])
+    assert lists["roster"] is roster
+    assert lookups == ["roster", "roster"]
+    database.bulk_import("roster", ["carol"])
+    assert lists["roster"] is roster and lists["roster"] is roster
+    assert lookups == ["roster"] * 3
+
+
+def test_list_names_pages(db: Path) -> None:
+    names = [f"name{i:03}" for i in range(25)]
+    database.bulk_import("roster", names)
+    list_id = database.select_list("roster")
+    assert list(database.iter_list_names(list_id, page_size=4)) == names
+    assert list(database.iter_list_titles(page_size=1)) == ["roster"]
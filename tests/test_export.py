@@ -0,0 +1,102 @@
+import csv
+import json
+import sqlite3
+import threading
+from itertools import count, islice
+from pathlib import Path
+from typing import Iterator, Tuple
+
+import pytest
+
+from namepicker import database, export
+
+
+def test_export_list(db: Path, tmp_path: Path) -> None:
+    names = ["alice", "Zoë", 'O"Brien, Jr', "bob"]
+    database.bulk_import("roster", names)
+
+    stats = export.export_list("roster", tmp_path / "roster.txt", chunk_size=3)
+    assert (stats.format, stats.rows) == ("text", 4)
+    assert sorted((tmp_path / "roster.txt").read_text().splitlines()) == sorted(names)
+
+    export.export_list("roster", tmp_path / "roster.csv", chunk_size=3)
+    with (tmp_path / "roster.csv").open(newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert sorted(row["name"] for row in rows) == sorted(names)
+
+    export.export_list("roster", tmp_path / "roster.out", format="jsonl")
+    lines = (tmp_path / "roster.out").read_text().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert sorted(row["name"] for row in rows) == sorted(names)
+    assert len({row["date_added"] for row in rows}) == 1
+
+    with pytest.raises(database.ListNotFoundError):
+        export.export_list("missing", tmp_path / "missing.txt")
+    assert not (tmp_path / "missing.txt").exists()
+
+
+def test_export_list_while_list_changes(
+    db: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    iter_list_name_data_in = database.iter_list_name_data_in
+    writer = threading.Thread(target=database.bulk_import, args=("roster", ["carol"]))
+
+    def changing(
+        connection: sqlite3.Connection, list_id: int, page_size: int
+    ) -> Iterator[Tuple[str, str]]:
+        # Adds a name from another thread after the list has been looked up
+        writer.start()
+        writer.join(timeout=0.2)
+        yield from iter_list_name_data_in(connection, list_id, page_size)
+
+    monkeypatch.setattr(database, "iter_list_name_data_in", changing)
+    stats = export.export_list("roster", tmp_path / "roster.txt")
+    writer.join()
+    assert stats.rows == 2
+    assert sorted((tmp_path / "roster.txt").read_text().splitlines()) == [
+        "alice",
+        "bob",
+    ]
+
+
+def test_export_names(tmp_path: Path) -> None:
+    names = (f"name{number}" for number in count())
+    path = tmp_path / "names.jsonl"
+    stats = export.export_names(islice(names, 10), path, chunk_size=4)
+    assert stats.rows == 10
+    assert json.loads(path.read_text().splitlines()[-1]) == {"name": "name9"}
+
+    def failing():
+        yield "first"
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        export.export_names(failing(), path, chunk_size=1)
+    # The earlier export is left alone
+    assert len(path.read_text().splitlines()) == 10
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_export_format() -> None:
+    assert export.export_format("names.PARQUET") == "parquet"
+    assert export.export_format("names.unknown") == "text"
+    assert export.export_format(None, "csv") == "csv"
+    with pytest.raises(ValueError):
+        export.export_format("names.txt", "xml")
+
+
+def test_export_columnar(db: Path, tmp_path: Path) -> None:
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    database.bulk_import("roster", ["alice", "bob", "carol"])
+    export.export_list("roster", tmp_path / "roster.parquet", chunk_size=2)
+    table = pyarrow.parquet.read_table(tmp_path / "roster.parquet")
+    assert sorted(table.column("name").to_pylist()) == ["alice", "bob", "carol"]
+    assert table.schema.field("date_added").type == pyarrow.timestamp("us", tz="UTC")
+
+    export.export_names(["dave", "erin"], tmp_path / "names.arrow")
+    table = pyarrow.ipc.open_file(tmp_path / "names.arrow").read_all()
+    assert table.column("name").to_pylist() == ["dave", "erin"]
@@ -0,0 +1,256 @@
+import os
+from collections import Counter
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from random import Random
+from typing import Callable
+
+import pytest
+
+from namepicker import generate
+
+
+def test_letter_sampler_distribution() -> None:
+    weights = {"a": 0.5, "b": 0.3, "c": 0.2, "d": 0.0}
+    sampler = generate.LetterSampler(weights, rng=Random(1))
+    draws = 100_000
+    counts = Counter(sampler.letters_of(draws))
+    assert counts["d"] == 0
+    for letter, weight in weights.items():
+        assert counts[letter] / draws == pytest.approx(weight, abs=0.01)
+
+
+def test_letter_sampler_rejects_bad_weights() -> None:
+    with pytest.raises(ValueError):
+        generate.LetterSampler({})
+    with pytest.raises(ValueError):
+        generate.LetterSampler({"a": 0.0})
+    with pytest.raises(ValueError):
+        generate.LetterSampler({"a": 1.0, "b": -1.0})
+
+
+def test_rand_list() -> None:
+    names = generate.rand_list(
+        count=50, min_length=2, max_length=4, weights=generate.default_weights
+    )
+    assert len(names) == 50
+    assert all(2 <= len(name) <= 4 for name in names)
+    assert all(name == name.capitalize() for name in names)
+
+
+def test_rand_list_python_engine() -> None:
+    names = generate.rand_list(
+        count=10, min_length=3, max_length=3, weights={"a": 1.0}, engine="python"
+    )
+    assert names == ["Aaa"] * 10
+
+
+training_names = ["anna", "annabel", "bella", "ella", "stella", "bob"]
+
+
+def test_ngram_model_follows_training_data() -> None:
+    model = generate.NgramModel.train(training_names, order=2)
+    model.random = Random(1).random
+    pairs = {name[i : i + 2] for name in training_names for i in range(len(name) - 1)}
+    for _ in range(200):
+        name = model.name(min_length=3, max_length=6).lower()
+        assert 3 <= len(name) <= 6
+        assert name[0] in {name[0] for name in training_names}
+        assert all(name[i : i + 2] in pairs for i in range(len(name) - 1))
+
+
+def test_ngram_model_round_trip(tmp_path: Path) -> None:
+    model = generate.NgramModel.train(training_names, order=3)
+    model.save(tmp_path / "model.bin")
+    loaded = generate.NgramModel.load(tmp_path / "model.bin")
+    assert loaded.order == 3
+    assert loaded.to_bytes() == model.to_bytes()
+    model.random = Random(2).random
+    loaded.random = Random(2).random
+    assert [model.name(3, 8) for _ in range(50)] == [
+        loaded.name(3, 8) for _ in range(50)
+    ]
+
+    with pytest.raises(ValueError):
+        generate.NgramModel.from_bytes(b"not a model")
+
+
+def test_rand_names_leaves_model_random() -> None:
+    model = generate.NgramModel.train(training_names, order=2)
+    own_random = model.random
+    draw = lambda: list(islice(generate.rand_names(weights=model, rng=Random(3)), 20))
+    assert draw() == draw()
+    assert model.random is own_random
+
+
+def test_rand_list_with_ngram_model() -> None:
+    model = generate.NgramModel.train(training_names, order=2)
+    names = generate.rand_list(count=20, min_length=2, max_length=5, weights=model)
+    assert len(names) == 20
+    assert all(2 <= len(name) <= 5 for name in names)
+
+
+def test_cached_letter_weights_and_model(tmp_path: Path) -> None:
+    census = tmp_path / "census.csv"
+    census.write_text("name,rank\nANNA,1\nBOB,2\n")
+    cache_dir = tmp_path / "cache"
+
+    weights = generate.letter_weights(census, cache_dir=cache_dir)
+    assert weights == pytest.approx({"a": 2 / 7, "n": 2 / 7, "b": 2 / 7, "o": 1 / 7})
+    assert (cache_dir / "letter_weights.bin").is_file()
+    assert generate.letter_weights(census, cache_dir=cache_dir) == weights
+
+    model = generate.ngram_model(2, census, cache_dir=cache_dir)
+    assert isinstance(model.tables["^"][1], memoryview)
+    assert model.name(3, 3).lower() in {"ann", "ana", "bob"}
+
+    # Touching the file without changing it keeps the cache
+    stamp = (cache_dir / "ngram2.bin").read_bytes()
+    os.utime(census, ns=(0, 0))
+    assert generate.ngram_model(2, census, cache_dir=cache_dir).order == 2
+    assert (cache_dir / "ngram2.bin").read_bytes() != stamp
+
+    census.write_text("name,rank\nCAROL,1\n")
+    assert set(generate.letter_weights(census, cache_dir=cache_dir)) == set("carol")
+    assert generate.ngram_model(2, census, cache_dir).name(5, 5) == "Carol"
+
+
+def test_bundled_ngram_model(tmp_path: Path) -> None:
+    census = tmp_path / "census.csv"
+    census.write_text("name,rank\nCAROL,1\n")
+    assert generate.bundled_ngram_model(9) is None
+
+    path = generate.bundle_ngram_model(9, tmp_path, census)
+    assert path == tmp_path / "ngram9.bin"
+    assert generate.bundled_ngram_model(9) is None
+
+    package_dir = Path(generate.__file__).parent
+    path = generate.bundle_ngram_model(9, package_dir, census)
+    try:
+        # Used when there's no census file to train on
+        model = generate.ngram_model(9, tmp_path / "missing.csv", cache_dir=None)
+        assert model.name(5, 5) == "Carol"
+    finally:
+        path.unlink()
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_parallel_rand_names_is_reproducible(engine: str) -> None:
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    run = lambda processes, seed: list(
+        generate.parallel_rand_names(
+            count=250,
+            min_length=2,
+            max_length=6,
+            weights=generate.default_weights,
+            seed=seed,
+            processes=processes,
+            chunk_size=40,
+            engine=engine,
+        )
+    )
+    names = run(1, 5)
+    assert len(names) == 250
+    assert all(2 <= len(name) <= 6 for name in names)
+    assert run(3, 5) == names
+    assert run(2, 6) != names
+
+    # Without a count, the same chunks come out, however many are read; the
+    # 'numpy' engine only gives the same names for the same chunk_size
+    endless = generate.parallel_rand_names(
+        count=None,
+        min_length=2,
+        max_length=6,
+        weights=generate.default_weights,
+        seed=5,
+        processes=3,
+        chunk_size=40,
+        engine=engine,
+    )
+    assert list(islice(endless, 240)) == names[:240]
+    endless.close()
+
+
+def test_parallel_rand_names_with_ngram_model() -> None:
+    model = generate.NgramModel.train(training_names, order=2)
+    names = list(
+        generate.parallel_rand_names(
+            count=30, min_length=2, max_length=5, weights=model, seed=1, processes=2
+        )
+    )
+    assert len(names) == 30
+    assert names == list(
+        generate.parallel_rand_names(
+            count=30, min_length=2, max_length=5, weights=model, seed=1, processes=1
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "make_set",
+    [generate.PackedNameSet, lambda: generate.BloomFilter(capacity=5000)],
+)
+def test_name_sets(make_set: Callable[[], generate.NameSet]) -> None:
+    seen = make_set()
+    names = [f"name{i}" for i in range(5000)]
+    assert all(seen.add(name) for name in names)
+    assert len(seen) == 5000
+    assert not any(seen.add(name) for name in names)
+    assert all(name in seen for name in names)
+    assert "Ünicode" not in seen
+    assert seen.add("Ünicode")
+    assert "Ünicode" in seen
+
+
+def test_rand_list_unique() -> None:
+    weights = {"a": 1.0, "b": 1.0}
+    for engine in ["python", "numpy"] if generate.has_numpy else ["python"]:
+        names = generate.rand_list(
+            count=14,
+            min_length=1,
+            max_length=3,
+            weights=weights,
+            engine=engine,
+            unique=True,
+        )
+        # Every name of 1 to 3 letters
+        assert len(set(names)) == len(names) == 14
+
+        only_b = partial(
+            generate.rand_list,
+            min_length=1,
+            max_length=1,
+            weights=weights,
+            engine=engine,
+            unique=True,
+            exclude=["A"],
+        )
+        assert only_b(count=1) == ["B"]
+        with pytest.raises(ValueError):
+            only_b(count=2)
+
+
+def test_find_unique_prefixes() -> None:
+    options = ["yes", "no", "yesterday", "nope", "maybe"]
+    assert generate.find_unique_prefixes(options) == {
+        "yes": "yes",
+        "no": "no",
+        "yesterday": "yest",
+        "nope": "nop",
+        "maybe": "m",
+    }
+    with pytest.raises(ValueError):
+        generate.find_unique_prefixes(["a", "b", "a"])
+
+
+def test_prefix_index_find() -> None:
+    index = generate.PrefixIndex(["yes", "yesterday", "no"])
+    assert index.find("n") == "no"
+    assert index.find("yes") == "yes"
+    assert index.find("yest") == "yesterday"
+    assert index.find("ye") is None
+    assert index.count("ye") == 2
+    assert index.find("x") is None
+    assert index.count("x") == 0
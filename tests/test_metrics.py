@@ -0,0 +1,73 @@
+import cProfile
+from pathlib import Path
+
+from namepicker import database
+from namepicker.metrics import Metrics, metrics, write_folded_stacks
+
+
+def test_counters_and_histograms() -> None:
+    registry = Metrics()
+    registry.describe("requests_total", "Requests answered")
+    registry.increment("requests_total", route="/pick")
+    registry.increment("requests_total", 2, route="/pick")
+    registry.increment("requests_total", route='say "hi"')
+    for seconds in (0.000_01, 0.003, 0.003, 20.0):
+        registry.observe("latency_seconds", seconds)
+
+    snapshot = registry.snapshot()
+    assert [counter["value"] for counter in snapshot["counters"]] == [3, 1]
+    (histogram,) = snapshot["histograms"]
+    assert histogram["count"] == 4
+    assert histogram["p50"] == 0.005
+    assert histogram["p99"] == float("inf")
+
+    text = registry.to_prometheus()
+    assert "# HELP requests_total Requests answered\n" in text
+    assert 'requests_total{route="/pick"} 3\n' in text
+    assert 'requests_total{route="say \\"hi\\""} 1\n' in text
+    assert 'latency_seconds_bucket{le="0.005"} 3\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4\n' in text
+    assert "latency_seconds_count 4\n" in text
+
+
+def test_database_metrics(db: Path) -> None:
+    metrics.reset()
+    database.bulk_import("roster", ["alice", "bob"])
+    database.pick("roster")
+
+    counters = {
+        counter["name"]: counter["value"] for counter in metrics.snapshot()["counters"]
+    }
+    assert counters == {
+        "import_lines_total": 2,
+        "names_imported_total": 2,
+        "picks_total": 1,
+    }
+    histograms = {
+        (histogram["name"], tuple(histogram["labels"].values())): histogram
+        for histogram in metrics.snapshot()["histograms"]
+    }
+    assert histograms["pick_seconds", ()]["count"] == 1
+    assert histograms["sql_seconds", ("pick_slots",)]["count"] == 1
+    # Counts Pony's statements as well as the named queries
+    assert histograms["db_session_statements", ("pick",)]["sum"] >= 5
+
+
+def test_write_folded_stacks(tmp_path: Path) -> None:
+    def inner() -> int:
+        return sum(range(200_000))
+
+    def outer() -> int:
+        return inner() + inner()
+
+    profile = cProfile.Profile()
+    profile.runcall(outer)
+    write_folded_stacks(profile, tmp_path / "profile.folded")
+
+    stacks = {}
+    for line in (tmp_path / "profile.folded").read_text().splitlines():
+        stack, _, microseconds = line.rpartition(" ")
+        stacks[stack] = int(microseconds)
+    assert any(
+        stack.startswith("outer (") and ";inner (" in stack for stack in stacks
+    )
@@ -1,5 +1,93 @@
+import subprocess
+import sys
+from pathlib import Path
+
 from namepicker import __version__
+from namepicker.namepicker import check_LogLevel
+
+# Generous, so slow CI machines pass; a regression that imports Pony or NumPy
+# for every command, or checks every table, costs far more than it allows for
+startup_budget_ms = 1_000
 
 
 def test_version():
     assert __version__ == '0.0.1'
+
+
+def test_log_levels_match_logging_module() -> None:
+    assert check_LogLevel()
+
+
+def test_cli_imports_lazily() -> None:
+    slow = ["asyncio", "numpy", "pony", "namepicker.database", "namepicker.generate"]
+    script = (
+        "import sys, namepicker.namepicker; "
+        f"print(','.join(m for m in {slow!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == ""
+
+
+def test_startup_time_budget(tmp_path: Path) -> None:
+    command = [
+        sys.executable,
+        "-m",
+        "namepicker.namepicker",
+        "--database",
+        str(tmp_path / "namepicker.sqlitedb"),
+        "--startup-profile",
+        "search",
+        "anything",
+    ]
+    # The first run creates the database
+    subprocess.run(command, capture_output=True, check=True)
+    output = subprocess.run(command, capture_output=True, text=True, check=True)
+    stages = {}
+    for line in output.stderr.splitlines():
+        milliseconds, _, stage = line.partition(" ms  ")
+        stages[stage.partition("  imported")[0]] = float(milliseconds)
+    assert "initialize database" in stages
+    assert stages["total"] < startup_budget_ms, output.stderr
+
+
+def test_read_only(tmp_path: Path) -> None:
+    names = tmp_path / "roster.txt"
+    names.write_text("alice\nbob\n")
+    command = [
+        sys.executable,
+        "-m",
+        "namepicker.namepicker",
+        "--database",
+        str(tmp_path / "namepicker.sqlitedb"),
+    ]
+    output = subprocess.run(
+        [*command, "--read-only", "export", "roster.txt"],
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 1
+    assert not (tmp_path / "namepicker.sqlitedb").exists()
+    output = subprocess.run(
+        [*command, "--read-only", "generate", "3", "--unique", "--exclude-database"],
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 1, output.stderr
+    assert not (tmp_path / "namepicker.sqlitedb").exists()
+
+    subprocess.run([*command, "--list", str(names)], capture_output=True, check=True)
+    output = subprocess.run(
+        [*command, "--read-only", "export", "roster.txt"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert output.stdout.split() == ["alice", "bob"]
+    for writer in (["pick", "roster.txt"], ["serve"]):
+        output = subprocess.run(
+            [*command, "--read-only", *writer], capture_output=True, text=True
+        )
+        assert output.returncode == 1
+        assert "--read-only" in output.stderr
@@ -0,0 +1,21 @@
+from collections import Counter
+
+import pytest
+
+from namepicker import numpy_engine
+
+
+def test_numpy_rand_list() -> None:
+    pytest.importorskip("numpy")
+    weights = {"a": 0.7, "b": 0.3}
+    names = numpy_engine.numpy_rand_list(
+        count=20_000, min_length=0, max_length=5, weights=weights, seed=1
+    )
+    assert len(names) == 20_000
+    assert {len(name) for name in names} == set(range(6))
+    assert all(name == name.capitalize() for name in names)
+    counts = Counter("".join(names).lower())
+    assert counts["a"] / sum(counts.values()) == pytest.approx(0.7, abs=0.01)
+    assert names == numpy_engine.numpy_rand_list(
+        count=20_000, min_length=0, max_length=5, weights=weights, seed=1
+    )
@@ -0,0 +1,67 @@
+from pathlib import Path
+from random import Random
+
+import pytest
+
+from namepicker import database
+from namepicker.replica import (
+    Replica,
+    ReplicaError,
+    current_replica,
+    publish_replica,
+)
+
+
+def test_live_replica(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    replica = Replica(db)
+    assert sorted(replica.names("roster")) == ["alice", "bob"]
+    before = replica.generation()
+    assert before == database.generation()
+
+    # Commits are seen straight away
+    database.pick("roster")
+    assert replica.generation() > before
+    assert replica.remaining("roster") == 1
+    with pytest.raises(database.ListNotFoundError):
+        replica.count("missing")
+    replica.close()
+
+
+def test_published_replica(db: Path, tmp_path: Path) -> None:
+    directory = tmp_path / "replicas"
+    with pytest.raises(ReplicaError):
+        Replica(directory)
+    database.bulk_import("roster", [f"name{i}" for i in range(20)])
+    first = publish_replica(db, directory)
+    assert first is not None
+    # Nothing has changed since
+    assert publish_replica(db, directory) is None
+
+    replica = Replica(directory, check_interval=0)
+    assert replica.count("roster") == 20
+    team = replica.draw("roster", 12, Random(1))
+    assert len(set(team)) == 12
+    with pytest.raises(database.NoNamesLeftError):
+        replica.draw("roster", 21)
+
+    database.pick("roster")
+    # The copy doesn't change until a new one is published
+    assert replica.remaining("roster") == 20
+    for _ in range(3):
+        database.pick("roster")
+        publish_replica(db, directory, keep=2)
+    assert replica.remaining("roster") == 16
+    assert replica.generation() == database.generation()
+    assert current_replica(directory) == (replica.generation(), replica_path(directory))
+    assert len(list(directory.glob("replica-*.sqlitedb"))) == 2
+    replica.close()
+
+
+def replica_path(directory: Path) -> Path:
+    (path,) = [
+        path
+        for path in directory.glob("replica-*.sqlitedb")
+        if path.name == (directory / "CURRENT").read_text().split()[1]
+    ]
+    return path
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pytest
+from pony import orm
+
+from namepicker import database
+from namepicker.server import NamepickerServer
+
+
+async def request(
+    port: int, requests: List[Tuple[str, str, bytes]]
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Sends every request over one keep-alive connection
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    responses = []
+    for method, target, body in requests:
+        writer.write(
+            f"{method} {target} HTTP/1.1\r\nHost: test\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.lower()] = value.strip()
+        payload = await reader.readexactly(int(headers["content-length"]))
+        responses.append((status, json.loads(payload)))
+    writer.close()
+    return responses
+
+
+def run_against_server(
+    requests: List[Tuple[str, str, bytes]], write_behind: bool = False
+) -> List[Tuple[int, Dict[str, Any]]]:
+    async def run() -> List[Tuple[int, Dict[str, Any]]]:
+        server = NamepickerServer(workers=2, write_behind=write_behind)
+        port = await server.start(port=0)
+        try:
+            return await request(port, requests)
+        finally:
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_pick_and_generate(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    responses = run_against_server(
+        [
+            ("GET", "/pick?list=roster", b""),
+            ("GET", "/pick?list=roster", b""),
+            ("GET", "/pick?list=roster", b""),
+            ("GET", "/pick?list=missing", b""),
+            ("GET", "/generate?count=5&min_length=2&max_length=3", b""),
+            ("GET", "/generate?count=lots", b""),
+            ("GET", "/nowhere", b""),
+            ("GET", "/metrics?format=json", b""),
+        ]
+    )
+    statuses = [status for status, _ in responses]
+    assert statuses == [200, 200, 409, 404, 200, 400, 404, 200]
+    assert {responses[0][1]["name"], responses[1][1]["name"]} == {"alice", "bob"}
+    names = responses[4][1]["names"]
+    assert len(names) == 5
+    assert all(2 <= len(name) <= 3 for name in names)
+    counters = {counter["name"] for counter in responses[7][1]["counters"]}
+    assert {"picks_total", "names_generated_total"} <= counters
+
+
+def test_batch(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob", "carol"])
+    operations = [{"pick": "roster"}, {"pick": "roster"}, {"generate": 3}]
+    (status, payload), (bad_status, _) = run_against_server(
+        [
+            ("POST", "/batch", json.dumps(operations).encode("utf-8")),
+            ("POST", "/batch", b'[{"frobnicate": 1}]'),
+        ]
+    )
+    assert status == 200
+    first, second, generated = payload["results"]
+    assert first != second
+    assert len(generated) == 3
+    assert bad_status == 400
+
+    # A batch that fails picks nothing
+    statuses = [
+        status
+        for status, _ in run_against_server(
+            [
+                ("POST", "/batch", b'[{"pick": "roster"}, {"pick": "missing"}]'),
+                ("POST", "/batch", b'[{"pick": "roster"}, {"pick": "roster"}]'),
+                ("POST", "/batch", b'[{"pick": "roster"}, {"generate": true}]'),
+            ]
+        )
+    ]
+    assert statuses == [404, 409, 400]
+    with orm.db_session():
+        assert orm.count(pick for pick in database.Pick) == 2
+
+
+def test_generate_doesnt_hold_up_picks(
+    db: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    database.bulk_import("roster", ["alice"])
+    release = threading.Event()
+
+    async def run() -> Tuple[int, Dict[str, Any]]:
+        server = NamepickerServer(workers=1)
+        generate = server.generate
+
+        def slow_generate(*args: Any, **kwargs: Any) -> List[str]:
+            release.wait()
+            return generate(*args, **kwargs)
+
+        monkeypatch.setattr(server, "generate", slow_generate)
+        port = await server.start(port=0)
+        try:
+            generating = asyncio.ensure_future(
+                request(port, [("GET", "/generate?count=5", b"")])
+            )
+            await asyncio.sleep(0.05)
+            # Answered while the generate request is still going
+            (picked,) = await asyncio.wait_for(
+                request(port, [("GET", "/pick?list=roster", b"")]), timeout=5
+            )
+            release.set()
+            await generating
+            return picked
+        finally:
+            release.set()
+            await server.close()
+
+    assert asyncio.run(run()) == (200, {"name": "alice"})
+
+
+def test_unread_body_closes_connection(db: Path) -> None:
+    database.bulk_import("roster", ["alice"])
+    smuggled = b"GET /pick?list=roster HTTP/1.1\r\nHost: test\r\n\r\n"
+
+    async def run(length: str) -> bytes:
+        server = NamepickerServer(workers=1)
+        port = await server.start(port=0)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                f"POST /batch HTTP/1.1\r\nHost: test\r\n"
+                f"Content-Length: {length}\r\n\r\n".encode("latin-1") + smuggled
+            )
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+            return response
+        finally:
+            await server.close()
+
+    for length in ["2000000", "-1", "lots"]:
+        response = asyncio.run(run(length))
+        # One error response, and then the connection is closed
+        assert response.count(b"HTTP/1.1 ") == 1
+        assert b"Connection: close" in response
+    with orm.db_session():
+        assert not orm.exists(pick for pick in database.Pick)
+
+
+def test_write_behind_picks(db: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    responses = run_against_server(
+        [
+            ("GET", "/pick?list=roster", b""),
+            ("POST", "/batch", b'[{"pick": "roster"}]'),
+            ("GET", "/pick?list=roster", b""),
+            ("GET", "/pick?list=missing", b""),
+        ],
+        write_behind=True,
+    )
+    assert [status for status, _ in responses] == [200, 200, 409, 404]
+    assert {responses[0][1]["name"], *responses[1][1]["results"]} == {"alice", "bob"}
@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from pathlib import Path
+from random import Random
+from typing import Iterator
+
+import pytest
+
+from namepicker import database
+from namepicker.snapshot import Snapshot, SnapshotError, export_snapshot
+
+
+def test_snapshot_round_trip(db: Path, tmp_path: Path) -> None:
+    names = ["alice", "Zoë", "", "李", "bob"]
+    database.bulk_import("roster", names)
+    path = export_snapshot("roster", tmp_path / "roster.snapshot")
+
+    with Snapshot(path) as snapshot:
+        assert snapshot.title == "roster"
+        # Blank lines aren't imported
+        assert sorted(snapshot) == sorted(["alice", "Zoë", "李", "bob"])
+        assert len(snapshot) == 4
+        assert snapshot[-1] == list(snapshot)[3]
+        with pytest.raises(IndexError):
+            snapshot[4]
+        assert snapshot.pick(Random(1)) in snapshot
+        assert sorted(snapshot.sample(4, Random(2))) == sorted(snapshot)
+        with pytest.raises(ValueError):
+            snapshot.sample(5)
+        assert snapshot.is_current()
+
+    database.bulk_import("roster", ["carol"])
+    with Snapshot(path) as snapshot:
+        assert not snapshot.is_current()
+
+
+def test_snapshot_while_list_changes(
+    db: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    iter_list_names_in = database.iter_list_names_in
+    writer = threading.Thread(target=database.bulk_import, args=("roster", ["carol"]))
+
+    def changing(connection: sqlite3.Connection, list_id: int) -> Iterator[str]:
+        # Adds a name from another thread after the metadata has been read
+        writer.start()
+        writer.join(timeout=0.2)
+        yield from iter_list_names_in(connection, list_id)
+
+    monkeypatch.setattr(database, "iter_list_names_in", changing)
+    path = export_snapshot("roster", tmp_path / "roster.snapshot")
+    writer.join()
+    with Snapshot(path) as snapshot:
+        assert sorted(snapshot) == ["alice", "bob"]
+        assert snapshot.metadata["count"] == 2
+        assert not snapshot.is_current()
+
+
+def test_empty_snapshot(db: Path, tmp_path: Path) -> None:
+    database.bulk_import("empty", [])
+    with Snapshot(export_snapshot("empty", tmp_path / "empty.snapshot")) as snapshot:
+        assert len(snapshot) == 0
+        with pytest.raises(IndexError):
+            snapshot.pick()
+
+
+def test_corrupt_snapshots(db: Path, tmp_path: Path) -> None:
+    database.bulk_import("roster", ["alice", "bob"])
+    path = export_snapshot("roster", tmp_path / "roster.snapshot")
+    data = bytearray(path.read_bytes())
+
+    data[-12] ^= 0xFF
+    path.write_bytes(data)
+    with pytest.raises(SnapshotError, match="checksum"):
+        Snapshot(path)
+    # Not checked without verify
+    Snapshot(path, verify=False).close()
+
+    path.write_bytes(data[:-1])
+    with pytest.raises(SnapshotError, match="corrupt"):
+        Snapshot(path)
+    path.write_bytes(b"")
+    with pytest.raises(SnapshotError, match="empty"):
+        Snapshot(path)
+    path.write_bytes(b"name\n" * 20)
+    with pytest.raises(SnapshotError, match="not a snapshot"):
+        Snapshot(path)